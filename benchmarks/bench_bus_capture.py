@@ -0,0 +1,108 @@
+"""
+Bus capture cost and replay: the time and allocation of capturing a chunk against the trace buffer,
+and on CPython the slave turnaround on the simulated bus with and without capture, then a noisy capture
+replayed with tools/bus_replay.py, its decode throughput, error classes and response differences.
+"""
+from bench_util import timeit, report, alloc_per_call, percentiles
+from sys import implementation
+
+MICROPYTHON = implementation.name == 'micropython'
+if not MICROPYTHON:
+    import sim
+    sim.install()
+
+from bus_capture import BusCapture, CAP_RX  # noqa: E402
+from modbus_frame import ModbusFrame  # noqa: E402
+from tracing import Trace, EV_RX  # noqa: E402
+
+ROUNDS = 2000
+CHUNK = bytes(ModbusFrame.read_holding_registers(1, 0, 10).to_bytes())
+
+
+def captured(capture):
+    for _ in range(ROUNDS):
+        capture.record(0, CAP_RX, CHUNK, len(CHUNK))
+        if capture.full >= 0:
+            capture.full = -1  # Written out by runloop() on the device, not timed here
+
+
+def traced(trace):
+    for _ in range(ROUNDS):
+        trace.record(EV_RX, len(CHUNK), 0, CHUNK)
+
+
+def record_once(capture):
+    capture.record(0, CAP_RX, CHUNK, len(CHUNK))
+    capture.full = -1
+
+
+async def traffic(path, baudrate=115200, transactions=300, noise_rate=0.0):
+    """ Polls reads and writes from a master, returns the slave turnarounds """
+    from uasyncio import create_task, sleep_ms
+    from modbus_master import ModbusRTUMaster
+    from modbus_rtu import ModbusRTUClient
+
+    bus = sim.RS485Bus(baudrate, noise_rate=noise_rate)
+    bus.attach(0, de_pin=11)
+    bus.attach(1, de_pin=21)
+    client = ModbusRTUClient(1, 12, 13, 11, uart=0, baudrate=baudrate, capture=path)
+    master = ModbusRTUMaster(22, 23, 21, uart=1, baudrate=baudrate, timeout_ms=20)
+    task = create_task(client.runloop())
+    await sleep_ms(10)
+    for n in range(transactions):
+        if n % 10 == 0:
+            request = ModbusFrame.write_single_register(1, n, n)
+        elif n % 25 == 1:
+            request = ModbusFrame.read_holding_registers(1, 20000, 2)  # Illegal data address
+        else:
+            request = ModbusFrame.read_holding_registers(1, 0, 20)
+        try:
+            await master.transact(request.to_bytes())
+        except Exception:
+            pass  # Timeouts and damaged responses, with noise
+    task.cancel()
+    client.serial.task.cancel()
+    master.serial.task.cancel()
+    await sleep_ms(5)
+    return bus.turnarounds[0]
+
+
+def main():
+    path = 'bench_capture.bin'
+    capture = BusCapture(path, 115200)
+    _, elapsed = timeit(captured, capture)
+    report("capture record", ROUNDS, elapsed, "chunks")
+    print("%32.1f bytes allocated/chunk" % alloc_per_call(record_once, capture))
+    trace = Trace(enabled=True)
+    _, elapsed = timeit(traced, trace)
+    report("trace record", ROUNDS, elapsed, "chunks")
+    print("%32.1f bytes allocated/chunk" % alloc_per_call(trace.record, EV_RX, len(CHUNK), 0, CHUNK))
+
+    if MICROPYTHON:
+        return  # The simulated bus and the replay tool need CPython
+    import tempfile
+    from os import path as ospath, remove
+    remove(path)
+    from uasyncio import run
+    from tools.bus_replay import Capture, report as replay_report
+
+    directory = tempfile.mkdtemp()
+    for name, capture_path in (("no capture", None), ("capture", ospath.join(directory, 'clean.bin'))):
+        turnarounds = run(traffic(capture_path))
+        print("%-28s turnaround p50/p90/p99: %d/%d/%d us" % (name, *percentiles(turnarounds)))
+
+    noisy = ospath.join(directory, 'noisy.bin')
+    run(traffic(noisy, noise_rate=0.002))
+
+    class Args:
+        speed = 'max'
+        address = None
+        registers = None
+        in_place = False
+        rounds = 5
+        diffs = 3
+    print("replay of a capture with line noise:")
+    replay_report(Capture(noisy), Args)
+
+
+main()
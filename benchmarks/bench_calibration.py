@@ -0,0 +1,79 @@
+"""
+Calibrates the RS485 turnaround against a simulated loopback transceiver,
+and compares the calibrated DE hold and TX delay with the defaults for several baud rates.
+The silence after a response is counted from the end of the last character, it must not fall below t3.5.
+"""
+from bench_util import ticks_us, ticks_diff
+from sys import implementation
+
+if implementation.name != 'micropython':
+    import sim
+    sim.install()
+
+from uasyncio import run  # noqa: E402
+
+from rs485 import RS485  # noqa: E402
+
+
+class SimTransceiver:
+    """
+    Loopback UART and DE pin.
+    flush() returns once the last byte has started shifting out, like a drained TX FIFO,
+    bytes which have not finished when DE drops are lost.
+    """
+    def __init__(self, baudrate, latency_us=2):
+        self.char_us = 11 * 1000000 / baudrate
+        self.latency_us = latency_us  # Transceiver propagation delay
+        self.tx = b''
+        self.tx_start = 0
+        self.rx = bytearray()
+
+    # UART
+    def write(self, data):
+        self.tx = bytes(data)
+        self.tx_start = ticks_us()
+        return len(data)
+
+    def flush(self):
+        last_start = (len(self.tx) - 1) * self.char_us
+        while ticks_diff(ticks_us(), self.tx_start) < last_start:
+            pass
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n=None):
+        n = len(self.rx) if n is None else n
+        data, self.rx = bytes(self.rx[:n]), self.rx[n:]
+        return data
+
+    # DE pin
+    def on(self):
+        pass
+
+    def off(self):
+        if not self.tx:
+            return
+        elapsed = ticks_diff(ticks_us(), self.tx_start) - self.latency_us
+        self.rx.extend(self.tx[:int(elapsed // self.char_us)])
+        self.tx = b''
+
+
+async def main():
+    print("%8s %16s %16s %16s %20s" % ("baud", "default DE/TX us", "calibrated us", "saved us", "silence/t3.5 us"))
+    for baudrate in (9600, 19200, 115200, 921600):
+        sim = SimTransceiver(baudrate)
+        serial = RS485(0, 0, sim, sim, baudrate=baudrate, parity=0, tx_delay=1750 if baudrate > 19200 else 0,
+                       calibration=None)
+        serial.task.cancel()
+        default = (serial.driver_delay, max(serial.tx_delay, serial.frame_gap))
+        calibrated = await serial.calibrate(save=False)
+        if calibrated is None:
+            print("%8d calibration failed" % baudrate)
+            continue
+        silence = max(0, calibrated[0] - serial.char_time) + calibrated[1]
+        print("%8d %16s %16s %16d %20s" % (baudrate, "%d/%d" % default, "%d/%d" % calibrated,
+                                            sum(default) - sum(calibrated), "%d/%d" % (silence, serial.frame_gap)))
+
+
+run(main())
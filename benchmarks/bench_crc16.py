@@ -0,0 +1,57 @@
+"""
+Compares the CRC implementations on a 256 byte frame: the original loop returning packed bytes,
+the pure and viper update functions, the in-place zero residue check, and byte by byte streaming.
+"""
+from bench_util import LCG, timeit, report, alloc_per_call
+
+from struct import pack
+
+from crc16_modbus import (CRC16, CRC16_INIT, CRC16_TABLE, _crc16_update, crc16_update,
+                          calculate_crc16, check_crc16)
+
+ROUNDS = 200
+
+
+def legacy_crc16(data):
+    crc = 0xFFFF
+    for char in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[((crc) ^ char) & 0xFF]
+    return pack('<H', crc)
+
+
+def legacy_check(frame):
+    crc = legacy_crc16(frame[:-2])
+    return crc[0] == frame[-2] and crc[1] == frame[-1]
+
+
+def run(func, *args):
+    for _ in range(ROUNDS):
+        func(*args)
+
+
+def stream(frame):
+    crc = CRC16()
+    for char in frame:
+        crc.update_byte(char)
+    return crc.valid
+
+
+def main():
+    data = LCG(1).bytes(254)
+    frame = bytearray(data + calculate_crc16(data))
+    if not check_crc16(frame) or not legacy_check(frame) or not stream(frame):
+        raise ValueError("CRC check failed")
+    print("viper" if crc16_update is not _crc16_update else "pure Python", "crc16_update")
+
+    cases = (("legacy slice + compare", legacy_check, frame),
+             ("pure update", _crc16_update, frame, 0, len(frame), CRC16_INIT),
+             ("crc16_update", crc16_update, frame, 0, len(frame), CRC16_INIT),
+             ("check_crc16 in place", check_crc16, frame),
+             ("CRC16.update_byte stream", stream, frame))
+    for name, func, *args in cases:
+        _, elapsed = timeit(run, func, *args)
+        report(name, ROUNDS * len(frame), elapsed, "bytes")
+        print("%32.1f bytes allocated/frame" % alloc_per_call(func, *args))
+
+
+main()
@@ -0,0 +1,105 @@
+"""
+Heap allocation and worst case latency per transaction, for the frame based request path
+(decoder.feed, parse_frame, handle, to_bytes) against the in-place path of ModbusRTUClient(in_place=True)
+(decoder.push, next_frame, handle_into the tx buffer).
+Each transaction is a request chunk as the receiver queues it, delimited, handled and encoded.
+On MicroPython allocations are gc.mem_alloc() deltas, and latency is measured with the collector enabled,
+so collection pauses land in the worst case. CPython frees by reference counting, its numbers are tracemalloc peaks.
+"""
+from bench_util import ticks_us, ticks_diff, alloc_per_call, percentiles
+
+import gc
+import sys
+
+from modbus_frame import ModbusFrame
+from modbus_unit import ModbusUnit
+from rtu_decoder import RTUDecoder
+from stats import Stats
+
+TRANSACTIONS = 5000
+READS = [bytes(ModbusFrame.read_holding_registers(1, start, count).to_bytes())
+         for start, count in ((0, 10), (100, 60), (300, 125))] + \
+        [bytes(ModbusFrame.read_input_registers(1, 0, 20).to_bytes())]
+WRITE = bytes(ModbusFrame.write_single_register(1, 50, 1234).to_bytes())
+
+
+class Chunk:
+    """ A receive queue slot holding a request, as RingQueue keeps them """
+    def __init__(self, request):
+        self.slot = bytearray(256)
+        self.slot[:len(request)] = request
+        self.length = len(request)
+        self.view = memoryview(self.slot)[:self.length]
+
+
+def framed(unit, decoder, stats, chunk, tx):
+    for frame in decoder.feed(chunk.view):
+        unit.handle(ModbusFrame.parse_frame(frame, check_crc=False), stats).to_bytes()
+
+
+def in_place(unit, decoder, stats, chunk, tx):
+    decoder.push(chunk.slot, chunk.length)
+    while end := decoder.next_frame():
+        unit.handle_into(decoder.buffer, decoder.frame_start, end, tx, stats)
+
+
+def latencies(path, unit, chunks):
+    decoder, stats, tx = RTUDecoder(), Stats(), bytearray(256)
+    samples = []
+    gc.collect()
+    for n in range(TRANSACTIONS):
+        start = ticks_us()
+        path(unit, decoder, stats, chunks[n % len(chunks)], tx)
+        samples.append(ticks_diff(ticks_us(), start))
+    return samples
+
+
+async def turnaround(in_place, baudrate=921600, transactions=300):
+    import sim
+    from uasyncio import create_task, sleep_ms
+    from modbus_master import ModbusRTUMaster
+    from modbus_rtu import ModbusRTUClient
+
+    bus = sim.RS485Bus(baudrate)
+    bus.attach(0, de_pin=11)
+    bus.attach(1, de_pin=21)
+    client = ModbusRTUClient(1, 12, 13, 11, uart=0, baudrate=baudrate, in_place=in_place)
+    master = ModbusRTUMaster(22, 23, 21, uart=1, baudrate=baudrate, timeout_ms=50)
+    task = create_task(client.runloop())
+    await sleep_ms(10)
+    for n in range(transactions):
+        response = await master.transact(READS[n % len(READS)])
+        if response[1] != READS[n % len(READS)][1]:
+            raise ValueError("Unexpected response: %s" % bytes(response).hex())
+    task.cancel()
+    client.serial.task.cancel()
+    master.serial.task.cancel()
+    samples = bus.turnarounds[0]
+    print("%-12s turnaround p50/p99/max: %d/%d/%d us" %
+          ("in place" if in_place else "frames", *percentiles(samples, (50, 99)), max(samples)))
+
+
+def main():
+    unit = ModbusUnit(1)
+    reads = [Chunk(request) for request in READS]
+    mix = reads * 3 + [Chunk(WRITE)]
+    for mix_name, chunks in (("reads", reads), ("reads + 1/13 writes", mix)):
+        print(mix_name)
+        for name, path in (("frames", framed), ("in place", in_place)):
+            decoder, stats, tx = RTUDecoder(), Stats(), bytearray(256)
+            allocated = sum(alloc_per_call(path, unit, decoder, stats, chunk, tx, n=200) for chunk in chunks)
+            samples = latencies(path, unit, chunks)
+            p50, p99 = percentiles(samples, (50, 99))
+            print("  %-10s %8.1f bytes/transaction, latency p50/p99/max: %d/%d/%d us" %
+                  (name, allocated / len(chunks), p50, p99, max(samples)))
+
+    if sys.implementation.name != 'micropython':  # The simulated bus needs CPython
+        import sim
+        sim.install()
+        from uasyncio import run
+        print("simulated bus, 921600 baud")
+        for in_place_mode in (False, True):
+            run(turnaround(in_place_mode))
+
+
+main()
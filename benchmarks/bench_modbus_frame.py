@@ -0,0 +1,70 @@
+"""
+Encode rate and allocations per frame for ModbusFrame against the previous implementation,
+which rebuilt the PDU for every pdu/crc access and packed response bytes one by one.
+"""
+from bench_util import timeit, report, alloc_per_call
+
+from struct import pack
+from crc16_modbus import calculate_crc16
+from modbus_frame import ModbusFrame
+
+
+class LegacyModbusFrame:
+    def __init__(self, address, function, data, response=False):
+        self.address = address
+        self.function = function
+        self.data = data
+        self.response = response
+
+    def to_bytes(self):
+        return self.pdu + self.crc
+
+    @property
+    def pdu(self):
+        if self.response:
+            data_length = len(self.data)
+            return pack(">BBB" + "B" * data_length, self.address, self.function, data_length, *self.data)
+        return pack(">BBHH", self.address, self.function, *self.data)
+
+    @property
+    def crc(self):
+        return calculate_crc16(self.pdu)
+
+
+PAYLOAD = bytes(range(250))  # 125 registers
+
+
+def encode_response(cls):
+    return cls(1, 3, PAYLOAD, response=True).to_bytes()
+
+
+def encode_request(cls):
+    return cls(1, 3, (0, 125)).to_bytes()
+
+
+def encode_into(buf):
+    return ModbusFrame(1, 3, PAYLOAD, response=True).encode_into(buf)
+
+
+def loop(func, arg, n):
+    for _ in range(n):
+        func(arg)
+    return n
+
+
+def main(n=2000):
+    buf = bytearray(256)
+    assert encode_response(LegacyModbusFrame) == encode_response(ModbusFrame)
+    assert encode_request(LegacyModbusFrame) == encode_request(ModbusFrame)
+    cases = (("legacy response", encode_response, LegacyModbusFrame),
+             ("ModbusFrame response", encode_response, ModbusFrame),
+             ("ModbusFrame encode_into", encode_into, buf),
+             ("legacy request", encode_request, LegacyModbusFrame),
+             ("ModbusFrame request", encode_request, ModbusFrame))
+    for name, func, arg in cases:
+        count, elapsed = timeit(loop, func, arg, n)
+        report(name, count, elapsed, "encodes")
+        print("%-28s %8.1f bytes allocated/frame" % ("", alloc_per_call(func, arg, n=200)))
+
+
+main()
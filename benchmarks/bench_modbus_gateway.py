@@ -0,0 +1,65 @@
+"""
+Several TCP clients read the same registers through the gateway from simulated RTU slaves at 9600 baud.
+Reports client requests per second and RTU transactions, without and with the response cache.
+"""
+from bench_util import ticks_us, ticks_diff, report
+from sys import implementation
+
+if implementation.name != 'micropython':
+    import sim
+    sim.install()
+
+from uasyncio import gather, open_connection, run, create_task  # noqa: E402
+from struct import pack, unpack_from  # noqa: E402
+
+from modbus_gateway import ModbusTCPGateway  # noqa: E402
+from modbus_master import ModbusRTUMaster  # noqa: E402
+from modbus_unit import ModbusUnit  # noqa: E402
+from sim_slaves import SimSlaveLink  # noqa: E402
+
+PORT = 15021
+# (unit, start, count) read by every client in turn, unit 3 is offline
+READS = ((1, 0, 10), (1, 100, 20), (2, 0, 10), (2, 50, 4), (3, 0, 10))
+
+
+async def client(requests, depth):
+    reader, writer = await open_connection('127.0.0.1', PORT)
+    sent = received = errors = 0
+    while received < requests:
+        while sent < requests and sent - received < depth:
+            unit, start, count = READS[sent % len(READS)]
+            writer.write(pack(">HHHBBHH", sent & 0xFFFF, 0, 6, unit, 3, start, count))
+            sent += 1
+        await writer.drain()
+        header = await reader.readexactly(7)
+        length = unpack_from(">HHHB", header)[2]
+        pdu = await reader.readexactly(length - 1)
+        if pdu[0] & 0x80:
+            errors += 1
+        received += 1
+    writer.close()
+    return errors
+
+
+async def bench(name, master, cache_ttl_ms, clients=8, requests=50, depth=2):
+    gateway = ModbusTCPGateway(master, '127.0.0.1', PORT, max_connections=clients, slave_timeouts={3: 20},
+                               cache_ttl_ms=cache_ttl_ms)
+    await gateway.start()
+    worker = create_task(gateway.worker())
+    start = ticks_us()
+    errors = await gather(*(client(requests, depth) for _ in range(clients)))
+    elapsed = ticks_diff(ticks_us(), start)
+    worker.cancel()
+    gateway.close()
+    print("%s: %s, exception responses: %d" % (name, gateway, sum(errors)))
+    report(name, clients * requests, elapsed, "requests")
+
+
+async def main():
+    units = {address: ModbusUnit(address) for address in (1, 2, 3)}
+    master = ModbusRTUMaster(serial=SimSlaveLink(units, offline=(3,)), timeout_ms=100)
+    await bench("coalescing", master, 0)
+    await bench("coalescing, 250 ms cache", master, 250)
+
+
+run(main())
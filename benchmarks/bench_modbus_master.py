@@ -0,0 +1,60 @@
+"""
+Polls points from simulated slaves, one offline, and reports polled points per second
+for one read per point against the coalesced plan.
+The link delivers each response after the wire time of the request and response at the set baud rate.
+"""
+from bench_util import LCG, ticks_us, ticks_diff, report
+from sys import implementation
+
+if implementation.name != 'micropython':
+    import sim
+    sim.install()
+
+from uasyncio import create_task, run, sleep_ms  # noqa: E402
+
+from modbus_master import ModbusRTUMaster, Point, PollRequest, plan_requests  # noqa: E402
+from modbus_unit import ModbusUnit  # noqa: E402
+from sim_slaves import SimSlaveLink  # noqa: E402
+
+
+def make_points(units, count, seed=1):
+    rand = LCG(seed)
+    types = ('u16', 'i16', 'u32', 'float32')
+    points = []
+    for n in range(count):
+        unit = units[n % len(units)]
+        # Clustered addresses, as on real devices
+        register = (rand.next() % 5) * 150 + rand.next() % 40
+        points.append(Point("p%d" % n, unit, register, types[rand.next() % len(types)],
+                            period_ms=100 * (1 + rand.next() % 3), table=3 + rand.next() % 2))
+    return points
+
+
+def one_per_point(points):
+    return [PollRequest(p.unit, p.table, p.register, p.size, [p]) for p in points]
+
+
+async def bench(name, planner, points, link, duration_ms=3000):
+    master = ModbusRTUMaster(serial=link, timeout_ms=100, retries=1)
+    master.points = points
+    master.requests = planner(points)
+    start = ticks_us()
+    task = create_task(master.runloop())
+    await sleep_ms(duration_ms)
+    task.cancel()
+    elapsed = ticks_diff(ticks_us(), start)
+    print("%s: %d requests, %d transactions, %d timeouts" % (name, len(master.requests),
+                                                            master.transactions, master.timeouts))
+    report(name, master.points_polled, elapsed, "points")
+
+
+async def main():
+    addresses = (1, 2, 3, 4)
+    units = {address: ModbusUnit(address) for address in addresses}
+    points = make_points(addresses, 240)
+    link = SimSlaveLink(units, offline=(4,))
+    await bench("one read per point", one_per_point, points, link)
+    await bench("coalesced", plan_requests, points, link)
+
+
+run(main())
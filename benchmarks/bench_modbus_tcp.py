@@ -0,0 +1,57 @@
+"""
+Load tests the Modbus TCP server over loopback, with several clients each pipelining requests,
+and reports requests per second. Every response is checked against the registers.
+"""
+from bench_util import ticks_us, ticks_diff, report
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from struct import pack, unpack_from
+
+from modbus_tcp import ModbusTCPServer
+from modbus_unit import ModbusUnit
+
+PORT = 15020
+
+
+async def client(requests, depth):
+    """ Keeps depth requests in flight, reading 10 holding registers from a rotating start """
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    sent = received = 0
+    while received < requests:
+        while sent < requests and sent - received < depth:
+            start = sent % 100
+            writer.write(pack(">HHHBBHH", sent & 0xFFFF, 0, 6, 1, 3, start, 10))
+            sent += 1
+        await writer.drain()
+        header = await reader.readexactly(7)
+        transaction_id, _, length, _ = unpack_from(">HHHB", header)
+        pdu = await reader.readexactly(length - 1)
+        if transaction_id != received & 0xFFFF or pdu[0] != 3 or pdu[2:4] != pack(">H", received % 100):
+            raise ValueError("Invalid response %d: %s" % (transaction_id, pdu))
+        received += 1
+    writer.close()
+
+
+async def bench(clients, depth, requests=2000):
+    start = ticks_us()
+    await asyncio.gather(*(client(requests, depth) for _ in range(clients)))
+    report("%d clients, depth %d" % (clients, depth), clients * requests, ticks_diff(ticks_us(), start),
+           "requests")
+
+
+async def main():
+    unit = ModbusUnit(1)
+    for register in range(200):
+        unit.holding_registers[register] = register
+    server = ModbusTCPServer(unit, '127.0.0.1', PORT, max_connections=16)
+    await server.start()
+    for clients, depth in ((1, 1), (1, 8), (8, 1), (8, 8)):
+        await bench(clients, depth)
+    print(server.stats)
+    server.close()
+
+
+asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Aggregate throughput of one ModbusRTUClient serving one and two RS485 ports, on simulated buses, under CPython.
+Each port has its own bus and master polling as fast as it is answered, all running in the same loop.
+Reports transactions per second per port and in total, and the slave turnaround percentiles per port.
+A bus time bound baud rate should scale close to twice with two ports, a faster one is limited by the CPU.
+"""
+from bench_util import ticks_us, ticks_diff, report, percentiles
+
+import sim
+sim.install()
+
+from uasyncio import run, create_task, gather, sleep_ms, TimeoutError
+
+from modbus_frame import ModbusFrame
+from modbus_master import ModbusRTUMaster
+from modbus_rtu import ModbusRTUClient
+from rs485 import RS485
+
+DURATION_MS = 2000
+# Slave UART, slave DE pin, master UART, master DE pin, for each bus
+PORTS = ((0, 11, 1, 21), (2, 31, 3, 41))
+
+
+async def poll(master, request, deadline):
+    done = failed = 0
+    while ticks_diff(deadline, ticks_us()) > 0:
+        try:
+            await master.transact(request)
+            done += 1
+        except TimeoutError:
+            failed += 1
+    return done, failed
+
+
+async def bench(baudrate, port_count):
+    buses, masters = [], []
+    client = None
+    for slave_uart, slave_de, master_uart, master_de in PORTS[:port_count]:
+        bus = sim.RS485Bus(baudrate)
+        bus.attach(slave_uart, de_pin=slave_de)
+        bus.attach(master_uart, de_pin=master_de)
+        if client is None:
+            client = ModbusRTUClient(1, 0, 0, slave_de, uart=slave_uart, baudrate=baudrate)
+        else:
+            client.add_port(0, 0, slave_de, uart=slave_uart, baudrate=baudrate)
+        # The masters share the loop with the ports, so they must not block it either
+        link = RS485(0, 0, master_de, master_uart, baudrate, parity=0, rx_mode='irq', calibration=None)
+        link.tx_yield = True
+        master = ModbusRTUMaster(serial=link, timeout_ms=200)
+        buses.append(bus)
+        masters.append(master)
+    task = create_task(client.runloop())
+    await sleep_ms(10)
+
+    request = ModbusFrame.read_holding_registers(1, 0, 20).to_bytes()
+    start = ticks_us()
+    results = await gather(*(poll(master, request, start + DURATION_MS * 1000) for master in masters))
+    elapsed = ticks_diff(ticks_us(), start)
+    task.cancel()
+    for port in client.ports:
+        port.serial.task.cancel()
+    for master in masters:
+        master.serial.task.cancel()
+    await sleep_ms(10)
+
+    for n, ((done, failed), bus) in enumerate(zip(results, buses)):
+        report("%d baud, port %d/%d" % (baudrate, n + 1, port_count), done, elapsed, "transactions")
+        print("    turnaround p50/p90/p99: %d/%d/%d us, timeouts: %d" %
+              (*percentiles(bus.turnarounds.get(PORTS[n][0], ())), failed))
+    if port_count > 1:
+        report("%d baud, total" % baudrate, sum(done for done, _ in results), elapsed, "transactions")
+
+
+async def main():
+    for baudrate in (9600, 19200, 115200):
+        for port_count in (1, 2):
+            await bench(baudrate, port_count)
+
+
+run(main())
@@ -0,0 +1,118 @@
+"""
+Register snapshots in flash: the boot restore of 10000 holding registers with a single readinto
+against loading them register by register, the saves made for a stream of writes coalesced
+over the interval, and on CPython, power cuts at points through a save, each of which must
+restore the previous snapshot. Flash is sim.FlashFS on CPython, the filesystem on MicroPython.
+"""
+from bench_util import timeit, report
+from sys import implementation
+
+MICROPYTHON = implementation.name == 'micropython'
+if not MICROPYTHON:
+    import sim
+    sim.install()
+
+from struct import unpack_from  # noqa: E402
+from uasyncio import run, sleep_ms, create_task  # noqa: E402
+
+from register_bank import RegisterBank  # noqa: E402
+from register_store import RegisterStore, SNAPSHOT_HEADER_LENGTH  # noqa: E402
+
+COUNT = 10000
+
+
+def flash():
+    if MICROPYTHON:
+        return None, 'bench_store'
+    import tempfile
+    from sim.flash import FlashFS
+    return FlashFS(tempfile.mkdtemp()), 'bank'
+
+
+def fill(bank, seed):
+    for i in range(bank.count):
+        bank[i] = (i * 7 + seed) & 0xFFFF
+
+
+def per_register(store, bank):
+    """ Loads a snapshot register by register, as a parser of a per register format would """
+    with store.open(store.slot_path(store.sequence), 'rb') as f:
+        data = f.read()
+    for i in range(bank.count):
+        bank[i] = unpack_from('>H', data, SNAPSHOT_HEADER_LENGTH + i * 2)[0]
+
+
+async def writes(bank, count, every_ms):
+    for n in range(count):
+        bank[n % 100] = n
+        await sleep_ms(every_ms)
+
+
+async def coalescing(fs, path, interval_ms, count=200, every_ms=5):
+    bank = RegisterBank(COUNT)
+    store = RegisterStore(bank, path + '_c%d' % interval_ms, interval_ms=interval_ms, fs=fs)
+    written = fs.bytes_written if fs else 0
+    task = create_task(store.runloop())
+    await writes(bank, count, every_ms)
+    await sleep_ms(interval_ms + 20)
+    task.cancel()
+    wear = ", %d bytes written" % (fs.bytes_written - written) if fs else ""
+    print("interval %4d ms: %d register writes, %d saves, last save %d us%s"
+          % (interval_ms, count, store.saves, store.save_us, wear))
+
+
+async def power_cuts(fs, path):
+    """ Cuts power at points through the second save, the first snapshot must be restored every time """
+    bank = RegisterBank(COUNT)
+    store = RegisterStore(bank, path + '_p', fs=fs)
+    fill(bank, 1)
+    await store.save()
+    expected = bytes(bank.buffer)
+    length = SNAPSHOT_HEADER_LENGTH + COUNT * 2
+    intact = 0
+    cuts = (0, 1, SNAPSHOT_HEADER_LENGTH, 100, length // 2, length - 1)
+    for cut in cuts:
+        fill(bank, 2)
+        fs.power_loss_after = fs.bytes_written + cut
+        try:
+            await store.save()
+        except OSError:
+            pass
+        fs.power_cycle()
+        restored = RegisterBank(COUNT)
+        if RegisterStore(restored, path + '_p', fs=fs).restore() == 1 and restored.buffer == expected:
+            intact += 1
+        else:
+            print("power cut after %d bytes: snapshot lost" % cut)
+    print("power cuts during a save: %d of %d restored the previous snapshot" % (intact, len(cuts)))
+    fill(bank, 3)
+    await store.save()
+    restored = RegisterBank(COUNT)
+    sequence = RegisterStore(restored, path + '_p', fs=fs).restore()
+    print("save after the cuts: snapshot %s restored, %s" % (sequence, "intact" if restored.buffer == bank.buffer else "DAMAGED"))
+
+
+def main():
+    fs, path = flash()
+    bank = RegisterBank(COUNT)
+    fill(bank, 0)
+    store = RegisterStore(bank, path, fs=fs)
+    run(store.save())
+
+    restored = RegisterBank(COUNT)
+    target = RegisterStore(restored, path, fs=fs)
+    sequence, elapsed = timeit(target.restore)
+    report("restore, single readinto", COUNT, elapsed, "registers")
+    print("%32s snapshot %d, restore_us %d, %s" % ("", sequence, target.restore_us,
+                                                    "intact" if restored.buffer == bank.buffer else "DAMAGED"))
+    _, elapsed = timeit(per_register, target, restored)
+    report("restore, per register", COUNT, elapsed, "registers")
+
+    for interval_ms in (0, 50, 250):
+        run(coalescing(fs, path, interval_ms))
+
+    if fs is not None:
+        run(power_cuts(fs, path))
+
+
+main()
@@ -0,0 +1,91 @@
+"""
+Compares handling repeated register reads with and without the response cache:
+the cost per request of parsing, handling and encoding against a cache hit,
+the hit rate of a poll cycle with occasional writes, and on CPython the slave turnaround on the simulated bus.
+"""
+from bench_util import timeit, report, alloc_per_call, percentiles
+
+from modbus_frame import ModbusFrame
+from modbus_unit import ModbusUnit
+from response_cache import ResponseCache
+
+ROUNDS = 2000
+POLLS = [bytes(ModbusFrame.read_holding_registers(1, start, count).to_bytes())
+         for start, count in ((0, 10), (100, 50), (300, 125))] + \
+        [bytes(ModbusFrame.read_input_registers(1, 0, 20).to_bytes())]
+
+
+def handle(unit, request):
+    return unit.handle(ModbusFrame.parse_frame(request, check_crc=False)).to_bytes()
+
+
+def uncached(unit, request):
+    for _ in range(ROUNDS):
+        handle(unit, request)
+
+
+def cached(cache, request):
+    for _ in range(ROUNDS):
+        cache.lookup(request)
+
+
+def poll_cycles(unit, cache, cycles=500, write_every=10):
+    """ Polls every read each cycle, writing a register in the second range every write_every cycles """
+    for cycle in range(cycles):
+        if cycle % write_every == 0:
+            unit.holding_registers[120] = cycle
+        for request in POLLS:
+            if cache.lookup(request) is None:
+                cache.store(request, handle(unit, request))
+
+
+async def turnaround(response_cache, baudrate=921600, transactions=200):
+    import sim
+    from uasyncio import create_task, sleep_ms
+    from modbus_master import ModbusRTUMaster
+    from modbus_rtu import ModbusRTUClient
+
+    bus = sim.RS485Bus(baudrate)
+    bus.attach(0, de_pin=11)
+    bus.attach(1, de_pin=21)
+    client = ModbusRTUClient(1, 12, 13, 11, uart=0, baudrate=baudrate, response_cache=response_cache)
+    master = ModbusRTUMaster(22, 23, 21, uart=1, baudrate=baudrate, timeout_ms=50)
+    task = create_task(client.runloop())
+    await sleep_ms(10)
+    for n in range(transactions):
+        await master.transact(POLLS[n % len(POLLS)])
+    task.cancel()
+    client.serial.task.cancel()
+    master.serial.task.cancel()
+    print("%-28s turnaround p50/p90/p99: %d/%d/%d us" % ("cache size %d" % response_cache,
+                                                           *percentiles(bus.turnarounds[0])))
+
+
+def main():
+    unit = ModbusUnit(1)
+    cache = ResponseCache({1: unit})
+    for request in POLLS:
+        cache.store(request, handle(unit, request))
+    for request in POLLS:
+        _, elapsed = timeit(uncached, unit, request)
+        report("parse+handle+encode %d B" % len(cache.lookup(request)), ROUNDS, elapsed, "requests")
+        print("%32.1f bytes allocated/request" % alloc_per_call(handle, unit, request))
+        _, elapsed = timeit(cached, cache, request)
+        report("cache hit", ROUNDS, elapsed, "requests")
+        print("%32.1f bytes allocated/request" % alloc_per_call(cache.lookup, request))
+
+    cache = ResponseCache({1: unit})
+    poll_cycles(unit, cache)
+    print("poll cycles, write every 10: %s" % cache)
+
+    from sys import implementation
+    if implementation.name == 'micropython':
+        return  # The simulated bus needs CPython
+    import sim
+    sim.install()
+    from uasyncio import run
+    run(turnaround(0))
+    run(turnaround(16))
+
+
+main()
@@ -0,0 +1,122 @@
+"""
+Receive latency of the RS485 rx modes against a simulated UART.
+Latency is measured from the time the last byte of a frame arrives on the line,
+to the time the complete frame is queued in RS485.messages.
+
+Runs under MicroPython, the simulated UART needs an io.IOBase base for the stream mode,
+and on CPython with the sim package.
+"""
+from bench_util import LCG
+from sys import implementation
+
+if implementation.name != 'micropython':
+    import sim
+    sim.install()
+
+from io import IOBase  # noqa: E402
+from uasyncio import run, sleep_ms, create_task  # noqa: E402
+from utime import ticks_us, ticks_diff, ticks_add  # noqa: E402
+
+from rs485 import RS485  # noqa: E402
+
+
+class SimPin:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+class SimUART(IOBase):
+    """ UART stand-in delivering injected bytes at the line rate """
+    IRQ_RXIDLE = 1
+
+    def __init__(self, char_us):
+        self.char_us = char_us
+        self.pending = []  # (arrival time, byte)
+        self.rx = bytearray()
+        self.handler = None
+
+    def inject(self, data):
+        """ Starts sending data on the line, returns the arrival time of the last byte """
+        start = ticks_us()
+        for i, byte in enumerate(data):
+            self.pending.append((ticks_add(start, (i + 1) * self.char_us), byte))
+        return self.pending[-1][0]
+
+    def _arrive(self):
+        now = ticks_us()
+        while self.pending and ticks_diff(now, self.pending[0][0]) >= 0:
+            self.rx.append(self.pending.pop(0)[1])
+
+    def any(self):
+        self._arrive()
+        return len(self.rx)
+
+    def read(self, n=None):
+        self._arrive()
+        if not self.rx:
+            return None
+        n = len(self.rx) if n is None else min(n, len(self.rx))
+        data = bytes(self.rx[:n])
+        self.rx = self.rx[n:]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if data:
+            buf[:len(data)] = data
+        return len(data) if data else None
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def irq(self, handler=None, trigger=0):
+        self.handler = handler
+
+    def ioctl(self, req, arg):
+        if req == 3:  # MP_STREAM_POLL
+            return arg & 1 if self.any() else 0
+        return 0
+
+
+async def measure(rx_mode, frames=100, baudrate=115200):
+    char_us = 11 * 1000000 // baudrate
+    uart = SimUART(char_us)
+    serial = RS485(0, 0, SimPin(), uart, baudrate=baudrate, parity=0, poll_interval=0, rx_mode=rx_mode)
+    await sleep_ms(1)  # Let the receive task start, in irq mode it registers the handler the first frame needs
+    rng = LCG(rx_mode == 'poll' and 1 or 2)
+    latencies = []
+    for _ in range(frames):
+        frame = rng.bytes(8)
+        last_byte = uart.inject(frame)
+        if uart.handler:  # Fire the RX idle interrupt 32 bit times after the last byte
+            async def idle_irq(at=ticks_add(last_byte, 32 * 1000000 // baudrate)):
+                while ticks_diff(at, ticks_us()) > 0:
+                    await sleep_ms(0)
+                uart.handler(uart)
+            create_task(idle_irq())
+        received = 0
+        while received < len(frame):
+            await serial.received.wait()
+            serial.received.clear()
+            while serial.messages:
+                received += len(serial.messages.pop())
+        latencies.append(ticks_diff(ticks_us(), last_byte))
+        await sleep_ms(2)
+    serial.task.cancel()
+    latencies.sort()
+    print("%-8s %s: mean %6d us, p50 %6d us, max %6d us" %
+          (rx_mode, serial.rx_mode, sum(latencies) // len(latencies), latencies[len(latencies) // 2], latencies[-1]))
+
+
+async def main():
+    for rx_mode in RS485.RX_MODES:
+        await measure(rx_mode)
+
+
+run(main())
@@ -0,0 +1,80 @@
+"""
+Turnaround jitter of the slave with the RS485 receive and transmit path on the asyncio loop ('irq'),
+and on a second core worker ('thread'), while other tasks hold the loop, on the simulated bus.
+The load task blocks the loop for up to load_us at a time, like display refresh chunks or user code.
+
+Under CPython the worker is a thread sharing the interpreter lock. The load blocks in the OS sleep,
+which releases it, so it holds core 0 without slowing the worker, as it would on the RP2040,
+and the switch interval is lowered so the worker is scheduled about as often as it polls.
+The remaining jitter is the simulation's, on a host with a single CPU the worker and the loop
+still take turns on it, which shows up as late responses under load.
+"""
+from bench_util import LCG, ticks_us, ticks_diff, report, percentiles
+
+import sys
+import sim
+sim.install()
+
+from uasyncio import run, create_task, sleep_ms, TimeoutError
+from time import sleep
+
+from modbus_frame import ModbusFrame
+from modbus_master import ModbusRTUMaster
+from modbus_rtu import ModbusRTUClient
+
+TRANSACTIONS = 300
+BAUDRATE = 115200
+
+
+async def load(max_us, rand):
+    """ Holds the loop for a random time up to max_us, then yields """
+    while True:
+        sleep((rand.next() % max_us) / 1000000)
+        await sleep_ms(0)
+
+
+async def bench(rx_mode, load_us, slot_us=None):
+    bus = sim.RS485Bus(BAUDRATE)
+    bus.attach(0, de_pin=11)
+    bus.attach(1, de_pin=21)
+    client = ModbusRTUClient(1, 12, 13, 11, uart=0, baudrate=BAUDRATE, rx_mode=rx_mode)
+    if slot_us is not None:
+        client.serial.response_slot = slot_us
+    master = ModbusRTUMaster(22, 23, 21, uart=1, baudrate=BAUDRATE, timeout_ms=50)
+    task = create_task(client.runloop())
+    load_task = create_task(load(load_us, LCG(7))) if load_us else None
+    await sleep_ms(10)
+    request = ModbusFrame.read_holding_registers(1, 0, 10).to_bytes()
+
+    failed = 0
+    start = ticks_us()
+    for _ in range(TRANSACTIONS):
+        try:
+            await master.transact(request)
+        except TimeoutError:
+            failed += 1
+    elapsed = ticks_diff(ticks_us(), start)
+    for running in (task, load_task, client.serial.task, master.serial.task):
+        if running is not None:
+            running.cancel()
+    await sleep_ms(10)
+
+    samples = bus.turnarounds.get(0, ())
+    p10, p50, p90, p99 = percentiles(samples, (10, 50, 90, 99))
+    name = "%s, load %d us" % (rx_mode if rx_mode != 'thread' else "thread/%d" % client.serial.response_slot, load_us)
+    report(name, TRANSACTIONS - failed, elapsed, "transactions")
+    print("    turnaround p10/p50/p90/p99: %d/%d/%d/%d us, jitter p10-p90: %d us, timeouts: %d%s" %
+          (p10, p50, p90, p99, p90 - p10, failed,
+           ", late: %d" % client.serial.late if rx_mode == 'thread' else ""))
+
+
+async def main():
+    for load_us in (0, 500, 1000):
+        await bench('irq', load_us)
+        await bench('thread', load_us)
+        if load_us:  # A slot covering a held loop
+            await bench('thread', load_us, 1750 + load_us)
+
+
+sys.setswitchinterval(0.00002)
+run(main())
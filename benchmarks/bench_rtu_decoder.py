@@ -0,0 +1,60 @@
+"""
+Throughput of the RTU frame decoder on streams mixing valid requests and garbage.
+Compares the incremental RTUDecoder against the previous recursive byte-shift resync.
+"""
+from bench_util import LCG, timeit, report
+
+from crc16_modbus import calculate_crc16
+from modbus_frame import ModbusFrame
+from rtu_decoder import RTUDecoder
+
+
+def make_stream(frames, garbage, seed=1):
+    """ Builds chunks of valid FC3 requests, each preceded by up to garbage random bytes """
+    rng = LCG(seed)
+    chunks = []
+    for i in range(frames):
+        pdu = bytes((1, 3, 0, i & 0xFF, 0, 10))
+        noise = rng.bytes(rng.next() % (garbage + 1)) if garbage else b''
+        chunks.append(noise + pdu + calculate_crc16(pdu))
+    return chunks
+
+
+def legacy_parse(data, i=0):
+    """ The previous resync strategy, shift one byte and reparse, giving up after 10 attempts """
+    if i > 10 or not data:
+        return 0
+    try:
+        ModbusFrame.parse_frame(data)
+        return 1
+    except Exception:
+        pass
+    return legacy_parse(data[1:], i + 1)
+
+
+def run_legacy(chunks):
+    return sum(legacy_parse(chunk) for chunk in chunks)
+
+
+def run_decoder(chunks):
+    decoder = RTUDecoder()
+    found = 0
+    for chunk in chunks:
+        for _ in decoder.feed(chunk):
+            found += 1
+        for _ in decoder.gap():
+            found += 1
+    return found
+
+
+def main(frames=2000):
+    for garbage in (0, 4, 16, 64):
+        chunks = make_stream(frames, garbage)
+        total = sum(len(chunk) for chunk in chunks)
+        print("garbage <= %d bytes/frame, %d bytes" % (garbage, total))
+        for name, func in (("legacy recursive", run_legacy), ("RTUDecoder", run_decoder)):
+            found, elapsed = timeit(func, chunks)
+            report("  %s (%d found)" % (name, found), total, elapsed, "bytes")
+
+
+main()
@@ -0,0 +1,59 @@
+"""
+Runs an unmodified ModbusRTUClient against a ModbusRTUMaster on the simulated RS485 bus, under CPython.
+For each receive mode and baud rate, reports transactions per second, the slave turnaround
+from the end of the request to the start of the response as percentiles, and CPU time per transaction,
+which includes the master and the simulation.
+The last run adds line noise, and reports how the decoder copes.
+"""
+from bench_util import ticks_us, ticks_diff, report, percentiles, cpu_us
+
+import sim
+sim.install()
+
+from uasyncio import run, create_task, sleep_ms, TimeoutError
+
+from modbus_frame import ModbusFrame
+from modbus_master import ModbusRTUMaster
+from modbus_rtu import ModbusRTUClient
+
+TRANSACTIONS = 200
+
+
+async def bench(baudrate, rx_mode, noise_rate=0.0):
+    bus = sim.RS485Bus(baudrate, noise_rate=noise_rate)
+    bus.attach(0, de_pin=11)
+    bus.attach(1, de_pin=21)
+    client = ModbusRTUClient(1, 12, 13, 11, uart=0, baudrate=baudrate, rx_mode=rx_mode)
+    master = ModbusRTUMaster(22, 23, 21, uart=1, baudrate=baudrate, timeout_ms=50)
+    task = create_task(client.runloop())
+    await sleep_ms(10)
+    request = ModbusFrame.read_holding_registers(1, 0, 10).to_bytes()
+
+    failed = 0
+    start, cpu_start = ticks_us(), cpu_us()
+    for _ in range(TRANSACTIONS):
+        try:
+            await master.transact(request)
+        except TimeoutError:
+            failed += 1
+    elapsed, cpu = ticks_diff(ticks_us(), start), cpu_us() - cpu_start
+    task.cancel()
+    client.serial.task.cancel()
+    master.serial.task.cancel()
+
+    name = "%d baud, %s%s" % (baudrate, rx_mode, ", noise" if noise_rate else "")
+    report(name, TRANSACTIONS - failed, elapsed, "transactions")
+    print("    turnaround p50/p90/p99: %d/%d/%d us, cpu: %d us/transaction, timeouts: %d" %
+          (*percentiles(bus.turnarounds.get(0, ())), cpu // TRANSACTIONS, failed))
+    if noise_rate:
+        print("    %s, slave %s" % (bus.stats(), client.stats))
+
+
+async def main():
+    for baudrate in (19200, 115200, 921600):
+        for rx_mode in ('irq', 'stream', 'poll'):
+            await bench(baudrate, rx_mode)
+    await bench(115200, 'irq', noise_rate=0.002)
+
+
+run(main())
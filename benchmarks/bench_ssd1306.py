@@ -0,0 +1,73 @@
+"""
+I2C bytes sent per SSD1306.show() against a fake I2C bus, for full flushes
+and for dirty region flushes, over typical status display updates.
+"""
+from bench_util import timeit
+from sys import implementation
+
+if implementation.name != 'micropython':
+    import sim
+    sim.install()
+
+from ssd1306 import SSD1306_I2C  # noqa: E402
+
+
+class FakeI2C:
+    """ Counts the bytes written, including the address byte of each transfer """
+    def __init__(self):
+        self.bytes = 0
+        self.transfers = 0
+
+    def writeto(self, addr, buf):
+        self.bytes += len(buf) + 1
+        self.transfers += 1
+
+    def writevto(self, addr, bufs):
+        self.bytes += sum(len(buf) for buf in bufs) + 1
+        self.transfers += 1
+
+
+def unchanged(display, i):
+    pass
+
+
+def one_line(display, i):
+    display.fill_rect(0, 56, 128, 8, 0)
+    display.text("%d" % i, 0, 56)
+
+
+def all_lines(display, i):
+    display.fill(0)
+    for line in range(8):
+        display.text("%d:%d" % (line, i), 0, line * 8)
+
+
+def redraw_same(display, i):
+    display.fill(0)
+    for line in range(8):
+        display.text("line %d" % line, 0, line * 8)
+
+
+def measure(update, full, frames=50):
+    i2c = FakeI2C()
+    display = SSD1306_I2C(128, 64, i2c)
+    redraw_same(display, 0)
+    display.show(full=True)
+    i2c.bytes = i2c.transfers = 0
+
+    def run():
+        for i in range(frames):
+            update(display, i)
+            display.show(full=full)
+    _, elapsed = timeit(run)
+    return i2c.bytes // frames, i2c.transfers // frames, elapsed // frames
+
+
+def main():
+    print("%-14s %22s %22s" % ("update", "full bytes/xfers/us", "dirty bytes/xfers/us"))
+    for update in (unchanged, one_line, redraw_same, all_lines):
+        print("%-14s %22s %22s" % (update.__name__, "%d/%d/%d" % measure(update, True),
+                                   "%d/%d/%d" % measure(update, False)))
+
+
+main()
@@ -0,0 +1,79 @@
+"""
+Cost of ignoring traffic for other devices on a busy bus, per frame from the decoder:
+parsing every frame and comparing its address, against the lookup on the raw address byte,
+and the unit dispatch for a node answering as one and as eight units.
+"""
+from bench_util import LCG, timeit, report, alloc_per_call
+
+from modbus_frame import ModbusFrame
+from modbus_unit import ModbusUnit
+from rtu_decoder import RTUDecoder
+
+FRAMES = 2000
+
+
+def make_stream(own, foreign_share=90, seed=1):
+    rand = LCG(seed)
+    frames = []
+    for _ in range(FRAMES):
+        if rand.next() % 100 < foreign_share:
+            address = 100 + rand.next() % 100
+        else:
+            address = own[rand.next() % len(own)]
+        frames.append(bytes(ModbusFrame.read_holding_registers(address, rand.next() % 100, 10).to_bytes()))
+    return b''.join(frames)
+
+
+def parse_then_check(stream, address):
+    handled = 0
+    for frame in RTUDecoder().feed(stream):
+        if ModbusFrame.parse_frame(frame, check_crc=False).address == address:
+            handled += 1
+    return handled
+
+
+def raw_check(stream, accept):
+    handled = 0
+    for frame in RTUDecoder().feed(stream):
+        if accept[frame[0]]:
+            handled += 1
+    return handled
+
+
+def parse_one(frame, address):
+    return ModbusFrame.parse_frame(frame, check_crc=False).address == address
+
+
+def lookup_one(frame, accept):
+    return accept[frame[0]]
+
+
+def dispatch(stream, accept, units):
+    for frame in RTUDecoder().feed(stream):
+        if accept[frame[0]]:
+            parsed = ModbusFrame.parse_frame(frame, check_crc=False)
+            units[parsed.address].handle(parsed)
+
+
+def main():
+    for own in ((1,), tuple(range(1, 9))):
+        units = {address: ModbusUnit(address) for address in own}
+        accept = bytearray(256)
+        for address in own:
+            accept[address] = 1
+        stream = make_stream(own)
+        print("%d unit(s), 90%% foreign traffic" % len(own))
+        if len(own) == 1:
+            handled, elapsed = timeit(parse_then_check, stream, own[0])
+            report("  parse, then check (%d)" % handled, FRAMES, elapsed)
+        handled, elapsed = timeit(raw_check, stream, accept)
+        report("  address byte lookup (%d)" % handled, FRAMES, elapsed)
+        _, elapsed = timeit(dispatch, stream, accept, units)
+        report("  lookup + dispatch", FRAMES, elapsed)
+    # Per frame, not the peak of a whole stream divided by its frames, which is the decoder buffer for both
+    frame = memoryview(bytearray(ModbusFrame.read_holding_registers(150, 0, 10).to_bytes()))
+    print("%32.1f bytes allocated/frame, parse" % alloc_per_call(parse_one, frame, 1))
+    print("%32.1f bytes allocated/frame, lookup" % alloc_per_call(lookup_one, frame, accept))
+
+
+main()
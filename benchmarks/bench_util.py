@@ -0,0 +1,91 @@
+"""
+Shared helpers for the benchmarks, they run under both MicroPython and CPython.
+Benchmarks are run from the repository root, for example:
+    python benchmarks/bench_rtu_decoder.py
+"""
+from sys import path
+
+if '' not in path and '.' not in path:
+    path.append('.')
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+
+class LCG:
+    """ Small deterministic random generator, MicroPython's random is not always available """
+    def __init__(self, seed=1):
+        self.state = seed
+
+    def next(self):
+        self.state = (self.state * 1103515245 + 12345) & 0x7FFFFFFF
+        return self.state >> 16
+
+    def bytes(self, n):
+        return bytes(self.next() & 0xFF for _ in range(n))
+
+
+def timeit(func, *args):
+    """ Returns the result of func and the time it took, in us """
+    start = ticks_us()
+    result = func(*args)
+    return result, ticks_diff(ticks_us(), start)
+
+
+def report(name, count, elapsed_us, unit="frames"):
+    rate = count * 1000000 / elapsed_us if elapsed_us else 0
+    print("%-28s %8d %s in %8d us, %10.1f %s/s" % (name, count, unit, elapsed_us, rate, unit))
+
+
+def alloc_per_call(func, *args, n=1000):
+    """
+    Bytes allocated per call of func.
+    MicroPython counts all heap allocations with the collector disabled,
+    CPython reports the traced peak of a single call.
+    """
+    import gc
+    if hasattr(gc, 'mem_alloc'):
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(n):
+            func(*args)
+        after = gc.mem_alloc()
+        gc.enable()
+        return (after - before) / n
+    import tracemalloc
+    tracemalloc.start()
+    func(*args)  # warm up caches
+    total = 0
+    for _ in range(n):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func(*args)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / n
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """ Nearest rank percentiles of samples """
+    ordered = sorted(samples)
+    if not ordered:
+        return [0 for _ in points]
+    return [ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points]
+
+
+def cpu_us():
+    """ Process CPU time in us on CPython, wall time on MicroPython where there is nothing else running """
+    try:
+        from time import process_time_ns
+    except ImportError:
+        return ticks_us()
+    return process_time_ns() // 1000
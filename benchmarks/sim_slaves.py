@@ -0,0 +1,33 @@
+"""
+Simulated RTU slaves behind an RS485 like link, for the master and gateway benchmarks.
+"""
+from uasyncio import Event, create_task, sleep_ms
+
+from modbus_frame import ModbusFrame
+from ring_queue import RingQueue
+from stats import Stats
+
+
+class SimSlaveLink:
+    """ An RS485 like link to simulated slaves, offline units never answer """
+    def __init__(self, units, baudrate=9600, offline=()):
+        self.units = units
+        self.offline = offline
+        self.char_us = 11 * 1000000 / baudrate
+        self.messages = RingQueue(8, 256)
+        self.received = Event()
+        self.idle = True
+        self.stats = Stats()
+
+    async def send(self, data):
+        await sleep_ms(int(len(data) * self.char_us // 1000))
+        unit = self.units.get(data[0])
+        if unit is None or data[0] in self.offline:
+            return
+        response = unit.handle(ModbusFrame.parse_frame(data)).to_bytes()
+        create_task(self._deliver(response))
+
+    async def _deliver(self, response):
+        await sleep_ms(int(len(response) * self.char_us // 1000))
+        self.messages.put(response)
+        self.received.set()
@@ -0,0 +1,26 @@
+"""
+Copies between preallocated buffers, for the paths which must not allocate.
+Slicing a buffer or a memoryview creates a new object, copy_into does not on MicroPython.
+"""
+
+
+def _copy_into(dst, offset, src, start, length):
+    dst[offset:offset + length] = memoryview(src)[start:start + length]
+
+
+copy_into = _copy_into
+try:
+    import micropython
+
+    @micropython.viper
+    def _copy_into_viper(dst, offset: int, src, start: int, length: int):
+        d = ptr8(dst)  # viper builtin
+        s = ptr8(src)  # viper builtin
+        i = 0
+        while i < length:
+            d[offset + i] = s[start + i]
+            i += 1
+
+    copy_into = _copy_into_viper
+except (ImportError, AttributeError, SyntaxError, ValueError):
+    pass  # CPython, or a port built without the viper emitter
@@ -0,0 +1,193 @@
+"""
+Capture of the raw RS485 traffic to a compact binary log, for replay on the host with tools/bus_replay.py.
+
+The log starts with a header, followed by one record per received or transmitted chunk:
+    header: magic, format version, baud rate, data bits, parity (0xFF for none), stop bits
+    record: ticks_us, port << 1 | direction, length, then length bytes of data
+The log is appended to across resets, a reset is when it is needed most. The header is only
+written to a new log, every boot appends a session record, CAP_SESSION with SESSION_MAGIC and its
+own offset in the file, so the replay can find where a session starts after a record torn by a reset.
+Once the log reaches max_bytes it is renamed to path.old, replacing the one before, and a new log
+is started, so the capture never takes more than twice max_bytes of flash. A log with other line
+settings is also kept as path.old.
+
+Records are packed into one of two preallocated buffers while the other is written out by
+runloop(), so capturing a chunk is a copy, and the flash is written in small chunks while the
+bus is quiet. When both buffers are full, chunks are dropped and counted, the log never blocks the bus.
+
+Timestamps are ticks_us, which wrap, the replay unwraps them assuming records are less than
+half a ticks period apart.
+"""
+from os import rename
+from struct import calcsize, pack, pack_into
+from uasyncio import Event, sleep_ms, wait_for_ms, TimeoutError
+from utime import ticks_ms, ticks_us
+
+from buffers import copy_into
+
+
+CAPTURE_MAGIC = b'MBCP'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = '<4sBIBBB'  # magic, version, baud rate, data bits, parity, stop bits
+CAPTURE_HEADER_LENGTH = calcsize(CAPTURE_HEADER)
+RECORD_HEADER = '<IBH'  # ticks_us, port << 1 | direction, data length
+RECORD_HEADER_LENGTH = calcsize(RECORD_HEADER)
+CAP_RX = 0
+CAP_TX = 1
+CAP_SESSION = 0xFF  # Record kind starting a session, its data is SESSION_MAGIC and the record offset
+SESSION_MAGIC = b'MBSS'
+SESSION_LENGTH = len(SESSION_MAGIC) + 4
+NO_PARITY = 0xFF
+WRITE_CHUNK = 512  # Bytes written to flash at a time, while the bus is quiet
+
+
+class BusCapture:
+    """
+    Appends the chunks recorded by attached RS485 links to path.
+
+    buffer_size: bytes held in memory per buffer before a bulk write
+    flush_ms: longest time a partly filled buffer is held before it is written
+    max_bytes: size of the log after which it is moved to path.old
+    wait_quiet: async function returning once flash writes no longer delay the bus,
+                such as ModbusRTUClient.wait_quiet, awaited before each chunk
+    fs: object with open(path, mode) and rename(old, new), the builtin open and os.rename by default
+    """
+    def __init__(self, path, baudrate, data_bits=8, parity=0, stop_bits=1, buffer_size=4096,
+                 flush_ms=1000, max_bytes=262144, wait_quiet=None, fs=None, debug=False):
+        self.path = path
+        self.flush_ms = flush_ms
+        self.max_bytes = max_bytes
+        self.wait_quiet = wait_quiet
+        self.open = open if fs is None else fs.open
+        self.rename = rename if fs is None else fs.rename
+        self.debug = debug
+        self.buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+        self.active = 0  # Index of the buffer records are packed into
+        self.fill = 0  # Bytes used in the active buffer
+        self.full = -1  # Index of the buffer waiting to be written, -1 for none
+        self.full_length = 0
+        self.ready = Event()  # Set when a buffer is full
+        self.records = 0
+        self.dropped = 0  # Chunks lost with both buffers full
+        self.bytes_written = 0
+        self.bytes_lost = 0  # Captured bytes which could not be written
+        self.rotations = 0
+        self.header = pack(CAPTURE_HEADER, CAPTURE_MAGIC, CAPTURE_VERSION, baudrate, data_bits,
+                           NO_PARITY if parity is None else parity, stop_bits)
+        try:
+            with self.open(path, 'rb') as f:
+                existing = f.read(CAPTURE_HEADER_LENGTH)
+        except OSError:
+            existing = None
+        if existing is not None and existing != self.header:
+            self.log("BusCapture: %s has other line settings, keeping it as %s.old" % (path, path))
+            self.rename(path, path + '.old')
+        self.size = 0  # Bytes in the log
+        self._start_session()
+
+    def _start_session(self):
+        """ Appends a session record, after the header when the log is new """
+        with self.open(self.path, 'ab') as f:
+            offset = f.seek(0, 2)
+            if not offset:
+                f.write(self.header)
+                offset = CAPTURE_HEADER_LENGTH
+            f.write(pack(RECORD_HEADER, ticks_us(), CAP_SESSION, SESSION_LENGTH) + SESSION_MAGIC + pack('<I', offset))
+        self.size = offset + RECORD_HEADER_LENGTH + SESSION_LENGTH
+        self.log("BusCapture: Session started at offset %d of %s" % (offset, self.path))
+
+    def _rotate(self):
+        """ Moves a log which would grow past max_bytes to path.old, and starts a new one """
+        self.rename(self.path, self.path + '.old')
+        self.rotations += 1
+        self._start_session()
+
+    def log(self, msg):
+        if self.debug:
+            print("[%d] %s" % (ticks_ms(), msg))
+
+    def attach(self, serial, port=0):
+        """ Captures the traffic of an RS485 link, as port in the records """
+        serial.capture = self
+        serial.capture_port = port
+        return serial
+
+    def record(self, port, direction, data, length):
+        """ Packs a chunk of length bytes from data, called from the receive and transmit paths """
+        size = RECORD_HEADER_LENGTH + length
+        buf = self.buffers[self.active]
+        if self.fill + size > len(buf):
+            if self.full >= 0 or size > len(buf):
+                self.dropped += 1
+                return
+            self._swap()
+            buf = self.buffers[self.active]
+        pack_into(RECORD_HEADER, buf, self.fill, ticks_us(), port << 1 | direction, length)
+        copy_into(buf, self.fill + RECORD_HEADER_LENGTH, data, 0, length)
+        self.fill += size
+        self.records += 1
+
+    def _swap(self):
+        """ Hands the active buffer to runloop() and packs into the other """
+        self.full, self.full_length = self.active, self.fill
+        self.active ^= 1
+        self.fill = 0
+        self.ready.set()
+
+    def _chunks(self, chunk):
+        """
+        Writes the full buffer chunk bytes at a time, a generator yielding before each chunk.
+        A failed write counts the buffer as lost, the buffer is released either way.
+        """
+        if self.full < 0:
+            return
+        view, length = memoryview(self.buffers[self.full]), self.full_length
+        try:
+            if self.size + length > self.max_bytes:
+                self._rotate()
+            with self.open(self.path, 'ab') as f:
+                for offset in range(0, length, chunk):
+                    yield
+                    f.write(view[offset:min(offset + chunk, length)])
+            self.size += length
+            self.bytes_written += length
+        except OSError:
+            self.bytes_lost += length
+            raise
+        finally:
+            self.full = -1
+
+    def _write(self):
+        """ Writes the full buffer at once """
+        for _ in self._chunks(len(self.buffers[0])):
+            pass
+
+    def flush(self):
+        """ Writes everything captured so far, at once, for shutdown """
+        self._write()
+        if self.fill:
+            self._swap()
+            self._write()
+        self.ready.clear()
+
+    async def runloop(self):
+        """ Writes full buffers as they fill, and partly filled ones every flush_ms """
+        while True:
+            try:
+                await wait_for_ms(self.ready.wait(), self.flush_ms)
+            except TimeoutError:
+                pass
+            self.ready.clear()
+            if self.full < 0 and self.fill:
+                self._swap()
+                self.ready.clear()
+            chunks = self._chunks(WRITE_CHUNK)
+            try:
+                for _ in chunks:
+                    if self.wait_quiet is not None:
+                        await self.wait_quiet()
+                    await sleep_ms(0)
+            except OSError as e:
+                self.log("BusCapture: Write failed, %d bytes lost: %s" % (self.bytes_lost, e))
+            finally:
+                chunks.close()  # Closes the log when cancelled between chunks
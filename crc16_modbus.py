@@ -1,8 +1,12 @@
+from array import array
 from struct import pack
 
 
+CRC16_INIT = 0xFFFF
+
+
 def generate_crc16_table():
-    crc_table = []
+    crc_table = array('H')
     for byte in range(256):
         crc = 0x0000
         for _ in range(8):
@@ -18,10 +22,76 @@ def generate_crc16_table():
 CRC16_TABLE = generate_crc16_table()
 
 
+def _crc16_update(buf, start, end, crc):
+    table = CRC16_TABLE
+    for char in memoryview(buf)[start:end]:
+        crc = (crc >> 8) ^ table[(crc ^ char) & 0xFF]
+    return crc
+
+
+crc16_update = _crc16_update
+try:
+    import micropython
+
+    @micropython.viper
+    def _crc16_update_viper(buf, start: int, end: int, crc: int) -> int:
+        data = ptr8(buf)  # viper builtin
+        table = ptr16(CRC16_TABLE)  # viper builtin
+        i = start
+        while i < end:
+            crc = (crc >> 8) ^ table[(crc ^ data[i]) & 0xFF]
+            i += 1
+        return crc
+
+    crc16_update = _crc16_update_viper
+except (ImportError, AttributeError, SyntaxError, ValueError):
+    pass  # CPython, or a port built without the viper emitter
+
+
+def crc16(data, start=0, end=None, crc=CRC16_INIT):
+    """
+    Returns the CRC of data[start:end] as an int, continuing from crc.
+    Over a frame including its CRC the result is 0, so frames are checked without slicing.
+    """
+    return crc16_update(data, start, len(data) if end is None else end, crc)
+
+
+def check_crc16(data, start=0, end=None):
+    """ True when data[start:end] ends with a valid CRC """
+    return not crc16_update(data, start, len(data) if end is None else end, CRC16_INIT)
+
+
 def calculate_crc16(data):
-    crc = 0xFFFF
+    """ Returns the packed little-endian CRC of data """
+    return pack('<H', crc16_update(data, 0, len(data), CRC16_INIT))
+
+
+class CRC16:
+    """
+    Incremental CRC, updated as bytes arrive.
+    Once the CRC bytes of a frame have been added, valid is True the moment the last byte lands.
+    """
+    __slots__ = ('crc',)
+
+    def __init__(self, data=None):
+        self.crc = CRC16_INIT
+        if data is not None:
+            self.update(data)
+
+    def reset(self):
+        self.crc = CRC16_INIT
+
+    def update(self, data, start=0, end=None):
+        self.crc = crc16_update(data, start, len(data) if end is None else end, self.crc)
+        return self
+
+    def update_byte(self, char):
+        self.crc = (self.crc >> 8) ^ CRC16_TABLE[(self.crc ^ char) & 0xFF]
+        return self
 
-    for char in data:
-        crc = (crc >> 8) ^ CRC16_TABLE[((crc) ^ char) & 0xFF]
+    @property
+    def valid(self):
+        return self.crc == 0
 
-    return pack('<H', crc)
+    def digest(self):
+        return pack('<H', self.crc)
@@ -1,10 +1,21 @@
 from ssd1306 import SSD1306_I2C
 from asyncio import sleep_ms
+import framebuf
 
 from text_buffer import TextBuffer
 
 
+GLYPH_FIRST = 32  # The framebuf font covers printable ASCII
+GLYPH_COUNT = 96
+
+
 class Display:
+    """
+    Text display on an SSD1306.
+    Glyphs are rasterised once into a FrameBuffer atlas, in the same MONO_VLSB layout as the display,
+    so an 8 pixel text row is one display page and each glyph is 8 column bytes.
+    Rendered rows are cached by their text, and a redraw only copies rows whose text changed.
+    """
     MODES = ['text', 'info']
 
     def __init__(self, i2c, display_x=128, display_y=64, display_mode='text',
@@ -20,9 +31,19 @@ class Display:
         self.display = SSD1306_I2C(display_x, display_y, i2c)
         self.text_lines = TextBuffer(line_length=self.line_length, display_lines=self.display_lines)
 
+        self.glyphs = bytearray(GLYPH_COUNT * 8)
+        self.glyph_view = memoryview(self.glyphs)
+        atlas = framebuf.FrameBuffer(self.glyphs, GLYPH_COUNT * 8, 8, framebuf.MONO_VLSB)
+        for i in range(GLYPH_COUNT):
+            atlas.text(chr(GLYPH_FIRST + i), i * 8, 0)
+        self.row_cache = {}  # Row text: rendered page bytes
+        self.row_cache_size = 32
+        self.row_text = [None] * self.display_lines  # Text currently drawn on each row
+
     async def start(self):
         print("Starting display.")
         self.display.fill(0)
+        self.row_text = [None] * self.display_lines
         self.text_lines += 'Starting...\n'
         self.display.show()
 
@@ -33,15 +54,39 @@ class Display:
             await self.display_text()
             self.display.show()
 
+    def get_rows(self):
+        """ The text of every display row, empty rows are padded with '' """
+        rows = self.text_lines.get_page(0)
+        return rows + [''] * (self.display_lines - len(rows))
+
     async def display_text(self):
-        self.display.fill(0)
-        display_text = self.text_lines.get_page(0)
-        for line_number, line in enumerate(display_text):
+        for line_number, line in enumerate(self.get_rows()):
             await self.set_line(line_number, line)
 
     async def set_line(self, line_number, text):
-        for char_number, char in enumerate(text):
-            text_char = chr(char) if isinstance(char, int) else char
-            self.display.text(text_char, char_number * 8, line_number * 8)
+        self.render_line(line_number, text)
+
+    def rasterise(self, text):
+        """ Renders text into the bytes of one display page by copying glyphs from the atlas """
+        row = bytearray(self.display_x)
+        glyphs = self.glyph_view
+        for char_number, char in enumerate(text[:self.line_length]):
+            index = (char if isinstance(char, int) else ord(char)) - GLYPH_FIRST
+            if 0 <= index < GLYPH_COUNT:
+                row[char_number * 8:char_number * 8 + 8] = glyphs[index * 8:index * 8 + 8]
+        return row
+
+    def render_line(self, line_number, text):
+        """ Draws text on a row, unless the row already shows it """
+        key = text if isinstance(text, str) else bytes(text)
+        if self.row_text[line_number] == key:
+            return
+        if (row := self.row_cache.get(key)) is None:
+            if len(self.row_cache) >= self.row_cache_size:
+                self.row_cache.clear()
+            row = self.row_cache[key] = self.rasterise(text)
+        start = line_number * self.display_x
+        self.display.buffer[start:start + self.display_x] = row
+        self.row_text[line_number] = key
 
 
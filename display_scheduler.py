@@ -0,0 +1,94 @@
+from asyncio import sleep_ms
+from utime import ticks_us, ticks_ms, ticks_diff
+
+
+class DisplayScheduler:
+    """
+    Refreshes a Display in small chunks which yield to the event loop,
+    so a redraw never holds the loop while the Modbus client has a frame in flight.
+
+    Each chunk renders one text row, or flushes at most flush_columns columns of a changed page.
+    Chunks wait while client.busy is set, a frame being received or a response pending.
+    The refresh interval doubles while the bus carried frames in the last interval, up to max_interval_ms,
+    and halves back to interval_ms once it is quiet.
+
+    The time each chunk holds the loop is compared with budget_us, the response turnaround
+    the client can tolerate, the worst case is reported as the remaining slack.
+    """
+    def __init__(self, display, client=None, interval_ms=1000, max_interval_ms=8000,
+                 flush_columns=32, budget_us=1750):
+        self.display = display
+        self.client = client
+        self.base_interval = interval_ms
+        self.max_interval = max_interval_ms
+        self.interval = interval_ms
+        self.flush_columns = flush_columns
+        self.budget_us = budget_us
+        self.chunks = 0
+        self.overruns = 0  # Chunks which held the loop longer than budget_us
+        self.max_chunk_us = 0
+        self.total_chunk_us = 0
+        self.deferrals = 0  # Times a chunk waited for the bus
+        self.refreshes = 0
+
+    @property
+    def slack_us(self):
+        """ Turnaround budget left after the longest chunk, negative if a redraw delayed a response """
+        return self.budget_us - self.max_chunk_us
+
+    def __str__(self):
+        return ("refreshes: %d, interval: %d ms, chunks: %d, max chunk: %d us, mean chunk: %d us, "
+                "slack: %d us, overruns: %d, deferrals: %d" %
+                (self.refreshes, self.interval, self.chunks, self.max_chunk_us,
+                 self.total_chunk_us // self.chunks if self.chunks else 0,
+                 self.slack_us, self.overruns, self.deferrals))
+
+    async def wait_bus(self):
+        """ Yields, then waits until the client has nothing in flight """
+        await sleep_ms(0)
+        while self.client is not None and self.client.busy:
+            self.deferrals += 1
+            await sleep_ms(1)
+
+    def _record(self, start):
+        elapsed = ticks_diff(ticks_us(), start)
+        self.chunks += 1
+        self.total_chunk_us += elapsed
+        if elapsed > self.max_chunk_us:
+            self.max_chunk_us = elapsed
+        if elapsed > self.budget_us:
+            self.overruns += 1
+
+    def _bus_messages(self):
+        return self.client.bus_messages if self.client is not None else 0
+
+    async def refresh(self):
+        """ Renders every row, then flushes the changed regions, one chunk at a time """
+        for line_number, line in enumerate(self.display.get_rows()):
+            await self.wait_bus()
+            start = ticks_us()
+            self.display.render_line(line_number, line)
+            self._record(start)
+
+        ssd1306 = self.display.display
+        for page, x0, x1 in ssd1306.dirty_regions():
+            for chunk_x0 in range(x0, x1 + 1, self.flush_columns):
+                await self.wait_bus()
+                start = ticks_us()
+                ssd1306.flush_region(page, chunk_x0, min(chunk_x0 + self.flush_columns - 1, x1))
+                self._record(start)
+        self.refreshes += 1
+
+    async def runloop(self):
+        await self.display.start()
+        while True:
+            messages = self._bus_messages()
+            started = ticks_ms()
+            await sleep_ms(self.interval)
+            if self._bus_messages() != messages:
+                self.interval = min(self.interval * 2, self.max_interval)
+            else:
+                self.interval = max(self.interval // 2, self.base_interval)
+            await self.refresh()
+            if self.client is not None and self.client.debug:
+                self.client.log("Display refresh %d ms after the last: %s" % (ticks_diff(ticks_ms(), started), self))
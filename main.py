@@ -1,6 +1,7 @@
 from uasyncio import run, create_task
 from modbus_rtu import ModbusRTUClient
 from display import Display
+from display_scheduler import DisplayScheduler
 from machine import I2C, Pin
 from utime import sleep_ms
 
@@ -8,7 +9,6 @@ display_i2c = I2C(1, scl=Pin(27), sda=Pin(26))
 
 try:
     display = Display(display_i2c)
-    create_task(display.runloop())
     display.text_lines += "MB RTU client\n"
 except Exception as e:
     print(e)
@@ -16,8 +16,12 @@ except Exception as e:
     sleep_ms(500)
 
 
-client = ModbusRTUClient(1, 12, 13, 11, baudrate=921600, debug=True, display_lines=display.text_lines)
+client = ModbusRTUClient(1, 12, 13, 11, baudrate=921600, debug=True,
+                         display_lines=display.text_lines if display else None)
 
+if display:
+    # Redraws yield to the client, so a refresh never delays a response
+    create_task(DisplayScheduler(display, client, budget_us=client.serial.frame_gap).runloop())
 
-run(client.runloop())
 
+run(client.runloop())
@@ -1,92 +1,280 @@
-from crc16_modbus import calculate_crc16
-from struct import pack, unpack
+from crc16_modbus import crc16
+from struct import calcsize, pack, pack_into, unpack_from
 
 
+# Function code: (request parameter format, name)
+# Requests ending in a byte count ('B') are followed by that many bytes of payload
 FUNCTION_CODES = {1: ('HH', "read_coils"),
-                  2: "Read Discrete Inputs",
+                  2: ('HH', "read_discrete_inputs"),
                   3: ('HH', "read_holding_registers"),
-                  4: "Read Input Registers",
-                  5: "Write Single Coil",
-                  6: "Write Single Register",
-                  15: "Write Multiple Coils",
-                  16: "Write Multiple Registers"}
+                  4: ('HH', "read_input_registers"),
+                  5: ('HH', "write_single_coil"),
+                  6: ('HH', "write_single_register"),
+                  8: ('HH', "diagnostics"),
+                  11: ('', "get_comm_event_counter"),
+                  15: ('HHB', "write_multiple_coils"),
+                  16: ('HHB', "write_multiple_registers"),
+                  23: ('HHHHB', "read_write_multiple_registers")}
+
+# Responses with fixed parameters, all other responses are a byte count followed by data
+RESPONSE_PARAMS = {5: 'HH', 6: 'HH', 8: 'HH', 11: 'HH', 15: 'HH', 16: 'HH'}
+
+# FC8 diagnostics sub-functions, each request and response carries a single data word
+DIAG_RETURN_QUERY_DATA = 0x00
+DIAG_RESTART_COMMUNICATIONS = 0x01
+DIAG_RETURN_DIAGNOSTIC_REGISTER = 0x02
+DIAG_CLEAR_COUNTERS = 0x0A
+DIAG_BUS_MESSAGE_COUNT = 0x0B
+DIAG_BUS_COMM_ERROR_COUNT = 0x0C
+DIAG_BUS_EXCEPTION_ERROR_COUNT = 0x0D
+DIAG_SERVER_MESSAGE_COUNT = 0x0E
+DIAG_SERVER_NO_RESPONSE_COUNT = 0x0F
+DIAG_SERVER_NAK_COUNT = 0x10
+DIAG_SERVER_BUSY_COUNT = 0x11
+DIAG_BUS_CHARACTER_OVERRUN_COUNT = 0x12
+# Vendor sub-functions, outside the range used by the specification
+DIAG_LATENCY_BUCKET = 0x0100  # data is the histogram bucket index
+DIAG_RESYNC_COUNT = 0x0101
+DIAG_FOREIGN_FRAME_COUNT = 0x0102
+
+# Exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+SERVER_DEVICE_FAILURE = 4
+SERVER_DEVICE_BUSY = 6
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_TARGET_FAILED = 0x0B
+
+EXCEPTION_FORMAT = ">BBB"
+
+# Precomputed struct formats and header lengths, without the CRC or payload
+REQUEST_FORMATS = {function: ">BB" + params[0] for function, params in FUNCTION_CODES.items()}
+RESPONSE_FORMATS = {function: ">BB" + params for function, params in RESPONSE_PARAMS.items()}
+HEADER_LENGTHS = {fmt: calcsize(fmt) for fmt in
+                  tuple(REQUEST_FORMATS.values()) + tuple(RESPONSE_FORMATS.values()) + (EXCEPTION_FORMAT,)}
+PAYLOAD_FUNCTIONS = tuple(function for function, params in FUNCTION_CODES.items() if params[0].endswith('B'))
+
+
+def append_crc(buf, length, offset=0):
+    """ Writes the CRC of the frame in buf[offset:offset + length] after it, returns the length with the CRC """
+    value = crc16(buf, offset, offset + length)
+    buf[offset + length] = value & 0xFF
+    buf[offset + length + 1] = value >> 8
+    return length + 2
 
 
 class FrameTooShortError(Exception):
     pass
 
 
+class ModbusException(Exception):
+    """ Raised to answer a request with a Modbus exception response """
+    def __init__(self, code, msg=None):
+        self.code = code
+        super().__init__(msg or "Modbus exception: %d" % code)
+
+
 class ModbusFrame:
+    """
+    A Modbus RTU frame.
+    data is a tuple of the fixed parameters, or the data of a byte count response.
+    payload holds the data following the byte count of multiple write requests.
+    Exception responses use the function code with the high bit set, and the exception code as data.
+
+    The encoded frame, including the CRC, is built once and cached,
+    pdu and crc are slices of that cache.
+    """
+    __slots__ = ('address', 'function', 'data', 'payload', 'response', '_encoded')
+
     @staticmethod
-    def parse_frame(frame_bytes):
-        """ Attempts to parse a modbus frame from a bytearray """
-        if len(frame_bytes) < 6:
+    def parse_frame(frame_bytes, check_crc=True, stats=None):
+        """
+        Attempts to parse a modbus request frame from a bytearray.
+        check_crc can be disabled when the frame was already checked by the decoder,
+        CRC errors are counted in stats if given.
+        Raises ModbusException for requests which must be answered with an exception response.
+        """
+        if len(frame_bytes) < 4:
             raise FrameTooShortError("Frame too short: %d" % len(frame_bytes))
-        address, function = unpack(">BB", frame_bytes[:2])
+        address, function = frame_bytes[0], frame_bytes[1]
 
         if address > 247:
             raise ValueError("Invalid address: %d" % address)
 
         if function not in FUNCTION_CODES:
-            raise ValueError("Function code not supported: %d" % function)
+            raise ModbusException(ILLEGAL_FUNCTION, "Function code not supported: %d" % function)
+
+        fmt = REQUEST_FORMATS[function]
+        header = HEADER_LENGTHS[fmt]
+        if len(frame_bytes) < header + 2:
+            raise FrameTooShortError("Frame too short: %d < %d" % (len(frame_bytes), header + 2))
+        data = unpack_from(fmt, frame_bytes)[2:]
 
-        try:
-            func = getattr(ModbusFrame, FUNCTION_CODES[function][1])
-        except AttributeError:
-            raise NotImplementedError("Function not implemented: %s" % FUNCTION_CODES[function][1])
-        params = FUNCTION_CODES[function][0]
+        payload = None
+        length = header + 2
+        if function in PAYLOAD_FUNCTIONS:
+            length += data[-1]
+            if len(frame_bytes) < length:
+                raise ModbusException(ILLEGAL_DATA_VALUE, "Byte count exceeds frame: %d" % data[-1])
+            payload = bytes(frame_bytes[header:length - 2])
 
-        frame = func(address, *unpack(">" + params, frame_bytes[len(params):]))
-        data_crc = frame_bytes[len(frame.pdu):len(frame.pdu) + 2]
-        if data_crc != frame.crc:
-            raise ValueError("CRC mismatch: %s != %s" % (data_crc, frame.crc))
+        if check_crc and crc16(frame_bytes, 0, length):  # Zero over the data and a valid CRC
+            if stats is not None:
+                stats.bus_comm_errors += 1
+            raise ValueError("CRC mismatch: %s != %04x" % (bytes(frame_bytes[length - 2:length]),
+                                                           crc16(frame_bytes, 0, length - 2)))
 
+        frame = ModbusFrame(address, function, data, payload=payload)
+        frame._encoded = bytes(frame_bytes[:length])
         return frame
 
-    def __init__(self, address, function, data, response=False):
-        if function not in FUNCTION_CODES:
+    def __init__(self, address, function, data, response=False, payload=None):
+        if function not in FUNCTION_CODES and not function & 0x80:
             raise ValueError("Function code not supported: %d" % function)
 
         self.address = address
         self.function = function
+        self.response = response
         if isinstance(data, tuple):
-            if len(data) != len(FUNCTION_CODES[function][0]):
-                raise ValueError("Invalid data length: %d != %d" %
-                                 (len(data), len(FUNCTION_CODES[function][0])))
+            if len(data) != len(self.format) - 3:
+                raise ValueError("Invalid data length: %d != %d" % (len(data), len(self.format) - 3))
         elif response:
             if len(data) < 1 or len(data) > 253:
                 raise ValueError("Invalid data length: %d" % len(data))
         self.data = data
-        self.response = response
+        self.payload = payload
+        self._encoded = None
 
-    def __str__(self):
-        return f"Address: {self.address}, Function: {FUNCTION_CODES[self.function][1]}, Data: {self.data}"
+    @property
+    def format(self):
+        """ The struct format of the frame header, for frames with fixed parameters """
+        if self.function & 0x80:
+            return EXCEPTION_FORMAT
+        if self.response:
+            return RESPONSE_FORMATS[self.function]
+        return REQUEST_FORMATS[self.function]
 
-    def to_bytes(self):
-        return self.pdu + self.crc
+    @property
+    def name(self):
+        function = self.function & 0x7F
+        name = FUNCTION_CODES[function][1] if function in FUNCTION_CODES else "function_%d" % function
+        return name + "_exception" if self.function & 0x80 else name
+
+    def __str__(self):
+        return f"Address: {self.address}, Function: {self.name}, Data: {self.data}"
 
     def __repr__(self):
         return f"ModbusFrame({self.address}, {self.function}, {self.data})"
 
+    def __len__(self):
+        if not isinstance(self.data, tuple):
+            return len(self.data) + 5
+        length = HEADER_LENGTHS[self.format] + 2
+        return length + len(self.payload) if self.payload is not None else length
+
+    def encode_into(self, buf, offset=0, crc=True):
+        """
+        Encodes the frame and CRC into buf at offset, returns the encoded length.
+        Response data and payloads are copied in as a block, buf may be reused between frames.
+        The CRC is left out when crc is False, for transports such as Modbus TCP which do not use it.
+        """
+        if isinstance(self.data, tuple):
+            fmt = self.format
+            pack_into(fmt, buf, offset, self.address, self.function, *self.data)
+            length = HEADER_LENGTHS[fmt]
+            if self.payload is not None:
+                buf[offset + length:offset + length + len(self.payload)] = self.payload
+                length += len(self.payload)
+        else:
+            data_length = len(self.data)
+            buf[offset] = self.address
+            buf[offset + 1] = self.function
+            buf[offset + 2] = data_length
+            buf[offset + 3:offset + 3 + data_length] = self.data
+            length = data_length + 3
+        if not crc:
+            return length
+        return append_crc(buf, length, offset)
+
+    def to_bytes(self):
+        """ The encoded frame with its CRC, as bytes, encoded once and cached """
+        if self._encoded is None:
+            data = self.data
+            if isinstance(data, tuple) and self.payload is None:
+                # Fixed parameters, packed in one call with no intermediate buffer, the common request
+                header = pack(self.format, self.address, self.function, *data)
+                encoded = header + pack('<H', crc16(header))
+            else:
+                encoded = bytearray(len(self))
+                self.encode_into(encoded)
+                encoded = bytes(encoded)
+            self._encoded = encoded
+        return self._encoded
+
     @property
     def pdu(self):
-        if self.response:
-            data_length = len(self.data)
-            data_format = "B" * data_length
-            return pack(">BBB" + data_format, self.address, self.function, data_length, *self.data)
-        else:
-            function_format = FUNCTION_CODES[self.function][0]
-            return pack(">BB" + function_format, self.address, self.function, *self.data)
+        return self.to_bytes()[:-2]
 
     @property
     def crc(self):
-        return calculate_crc16(self.pdu)
+        return self.to_bytes()[-2:]
+
+    @staticmethod
+    def exception(address, function, code):
+        return ModbusFrame(address, function | 0x80, (code,), response=True)
+
+    @staticmethod
+    def exception_into(buf, address, function, code):
+        """ Encodes an exception response into buf without building a frame, returns the length """
+        buf[0] = address
+        buf[1] = function | 0x80
+        buf[2] = code
+        return append_crc(buf, 3)
 
     @staticmethod
     def read_coils(address, start, count):
         return ModbusFrame(address, 1, (start, count))
 
+    @staticmethod
+    def read_discrete_inputs(address, start, count):
+        return ModbusFrame(address, 2, (start, count))
+
     @staticmethod
     def read_holding_registers(address, start, count):
         return ModbusFrame(address, 3, (start, count))
 
+    @staticmethod
+    def read_input_registers(address, start, count):
+        return ModbusFrame(address, 4, (start, count))
+
+    @staticmethod
+    def write_single_coil(address, coil, value):
+        return ModbusFrame(address, 5, (coil, 0xFF00 if value else 0x0000))
+
+    @staticmethod
+    def write_single_register(address, register, value):
+        return ModbusFrame(address, 6, (register, value))
+
+    @staticmethod
+    def diagnostics(address, sub_function, data=0):
+        return ModbusFrame(address, 8, (sub_function, data))
+
+    @staticmethod
+    def get_comm_event_counter(address):
+        return ModbusFrame(address, 11, ())
+
+    @staticmethod
+    def write_multiple_coils(address, start, count, data):
+        """ data is the packed coil values, LSB first """
+        return ModbusFrame(address, 15, (start, count, len(data)), payload=data)
+
+    @staticmethod
+    def write_multiple_registers(address, start, data):
+        """ data is the big-endian register values """
+        return ModbusFrame(address, 16, (start, len(data) // 2, len(data)), payload=data)
+
+    @staticmethod
+    def read_write_multiple_registers(address, read_start, read_count, write_start, data):
+        return ModbusFrame(address, 23, (read_start, read_count, write_start, len(data) // 2, len(data)),
+                           payload=data)
@@ -0,0 +1,180 @@
+from uasyncio import Event, create_task, TimeoutError
+from utime import ticks_ms, ticks_diff
+try:
+    from heapq import heappush, heappop
+except ImportError:
+    from uheapq import heappush, heappop
+
+from crc16_modbus import crc16
+from modbus_frame import (ModbusFrame, SERVER_DEVICE_FAILURE, SERVER_DEVICE_BUSY, GATEWAY_PATH_UNAVAILABLE,
+                          GATEWAY_TARGET_FAILED)
+from modbus_tcp import ModbusTCPServer, MBAP_LENGTH, MAX_PDU_LENGTH
+
+
+READ_FUNCTIONS = (1, 2, 3, 4)
+# Queue priorities, lower first, writes go ahead of queued reads
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+
+
+class GatewayTransaction:
+    """ An RTU request queued by the gateway, answered to every client waiting on it """
+    __slots__ = ('frame', 'priority', 'event', 'response')
+
+    def __init__(self, frame, priority):
+        self.frame = frame
+        self.priority = priority
+        self.event = Event()
+        self.response = None
+
+
+class ModbusTCPGateway(ModbusTCPServer):
+    """
+    Forwards Modbus TCP requests to slaves on the RS485 link of a ModbusRTUMaster.
+
+    Requests from all connections are serialised through a priority queue, one RTU transaction
+    at a time, with a timeout per slave address. Identical reads which are queued or in flight
+    are answered by a single transaction, and when cache_ttl_ms is set, read responses are served
+    from a cache for that long. Writes drop the cached responses of their slave.
+
+    units maps TCP unit ids to RTU addresses, by default unit ids are used as addresses.
+    Pipelined requests are queued concurrently, so responses may return out of order,
+    matched by their transaction id as allowed by Modbus TCP.
+    """
+    def __init__(self, master, host='0.0.0.0', port=502, max_connections=8, units=None, slave_timeouts=None,
+                 cache_ttl_ms=0, max_cache=64, max_queue=32, debug=False):
+        """
+        master: ModbusRTUMaster, the RS485 link, which may also be polling
+        slave_timeouts: dict, response timeout in ms by RTU address, the master timeout is used otherwise
+        max_queue: int, requests queued beyond this are answered with SERVER_DEVICE_BUSY
+        """
+        super().__init__(None, host, port, max_connections, debug)
+        self.master = master
+        self.units = units
+        self.slave_timeouts = slave_timeouts or {}
+        self.cache_ttl_ms = cache_ttl_ms
+        self.max_cache = max_cache
+        self.max_queue = max_queue
+        self.cache = {}  # RTU request: (ticks_ms, RTU response)
+        self.queue = []  # heap of (priority, sequence, GatewayTransaction)
+        self.sequence = 0
+        self.in_flight = {}  # RTU request: GatewayTransaction, reads which are queued or being sent
+        self.queued = Event()
+        self.rtu_transactions = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.failures = 0  # Transactions which failed other than by a timeout
+
+    def __str__(self):
+        return ("requests: %d, rtu_transactions: %d, coalesced: %d, cache_hits: %d, timeouts: %d, failures: %d" %
+                (self.stats.bus_messages, self.rtu_transactions, self.coalesced, self.cache_hits,
+                 self.timeouts, self.failures))
+
+    async def runloop(self):
+        await self.start()
+        await self.worker()
+
+    async def serve(self, reader, writer):
+        request = bytearray(1 + MAX_PDU_LENGTH + 2)
+        while header := await self.read_request(reader, request):
+            transaction_id, unit_id, length = header
+            self.stats.bus_messages += 1
+            if self.units is not None:
+                if unit_id not in self.units:
+                    frame = ModbusFrame.exception(unit_id, request[1] & 0x7F, GATEWAY_PATH_UNAVAILABLE).to_bytes()
+                    create_task(self.reply(writer, frame, transaction_id, unit_id))
+                    continue
+                request[0] = self.units[unit_id]
+            crc = crc16(request, 0, length)
+            request[length] = crc & 0xFF
+            request[length + 1] = crc >> 8
+            create_task(self.forward(writer, bytes(request[:length + 2]), transaction_id, unit_id))
+
+    async def forward(self, writer, frame, transaction_id, unit_id):
+        if (response := await self.submit(frame)) is not None:
+            await self.reply(writer, response, transaction_id, unit_id)
+
+    async def reply(self, writer, response, transaction_id, unit_id):
+        """ Sends an RTU response to the client, replacing the CRC with the MBAP header """
+        length = len(response) - 2
+        buf = bytearray(MBAP_LENGTH - 1 + length)
+        buf[MBAP_LENGTH - 1:] = response[:length]
+        try:
+            await self.write_response(writer, buf, transaction_id, unit_id, length)
+        except OSError as e:
+            self.log("Modbus gateway: Client went away: %s" % e)
+
+    async def submit(self, frame):
+        """
+        Queues an RTU request frame, returning the RTU response, an exception response,
+        or None for broadcasts.
+        """
+        read = frame[1] in READ_FUNCTIONS
+        if read and self.cache_ttl_ms and (cached := self.cache.get(frame)):
+            if ticks_diff(ticks_ms(), cached[0]) < self.cache_ttl_ms:
+                self.cache_hits += 1
+                return cached[1]
+            del self.cache[frame]
+
+        if read and (transaction := self.in_flight.get(frame)):
+            self.coalesced += 1
+        elif len(self.queue) >= self.max_queue:
+            return ModbusFrame.exception(frame[0], frame[1], SERVER_DEVICE_BUSY).to_bytes()
+        else:
+            transaction = GatewayTransaction(frame, PRIORITY_READ if read else PRIORITY_WRITE)
+            if read:
+                self.in_flight[frame] = transaction
+            heappush(self.queue, (transaction.priority, self.sequence, transaction))
+            self.sequence += 1
+            self.queued.set()
+        await transaction.event.wait()
+        return transaction.response
+
+    def _cache_response(self, frame, response):
+        if len(self.cache) >= self.max_cache:
+            now = ticks_ms()
+            for key in [key for key, (time, _) in self.cache.items() if ticks_diff(now, time) >= self.cache_ttl_ms]:
+                del self.cache[key]
+            if len(self.cache) >= self.max_cache:
+                self.cache.clear()
+        self.cache[frame] = (ticks_ms(), response)
+
+    def _invalidate(self, address):
+        for key in [key for key in self.cache if key[0] == address or not address]:
+            del self.cache[key]
+
+    async def worker(self):
+        """
+        Sends queued requests in priority order, one at a time.
+        A timeout is answered with GATEWAY_TARGET_FAILED and any other error with SERVER_DEVICE_FAILURE,
+        the waiting clients are always released.
+        """
+        while True:
+            if not self.queue:
+                self.queued.clear()
+                await self.queued.wait()
+                continue
+            transaction = heappop(self.queue)[2]
+            frame = transaction.frame
+            self.rtu_transactions += 1
+            response = None
+            try:
+                response = await self.master.transact(frame, self.slave_timeouts.get(frame[0]))
+            except TimeoutError:
+                self.timeouts += 1
+                response = ModbusFrame.exception(frame[0], frame[1], GATEWAY_TARGET_FAILED).to_bytes()
+            except Exception as e:
+                self.failures += 1
+                self.log("Modbus gateway: RTU transaction failed: %s" % e)
+                response = ModbusFrame.exception(frame[0], frame[1], SERVER_DEVICE_FAILURE).to_bytes()
+            finally:
+                if frame[1] in READ_FUNCTIONS:
+                    self.in_flight.pop(frame, None)
+                transaction.response = response
+                transaction.event.set()
+
+            if frame[1] not in READ_FUNCTIONS:
+                self._invalidate(frame[0])
+            elif self.cache_ttl_ms and response is not None and not response[1] & 0x80:
+                self._cache_response(frame, response)
@@ -0,0 +1,254 @@
+from uasyncio import Lock, sleep_ms, wait_for_ms, TimeoutError
+from utime import ticks_ms, ticks_diff, ticks_add
+from struct import unpack_from
+
+from modbus_frame import ModbusFrame
+from rtu_decoder import RTUDecoder
+
+
+# Point type: (registers, struct format)
+POINT_TYPES = {'u16': (1, '>H'), 'i16': (1, '>h'),
+               'u32': (2, '>I'), 'i32': (2, '>i'), 'float32': (2, '>f')}
+MAX_READ_REGISTERS = 125
+
+
+class ModbusMasterError(Exception):
+    pass
+
+
+class Point:
+    """
+    A value polled from a slave.
+    table is the read function code, 3 for holding registers or 4 for input registers.
+    word_order is the register order of 32 bit types, 'big' for high word first.
+    """
+    __slots__ = ('name', 'unit', 'register', 'type', 'period_ms', 'table', 'word_order',
+                 'value', 'updated', 'errors')
+
+    def __init__(self, name, unit, register, type='u16', period_ms=1000, table=3, word_order='big'):
+        if type not in POINT_TYPES:
+            raise ValueError("Invalid point type: %s" % type)
+        if table not in (3, 4):
+            raise ValueError("Invalid register table: %d" % table)
+        self.name = name
+        self.unit = unit
+        self.register = register
+        self.type = type
+        self.period_ms = period_ms
+        self.table = table
+        self.word_order = word_order
+        self.value = None
+        self.updated = None  # ticks_ms of the last successful poll
+        self.errors = 0
+
+    @property
+    def size(self):
+        return POINT_TYPES[self.type][0]
+
+    def decode(self, data, offset):
+        size, fmt = POINT_TYPES[self.type]
+        if size == 2 and self.word_order == 'little':
+            data = bytes(data[offset + 2:offset + 4]) + bytes(data[offset:offset + 2])
+            offset = 0
+        return unpack_from(fmt, data, offset)[0]
+
+    def __repr__(self):
+        return f"Point({self.name}, {self.unit}, {self.register}, {self.type}, {self.value})"
+
+
+class PollRequest:
+    """ A single FC3/FC4 read covering one or more points, polled at the shortest period of its points """
+    __slots__ = ('unit', 'table', 'start', 'count', 'period_ms', 'points', 'frame', 'due', 'attempts')
+
+    def __init__(self, unit, table, start, count, points):
+        self.unit = unit
+        self.table = table
+        self.start = start
+        self.count = count
+        self.period_ms = min(point.period_ms for point in points)
+        self.points = points
+        self.frame = bytes(ModbusFrame(unit, table, (start, count)).to_bytes())
+        self.due = ticks_ms()
+        self.attempts = 0
+
+    def __repr__(self):
+        return f"PollRequest({self.unit}, FC{self.table}, {self.start}+{self.count}, {len(self.points)} points)"
+
+
+def plan_requests(points, max_gap=8, max_count=MAX_READ_REGISTERS):
+    """
+    Merges points into the fewest reads.
+    Points of the same unit and table are sorted by register, and merged while the read
+    stays within max_count registers and skips at most max_gap unused registers,
+    reading a few extra registers is cheaper than the turnaround of another request.
+    Each read is polled at the shortest period of its points.
+    """
+    groups = {}
+    for point in points:
+        groups.setdefault((point.unit, point.table), []).append(point)
+
+    requests = []
+    for (unit, table), group in groups.items():
+        group.sort(key=lambda point: point.register)
+        current = [group[0]]
+        start, end = group[0].register, group[0].register + group[0].size
+        for point in group[1:]:
+            point_end = point.register + point.size
+            if point.register - end <= max_gap and max(end, point_end) - start <= max_count:
+                current.append(point)
+                end = max(end, point_end)
+            else:
+                requests.append(PollRequest(unit, table, start, end - start, current))
+                current = [point]
+                start, end = point.register, point_end
+        requests.append(PollRequest(unit, table, start, end - start, current))
+    return requests
+
+
+class ModbusRTUMaster:
+    """
+    Polls points from slaves on an RS485 link.
+
+    Reads are planned with plan_requests, and scheduled earliest deadline first so the bus
+    is kept busy with whatever is most overdue. A request which times out is retried up to
+    retries times, interleaved with the other slaves. A slave which keeps failing is backed
+    off for backoff_ms, doubling up to max_backoff_ms, so a dead slave never stalls the others.
+    """
+    def __init__(self, tx_pin=None, rx_pin=None, de_pin=None, uart=0,
+                 baudrate=19200, data_bits=8, parity=0, stop_bits=1,
+                 timeout_ms=100, retries=2, backoff_ms=1000, max_backoff_ms=30000,
+                 serial=None, debug=False):
+        """
+        serial: an RS485 like link, created from the pin and UART arguments if not given
+        timeout_ms: int, time to wait for a response
+        retries: int, attempts after a timeout before the slave is backed off
+        """
+        self.debug = debug
+        if serial is None:
+            from rs485 import RS485
+            serial = RS485(tx_pin, rx_pin, de_pin, uart, baudrate, data_bits, parity, stop_bits,
+                           poll_interval=0, debug=debug)
+        self.serial = serial
+        self.decoder = RTUDecoder(response=True, stats=serial.stats)
+        self.lock = Lock()  # One transaction on the bus at a time, polling may share the link with a gateway
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.points = []
+        self.requests = []
+        self.backoff = {}  # unit: (resume ticks_ms, backoff ms)
+        self.transactions = 0
+        self.timeouts = 0
+        self.exceptions = 0
+        self.points_polled = 0
+
+    def log(self, msg):
+        if self.debug:
+            print("[%d] %s" % (ticks_ms(), msg))
+
+    def add_point(self, *args, **kwargs):
+        point = args[0] if isinstance(args[0], Point) else Point(*args, **kwargs)
+        self.points.append(point)
+        self.requests = plan_requests(self.points)
+        return point
+
+    async def transact(self, frame, timeout_ms=None):
+        """
+        Sends a request frame and returns the raw response frame from the same unit.
+        Broadcasts are sent without waiting, and return None.
+        Raises TimeoutError if no valid response arrives in time.
+        """
+        async with self.lock:
+            while self.serial.messages.pop() is not None:  # Discard anything left over
+                pass
+            self.decoder.reset()
+            self.serial.received.clear()
+            self.transactions += 1
+            await self.serial.send(frame)
+            if not frame[0]:
+                return None
+            return await wait_for_ms(self._response(frame[0], frame[1]), timeout_ms or self.timeout_ms)
+
+    async def _response(self, unit, function):
+        while True:
+            await self.serial.received.wait()
+            self.serial.received.clear()
+            while (message := self.serial.messages.pop()) is not None:
+                for response in self.decoder.feed(message):
+                    if response[0] == unit and response[1] & 0x7F == function:
+                        return bytes(response)
+            if self.decoder.pending and self.serial.idle:
+                for response in self.decoder.gap():
+                    if response[0] == unit and response[1] & 0x7F == function:
+                        return bytes(response)
+
+    async def poll(self, request):
+        """ Reads a planned request and updates its points """
+        response = await self.transact(request.frame)
+        if response[1] & 0x80:
+            self.exceptions += 1
+            for point in request.points:
+                point.errors += 1
+            raise ModbusMasterError("Exception %d from unit %d for %s" % (response[2], request.unit, request))
+        if response[2] != request.count * 2:
+            raise ModbusMasterError("Invalid byte count %d for %s" % (response[2], request))
+        now = ticks_ms()
+        for point in request.points:
+            point.value = point.decode(response, 3 + (point.register - request.start) * 2)
+            point.updated = now
+        self.points_polled += len(request.points)
+
+    def next_request(self, now):
+        """ The most overdue request of a slave which is not backed off """
+        best = None
+        for request in self.requests:
+            if backoff := self.backoff.get(request.unit):
+                if ticks_diff(backoff[0], now) > 0:
+                    continue
+            if best is None or ticks_diff(request.due, best.due) < 0:
+                best = request
+        return best
+
+    def _failed(self, request, now):
+        request.attempts += 1
+        if request.attempts <= self.retries and request.unit not in self.backoff:
+            # Retry behind every other request already due, so the other slaves are polled in between,
+            # slaves already backed off get a single probe
+            latest = None
+            for other in self.requests:
+                if other is not request and ticks_diff(other.due, now) <= 0 and other.unit not in self.backoff:
+                    if latest is None or ticks_diff(other.due, latest) > 0:
+                        latest = other.due
+            request.due = now if latest is None else ticks_add(latest, 1)
+            return
+        request.attempts = 0
+        request.due = ticks_add(now, request.period_ms)
+        backoff = min(self.backoff.get(request.unit, (0, self.backoff_ms // 2))[1] * 2, self.max_backoff_ms)
+        self.backoff[request.unit] = (ticks_add(now, backoff), backoff)
+        self.log("Unit %d not responding, backing off for %d ms" % (request.unit, backoff))
+
+    async def runloop(self):
+        while True:
+            now = ticks_ms()
+            request = self.next_request(now)
+            if request is None:
+                await sleep_ms(10)  # Every slave is backed off
+                continue
+            if (wait := ticks_diff(request.due, now)) > 0:
+                await sleep_ms(wait)
+                continue
+            try:
+                await self.poll(request)
+            except TimeoutError:
+                self.timeouts += 1
+                self._failed(request, ticks_ms())
+                continue
+            except ModbusMasterError as e:
+                self.log(e)
+            request.attempts = 0
+            self.backoff.pop(request.unit, None)
+            # Keep the schedule, unless the bus is so far behind that a period was missed
+            request.due = ticks_add(request.due, request.period_ms)
+            if ticks_diff(ticks_ms(), request.due) > request.period_ms:
+                request.due = ticks_ms()
@@ -1,16 +1,48 @@
-from uasyncio import sleep_ms
-from modbus_frame import ModbusFrame, FrameTooShortError
-from rs485 import RS485, get_serial_chartime
+from modbus_frame import ModbusFrame, ModbusException
+from modbus_unit import ModbusUnit
+from rtu_decoder import RTUDecoder
+from register_bank import RegisterBank, CoilBank
+from response_cache import ResponseCache
+from rs485 import RS485, get_serial_chartime, get_frame_gap
+from stats import Stats
 from math import ceil
+from tracing import TRACE, EV_FRAME, EV_FOREIGN, EV_EXCEPTION, EV_PARSE_ERROR, EV_BROADCAST
+from uasyncio import create_task, sleep_ms
 from utime import ticks_ms
 
 
+class RTUPort:
+    """ An RS485 line served by a ModbusRTUClient, with its own receiver, queue, decoder and counters """
+    def __init__(self, serial):
+        self.serial = serial
+        self.stats = serial.stats
+        self.decoder = RTUDecoder(stats=self.stats)
+        self.handling = False  # A request is being handled, its response may not be sent yet
+        self.tx_buffer = bytearray(256)  # Responses encoded in place
+        self.tx_view = memoryview(self.tx_buffer)
+        self.tx_views = {}  # Response length: view of tx_buffer, each created once
+
+    def response_view(self, length):
+        """ The first length bytes of tx_buffer, without allocating once that length was sent before """
+        if (view := self.tx_views.get(length)) is None:
+            view = self.tx_views[length] = self.tx_view[:length]
+        return view
+
+    @property
+    def busy(self):
+        serial = self.serial
+        return self.handling or not serial.idle or bool(serial.messages) or bool(self.decoder.pending)
+
+
 class ModbusRTUClient:
     def __init__(self, address, tx_pin, rx_pin, de_pin, uart=0,
                  baudrate=19200, data_bits=8, parity=0, stop_bits=1,
-                 display_lines=None, debug=False):
+                 holding_register_count=10000, input_register_count=1000,
+                 coil_count=2000, discrete_input_count=2000, word_order='big', alias_4xxxx=False,
+                 rx_mode='irq', response_cache=16, in_place=False, persist=None, persist_interval_ms=5000,
+                 capture=None, display_lines=None, trace=None, debug=False):
         """
-        address: int, device address
+        address: int, device address, or a set of addresses to answer as several units
         tx_pin: int, pin number for UART TX
         rx_pin: int, pin number for UART RX
         de_pin: int, pin number for RS485 DE/RE
@@ -19,112 +51,358 @@ class ModbusRTUClient:
         data_bits: int, number of data bits (default 8)
         parity: int, parity (None: no parity, 0: even, 1: odd)
         stop_bits: int, number of stop bits (default 1)
+        holding_register_count: int, number of holding registers (default 10000)
+        input_register_count: int, number of input registers (default 1000)
+        coil_count: int, number of coils (default 2000)
+        discrete_input_count: int, number of discrete inputs (default 2000)
+        word_order: str, register order of 32 bit values, 'big' or 'little' (default 'big')
+        alias_4xxxx: bool, also accept holding register addresses 40001 to 49999, the addressing served
+                     before registers were zero based, see ModbusUnit (default False)
+        rx_mode: str, RS485 receive path, 'irq', 'stream' or 'poll' (default 'irq'),
+                 or 'thread' to receive and transmit from the second core, see RS485Thread
+        response_cache: int, number of encoded register read responses to cache, 0 to disable (default 16)
+        in_place: bool, handle requests from the receive buffers and encode responses in place,
+                  reads allocate nothing without display_lines, the response cache is not used (default False)
+        persist: str, path prefix to keep the holding registers of each unit in flash, restored here,
+                 see RegisterStore, None to disable (default None)
+        persist_interval_ms: int, time over which register writes are coalesced into one save (default 5000)
+        capture: str, path of a BusCapture log of the raw traffic on every port, for tools/bus_replay.py,
+                 None to disable (default None)
+        trace: bool, record frames in the binary trace buffer, tracing.TRACE, which is shared by every client,
+               master and gateway, None leaves it as it is (default None)
         """
         self.display_lines = display_lines
         self.debug = debug
-        if parity is None:
-            stop_bits = 2  # Modbus RTU must use a 11-bit frame
-        if baudrate < 19200:
-            chartime = get_serial_chartime(baudrate, data_bits, parity, stop_bits)
-            tx_delay = chartime * 3500  # Use the base char time for the tx_delay, convert to us
-            chartime = chartime * 1.5  # Multiply by 1.5 to account for the 1.5 character time
-        else:
-            tx_delay = 1750  # 1750 us
-            chartime = 0.750  # 750 us
-
-        chartime = ceil(chartime)
-        self.address = address
-        self.serial = RS485(tx_pin, rx_pin, de_pin, uart,
-                            baudrate, data_bits, parity, stop_bits,
-                            tx_delay=tx_delay, timeout_char=chartime,
-                            poll_interval=0,  # gotta go fast
-                            debug=debug)
-
-        self.poll_interval = chartime * 2
-
-        self.log("RTU Poll Interval: %d ms" % self.poll_interval)
-
-        # Each key is a register address
-        # Implied starting at 40001, so 0x0000 is 40001
-        self.holding_registers = {}  # Each key is a register address
+        self.in_place = in_place
+        self.persist = persist
+        self.persist_interval_ms = persist_interval_ms
+        self.stores = {}  # Unit address: RegisterStore of its holding registers, with persist
+        self.capture = None
+        if capture is not None:
+            from bus_capture import BusCapture
+            self.capture = BusCapture(capture, baudrate, data_bits, parity, stop_bits,
+                                      wait_quiet=self.wait_quiet, debug=debug)
+        if trace is not None:
+            TRACE.enabled = trace
+        self.ports = []
+        self.port_tasks = []  # Tasks serving the ports after the first and saving registers, while the runloop runs
+        self.running = False
+        self.add_port(tx_pin, rx_pin, de_pin, uart, baudrate, data_bits, parity, stop_bits, rx_mode)
+        # The first port, for code written for a single line
+        self.serial = self.ports[0].serial
+        self.stats = self.ports[0].stats
+        self.decoder = self.ports[0].decoder
+        self.broadcast_stats = Stats()  # Scratch counters for the extra units handling a broadcast
+
+        # Units by address, with accept indexed by the address byte, so frames for other devices
+        # are dropped with a single lookup before they are parsed
+        self.units = {}
+        self.accept = bytearray(256)
+        self.accept[0] = 1  # Broadcasts
+        self.response_cache = ResponseCache(self.units, response_cache) if response_cache and not in_place else None
+        addresses = sorted(address) if not isinstance(address, int) else [address]
+        for unit_address in addresses:
+            self.add_unit(ModbusUnit(unit_address,
+                                     coils=CoilBank(coil_count),
+                                     discrete_inputs=CoilBank(discrete_input_count),
+                                     holding_registers=RegisterBank(holding_register_count, word_order),
+                                     input_registers=RegisterBank(input_register_count, word_order),
+                                     alias_4xxxx=alias_4xxxx))
+        # The lowest address is the primary unit, register addresses are zero based, holding register 0x0000 is 40001
+        self.address = addresses[0]
+        self.unit = self.units[self.address]
+        self.holding_registers = self.unit.holding_registers
+        self.input_registers = self.unit.input_registers
+        self.coils = self.unit.coils
+        self.discrete_inputs = self.unit.discrete_inputs
+
+    def add_port(self, tx_pin, rx_pin, de_pin, uart=0, baudrate=19200, data_bits=8, parity=0, stop_bits=1,
+                 rx_mode='irq', serial=None):
+        """
+        Serves another RS485 line, with its own timing, from the same units.
+        The arguments are those of the constructor, or serial is an RS485 like link.
+        With several ports, responses are awaited while they are sent instead of blocking the loop,
+        and each port yields after every frame, so a busy line cannot starve the others.
+        Returns the RTUPort.
+        """
+        if serial is None:
+            if parity is None:
+                stop_bits = 2  # Modbus RTU must use a 11-bit frame
+            # The t3.5 gap between frames, the RS485 driver replaces it with calibrated values when available
+            tx_delay = get_frame_gap(baudrate, data_bits, parity, stop_bits)
+            if baudrate < 19200:
+                # UART character timeout of 1.5 character times
+                chartime = get_serial_chartime(baudrate, data_bits, parity, stop_bits) * 1.5
+            else:
+                chartime = 0.750  # 750 us
+
+            chartime = ceil(chartime)
+            serial_class = RS485
+            if rx_mode == 'thread':
+                if any(getattr(port.serial, 'rx_mode', None) == 'thread' for port in self.ports):
+                    raise ValueError("Only one port can run on the second core")
+                from rs485_thread import RS485Thread as serial_class
+            serial = serial_class(tx_pin, rx_pin, de_pin, uart,
+                                  baudrate, data_bits, parity, stop_bits,
+                                  tx_delay=tx_delay, timeout_char=chartime,
+                                  poll_interval=0,  # gotta go fast
+                                  rx_mode=rx_mode,
+                                  debug=self.debug)
+        port = RTUPort(serial)
+        self.ports.append(port)
+        if self.capture is not None:
+            self.capture.attach(serial, len(self.ports) - 1)
+        if len(self.ports) > 1:
+            for other in self.ports:
+                other.serial.tx_yield = True
+        if self.running:
+            port_loop = self.port_loop_in_place if self.in_place else self.port_loop
+            self.port_tasks.append(create_task(port_loop(port)))
+        return port
+
+    def add_unit(self, unit):
+        """ Answers requests for unit.address with unit, which may have its own register bank sizes """
+        if not 1 <= unit.address <= 247:
+            raise ValueError("Invalid unit address: %d" % unit.address)
+        self.units[unit.address] = unit
+        self.accept[unit.address] = 1
+        if self.persist is not None:
+            from register_store import RegisterStore
+            store = self.stores[unit.address] = RegisterStore(unit.holding_registers,
+                                                              "%s_%d" % (self.persist, unit.address),
+                                                              interval_ms=self.persist_interval_ms,
+                                                              wait_quiet=self.wait_quiet, debug=self.debug)
+            sequence = store.restore()
+            self.log("Unit %d: Restored holding registers snapshot %s in %d us"
+                     % (unit.address, sequence, store.restore_us))
+            if self.running:
+                self.port_tasks.append(create_task(store.runloop()))
+        if self.response_cache is not None:
+            self.response_cache.clear()
+        return unit
 
     def log(self, msg):
         if self.debug:
             print("[%d] %s" % (ticks_ms(), msg))
 
+    @property
+    def busy(self):
+        """ A frame is being received or a response is pending on a port, other tasks should not block now """
+        for port in self.ports:
+            if port.busy:
+                return True
+        return False
+
+    async def wait_quiet(self):
+        """ Returns once no port is busy, flash writes await this before each chunk """
+        while self.busy:
+            await sleep_ms(1)
+
+    @property
+    def bus_messages(self):
+        """ Frames seen on every port """
+        return sum(port.stats.bus_messages for port in self.ports)
+
     async def runloop(self):
         print("Starting Modbus RTU Client")
-        while True:
-            for message in self.get_messages():
-                await self.parse_recv(message)
-            await sleep_ms(self.poll_interval)
+        self.running = True
+        port_loop = self.port_loop_in_place if self.in_place else self.port_loop
+        self.port_tasks = [create_task(port_loop(port)) for port in self.ports[1:]]
+        self.port_tasks += [create_task(store.runloop()) for store in self.stores.values()]
+        if self.capture is not None:
+            self.port_tasks.append(create_task(self.capture.runloop()))
+        try:
+            await port_loop(self.ports[0])
+        finally:
+            self.running = False
+            for task in self.port_tasks:
+                task.cancel()
+            if self.capture is not None:
+                self.capture.flush()
 
-    def get_messages(self):
-        """ Get a message from message list """
-        if self.serial.messages:
-            yield self.serial.messages.pop(0)
-        return None
+    async def port_loop(self, port):
+        """ Handles the frames received on a port """
+        accept = self.accept
+        serial, decoder = port.serial, port.decoder
+        framed = serial.framed  # The RS485 thread delimits frames itself
+        while True:
+            await serial.received.wait()
+            serial.received.clear()
+            for message in self.get_messages(port):
+                for frame in (message,) if framed else decoder.feed(message):
+                    if accept[frame[0]]:
+                        await self.parse_recv(frame, port)
+                    else:
+                        self.foreign_frame(frame, port)
+                if len(self.ports) > 1:
+                    await sleep_ms(0)  # Let the other ports run between messages
+            # The receiver timed out with nothing queued, the t3.5 gap ended any pending frame
+            if decoder.pending and serial.idle and not serial.messages:
+                for frame in decoder.gap():
+                    if accept[frame[0]]:
+                        await self.parse_recv(frame, port)
+                    else:
+                        self.foreign_frame(frame, port)
 
-    def parse_recv(self, data, i=0):
+    async def port_loop_in_place(self, port):
         """
-        Try to parse a message from the receive buffer or the given data.
-        If the data cannot be parsed, shift the buffer by one byte and try again.
-        After 10 attempts, return.
+        Handles the frames received on a port from the receive and decoder buffers, by their offsets,
+        answering into the port tx buffer, so a register read allocates nothing.
         """
-        if i > 10:
-            return print("Failed to parse data after 10 attempts. Resetting buffer.")
+        serial, decoder, messages = port.serial, port.decoder, port.serial.messages
+        framed = serial.framed
+        while True:
+            await serial.received.wait()
+            serial.received.clear()
+            while (index := messages.pop_index()) >= 0:
+                if framed:
+                    length = self.serve_in_place(port, messages.slots[index], 0, messages.lengths[index])
+                    if length and not serial.send_nowait(port.response_view(length)):
+                        await serial.send(port.response_view(length))
+                    continue
+                decoder.push(messages.slots[index], messages.lengths[index])
+                while end := decoder.next_frame():
+                    length = self.serve_in_place(port, decoder.buffer, decoder.frame_start, end)
+                    if length and not serial.send_nowait(port.response_view(length)):
+                        await serial.send(port.response_view(length))
+                if len(self.ports) > 1:
+                    await sleep_ms(0)  # Let the other ports run between messages
+            if decoder.pending and serial.idle and not serial.messages:
+                while end := decoder.next_frame(True):
+                    length = self.serve_in_place(port, decoder.buffer, decoder.frame_start, end)
+                    if length and not serial.send_nowait(port.response_view(length)):
+                        await serial.send(port.response_view(length))
+                decoder.reset()
+
+    def serve_in_place(self, port, buf, start, end):
+        """ Handles the frame in buf[start:end] received on port, returns the response length in port.tx_buffer """
+        address = buf[start]
+        if not self.accept[address]:
+            port.stats.foreign_frames += 1
+            if TRACE.enabled:
+                TRACE.record(EV_FOREIGN, address, buf[start + 1])
+            return 0
+        if TRACE.enabled:
+            TRACE.record(EV_FRAME, address, buf[start + 1], memoryview(buf)[start:end])
+        if self.display_lines is not None:
+            self.display_lines.clear()
+            self.display_frame(memoryview(buf)[start:end])
+        port.handling = True
+        try:
+            if not address:  # Every unit acts on a broadcast, counted once on the link by the first
+                stats = port.stats
+                for unit in self.units.values():
+                    try:
+                        unit.handle_into(buf, start, end, port.tx_buffer, stats)
+                    except ModbusException as e:  # Never answered, only counted
+                        if TRACE.enabled:
+                            TRACE.record(EV_PARSE_ERROR, end - start, e.code, memoryview(buf)[start:end])
+                        unit.exception_response(memoryview(buf)[start:end], e.code, stats)
+                    stats = self.broadcast_stats
+                return 0
+            unit = self.units[address]
+            try:
+                length = unit.handle_into(buf, start, end, port.tx_buffer, port.stats)
+            except ModbusException as e:
+                if TRACE.enabled:
+                    TRACE.record(EV_PARSE_ERROR, end - start, e.code, memoryview(buf)[start:end])
+                response = unit.exception_response(memoryview(buf)[start:end], e.code, port.stats)
+                length = response.encode_into(port.tx_buffer)
+            if TRACE.enabled and port.tx_buffer[1] & 0x80:
+                TRACE.record(EV_EXCEPTION, port.tx_buffer[1] & 0x7F, port.tx_buffer[2])
+            if self.display_lines is not None:
+                self.display_frame(port.response_view(length))
+            return length
+        except ValueError:
+            if TRACE.enabled:
+                TRACE.record(EV_PARSE_ERROR, end - start, 0, memoryview(buf)[start:end])
+            return 0
+        finally:
+            port.handling = False
 
-        if not data:
-            return print("No data to parse")
+    def get_messages(self, port=None):
+        """
+        Get messages from the receive queue of a port, the first by default.
+        Each is a view of a queue buffer, it must be consumed before the next await.
+        """
+        messages = (port or self.ports[0]).serial.messages
+        while (message := messages.pop()) is not None:
+            yield message
 
+    async def parse_recv(self, data, port=None):
+        """
+        Parse and handle a frame delimited by the decoder of a port, the CRC is already checked.
+        Frames for other devices were already dropped by the runloop.
+        """
+        port = port or self.ports[0]
+        port.handling = True
         try:
-            await self.handle_frame(ModbusFrame.parse_frame(data))
-        except ValueError as e:
-            print("Failed to parse data: %s\n%s " % (e, data))
-        except NotImplementedError as e:
-            print("Failed to parse data: %s\n%s " % (e, data))
-        except FrameTooShortError as e:
-            print("Possible incomplete frame: %s\n%s " % (e, data))
-            return
+            if self.response_cache is not None and data[0]:
+                if (response := self.response_cache.lookup(data, port.stats)) is not None:
+                    if TRACE.enabled:
+                        TRACE.record(EV_FRAME, data[0], data[1], data)
+                    await self.send_response(response, data, port)
+                    return
+            await self.handle_frame(ModbusFrame.parse_frame(data, check_crc=False), port)
+        except ModbusException as e:
+            # The request could not be decoded, answer right away so the master does not time out
+            if TRACE.enabled:
+                TRACE.record(EV_PARSE_ERROR, len(data), e.code, data)
+            if unit := self.units.get(data[0]):
+                await self.send_response(unit.exception_response(data, e.code, port.stats).to_bytes(), port=port)
+        except ValueError:
+            if TRACE.enabled:
+                TRACE.record(EV_PARSE_ERROR, len(data), 0, data)
+        finally:
+            port.handling = False
 
-        data = data[1:]
-        if data:
-            return self.parse_recv(data, i + 1)
-
-    async def handle_read_holding_registers(self, frame):
-        """ Sends a response with the values of the requested registers """
-        start = frame.data[0]
-        if start > 49999:
-            raise ValueError("Invalid register address: %s" % start)
-        if start < 40001:
-            start += 40000
-        end = start + frame.data[1]
-        register_data = b''
-        for i in range(start, end):
-            register_data += self.holding_registers.get(i, b'\x00\x00')
-        response = ModbusFrame(address=self.address, function=3, data=register_data, response=1)
-        self.display_frame(response)
-        await self.serial.send(response.to_bytes())
-
-    def display_frame(self, frame):
+    async def send_response(self, response, request=None, port=None):
+        """ Sends an encoded response on a port, the request is shown first when it was not displayed yet """
         if self.display_lines is not None:
-            self.display_lines += f'{ticks_ms()}@{frame.address}:{frame.function};{frame.crc.hex()}\n'
-            self.display_lines += f'{frame.pdu.hex()}\n'
-        else:
-            print("[%d] %s" % (ticks_ms(), frame))
-
-    async def handle_frame(self, frame):
-        self.display_lines.clear()
-        self.display_frame(frame)
-        if frame.address == 0:
-            print("Received broadcast frame: %s" % frame)
-        elif frame.address != self.address:
-            print("Received frame for another device: %s" % frame)
-            return
-        else:
-            print("[%d] Received frame: %s" % (ticks_ms(), frame))
-            if frame.function == 3:
-                await self.handle_read_holding_registers(frame)
+            if request is not None:
+                self.display_lines.clear()
+                self.display_frame(request)
+            self.display_frame(response)
+        await (port or self.ports[0]).serial.send(response)
+
+    def display_frame(self, frame_bytes):
+        if self.display_lines is not None:
+            crc = bytes(frame_bytes[-2:]).hex()
+            self.display_lines += f'{ticks_ms()}@{frame_bytes[0]}:{frame_bytes[1]};{crc}\n'
+            self.display_lines += f'{bytes(frame_bytes[:-2]).hex()}\n'
 
+    def foreign_frame(self, data, port=None):
+        """ Counts a frame for another device, it is never parsed or displayed """
+        (port or self.ports[0]).stats.foreign_frames += 1
+        if TRACE.enabled:
+            TRACE.record(EV_FOREIGN, data[0], data[1])
 
+    async def handle_frame(self, frame, port=None):
+        port = port or self.ports[0]
+        if frame.address == 0:
+            if TRACE.enabled:
+                TRACE.record(EV_BROADCAST, frame.function)
+            # Every unit acts on a broadcast, as the devices they replace would
+            if self.display_lines is not None:
+                self.display_lines.clear()
+            self.display_frame(frame.to_bytes())
+            stats = port.stats
+            for unit in self.units.values():
+                unit.handle(frame, stats)
+                stats = self.broadcast_stats  # Counted once on the link, by the first unit
+            return
+        if (unit := self.units.get(frame.address)) is None:
+            return self.foreign_frame(frame.to_bytes(), port)
+        if TRACE.enabled:
+            TRACE.record(EV_FRAME, frame.address, frame.function, frame.to_bytes())
 
+        if self.display_lines is not None:
+            self.display_lines.clear()
+        self.display_frame(frame.to_bytes())
+        if response := unit.handle(frame, port.stats):
+            if TRACE.enabled and response.function & 0x80:
+                TRACE.record(EV_EXCEPTION, response.function & 0x7F, response.data[0])
+            encoded = response.to_bytes()
+            if self.response_cache is not None:
+                self.response_cache.store(frame.to_bytes(), encoded)
+            await self.send_response(encoded, port=port)
@@ -0,0 +1,129 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from struct import pack_into, unpack_from
+try:
+    from utime import ticks_ms
+except ImportError:
+    from time import monotonic_ns
+
+    def ticks_ms():
+        return monotonic_ns() // 1000000
+
+from modbus_frame import ModbusFrame, ModbusException, FrameTooShortError
+from stats import Stats
+
+
+MBAP_FORMAT = ">HHHB"  # Transaction id, protocol id, length, unit id
+MBAP_LENGTH = 7
+MAX_PDU_LENGTH = 253
+
+
+class ModbusTCPServer:
+    """
+    Modbus TCP server for a ModbusUnit, such as the unit of a ModbusRTUClient,
+    so the same registers are served over RS485 and TCP.
+
+    Requests are unpacked from the MBAP header into the RTU layout, the unit id followed by the PDU,
+    so ModbusFrame parses them without a CRC. Requests on each connection are handled in order,
+    so clients may pipeline transactions, and any number of connections up to max_connections
+    are served concurrently. Handling is synchronous, so the shared response buffer of the unit
+    is encoded before the next request is handled.
+    The unit id is echoed but otherwise ignored, as the server is addressed by its IP.
+    """
+    def __init__(self, unit, host='0.0.0.0', port=502, max_connections=8, debug=False):
+        self.unit = unit
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.debug = debug
+        self.connections = 0
+        self.stats = Stats()
+        self.server = None
+
+    def log(self, msg):
+        if self.debug:
+            print("[%d] %s" % (ticks_ms(), msg))
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.log("Modbus TCP: Listening on %s:%d" % (self.host, self.port))
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def runloop(self):
+        await self.start()
+        while True:
+            await asyncio.sleep(3600)
+
+    async def read_request(self, reader, request):
+        """
+        Reads the next request into request in the RTU layout.
+        Returns the transaction id, unit id and the length of the unit id and PDU, or None for an invalid header.
+        """
+        header = await reader.readexactly(MBAP_LENGTH)
+        transaction_id, protocol_id, length, unit_id = unpack_from(MBAP_FORMAT, header)
+        if protocol_id != 0 or length < 2 or length > MAX_PDU_LENGTH + 1:
+            self.log("Modbus TCP: Invalid MBAP header: %s" % header)
+            return None
+        request[1:length] = await reader.readexactly(length - 1)
+        request[0] = unit_id
+        request[length] = request[length + 1] = 0
+        return transaction_id, unit_id, length
+
+    async def write_response(self, writer, response, transaction_id, unit_id, length):
+        """ Sends the unit id and PDU following the MBAP header space in response """
+        pack_into(MBAP_FORMAT, response, 0, transaction_id, 0, length, unit_id)
+        writer.write(response[:MBAP_LENGTH - 1 + length])
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            self.log("Modbus TCP: Connection limit reached, closing new connection")
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            await self.serve(reader, writer)
+        except (EOFError, OSError) as e:
+            self.log("Modbus TCP: Connection closed: %s" % e)
+        except Exception as e:  # IncompleteReadError on CPython
+            self.log("Modbus TCP: Connection error: %s" % e)
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, reader, writer):
+        # Request as an RTU frame, unit id and PDU, with room for the CRC which is never checked
+        request = bytearray(1 + MAX_PDU_LENGTH + 2)
+        request_view = memoryview(request)
+        response = bytearray(MBAP_LENGTH - 1 + 1 + MAX_PDU_LENGTH + 2)
+        while header := await self.read_request(reader, request):
+            transaction_id, unit_id, length = header
+            if length := self.handle_request(request_view[:length + 2], response):
+                await self.write_response(writer, response, transaction_id, unit_id, length)
+
+    def handle_request(self, request, response):
+        """
+        Handles an RTU layout request, encoding the response after the MBAP header in response.
+        Returns the length of the unit id and PDU, or 0 when there is nothing to send.
+        """
+        stats = self.stats
+        stats.bus_messages += 1
+        request[0] = self.unit.address
+        try:
+            frame = ModbusFrame.parse_frame(request, check_crc=False)
+            reply = self.unit.handle(frame, stats)
+        except ModbusException as e:
+            reply = self.unit.exception_response(request, e.code, stats)
+        except (FrameTooShortError, ValueError) as e:
+            stats.bus_comm_errors += 1
+            self.log("Modbus TCP: Invalid request: %s" % e)
+            return 0
+        if reply is None:
+            return 0
+        return reply.encode_into(response, MBAP_LENGTH - 1, crc=False)
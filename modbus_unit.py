@@ -0,0 +1,250 @@
+from modbus_frame import (ModbusFrame, ModbusException, FUNCTION_CODES, append_crc,
+                          ILLEGAL_FUNCTION, ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE,
+                          DIAG_RETURN_QUERY_DATA, DIAG_RESTART_COMMUNICATIONS, DIAG_RETURN_DIAGNOSTIC_REGISTER,
+                          DIAG_CLEAR_COUNTERS, DIAG_BUS_MESSAGE_COUNT, DIAG_BUS_COMM_ERROR_COUNT,
+                          DIAG_BUS_EXCEPTION_ERROR_COUNT, DIAG_SERVER_MESSAGE_COUNT, DIAG_SERVER_NO_RESPONSE_COUNT,
+                          DIAG_SERVER_NAK_COUNT, DIAG_SERVER_BUSY_COUNT, DIAG_BUS_CHARACTER_OVERRUN_COUNT,
+                          DIAG_LATENCY_BUCKET, DIAG_RESYNC_COUNT, DIAG_FOREIGN_FRAME_COUNT)
+from register_bank import RegisterBank, CoilBank
+from stats import Stats
+
+
+# FC8 sub-functions returning a counter: Stats attribute, None for counters which are always 0
+DIAG_COUNTERS = {DIAG_RETURN_DIAGNOSTIC_REGISTER: None,
+                 DIAG_BUS_MESSAGE_COUNT: 'bus_messages',
+                 DIAG_BUS_COMM_ERROR_COUNT: 'bus_comm_errors',
+                 DIAG_BUS_EXCEPTION_ERROR_COUNT: 'bus_exceptions',
+                 DIAG_SERVER_MESSAGE_COUNT: 'server_messages',
+                 DIAG_SERVER_NO_RESPONSE_COUNT: 'server_no_responses',
+                 DIAG_SERVER_NAK_COUNT: None,
+                 DIAG_SERVER_BUSY_COUNT: None,
+                 DIAG_BUS_CHARACTER_OVERRUN_COUNT: 'character_overruns',
+                 DIAG_RESYNC_COUNT: 'resyncs',
+                 DIAG_FOREIGN_FRAME_COUNT: 'foreign_frames'}
+
+
+class ModbusUnit:
+    """
+    The register banks and request handlers of a single Modbus unit.
+    Handlers are looked up by function code in a dispatch table built from FUNCTION_CODES,
+    each returns the response frame, or raises ModbusException to send an exception response.
+    Register addresses are zero based, so 0x0000 is 40001 for holding registers.
+    """
+    def __init__(self, address, coils=None, discrete_inputs=None,
+                 holding_registers=None, input_registers=None, alias_4xxxx=False):
+        """
+        address: int, unit address
+        coils: CoilBank, read/write bits, FC1/5/15
+        discrete_inputs: CoilBank, read only bits, FC2
+        holding_registers: RegisterBank, read/write registers, FC3/6/16/23
+        input_registers: RegisterBank, read only registers, FC4
+        alias_4xxxx: bool, also accept holding register addresses 40001 to 49999 as 0x0000 to 0x270E,
+                     for masters written for the 4xxxx addressing served before
+        """
+        self.address = address
+        self.alias_4xxxx = alias_4xxxx
+        self.coils = coils if coils is not None else CoilBank()
+        self.discrete_inputs = discrete_inputs if discrete_inputs is not None else CoilBank()
+        self.holding_registers = holding_registers if holding_registers is not None else RegisterBank()
+        self.input_registers = input_registers if input_registers is not None else RegisterBank(1000)
+
+        self.stats = Stats()  # Replaced by the stats of the link each request arrives on
+        self.response_data = bytearray(250)  # Response payload buffer, 125 registers max
+        self.response_view = memoryview(self.response_data)
+        self.handlers = {function: getattr(self, name) for function, (_, name) in FUNCTION_CODES.items()}
+
+    def handle(self, frame, stats=None):
+        """
+        Runs the handler for a request frame, returning the response frame.
+        Returns None for broadcasts, which are executed but never answered.
+        stats are the counters of the link the frame arrived on, they are updated and served by FC8/FC11.
+        """
+        if stats is not None:
+            self.stats = stats
+        stats = self.stats
+        stats.server_messages += 1
+        try:
+            if handler := self.handlers.get(frame.function):
+                response = handler(frame)
+            else:
+                raise ModbusException(ILLEGAL_FUNCTION, "Function not implemented: %d" % frame.function)
+        except ModbusException as e:
+            response = ModbusFrame.exception(self.address, frame.function, e.code)
+
+        if not frame.address:
+            stats.server_no_responses += 1
+            return None
+        if response.function & 0x80:
+            stats.bus_exceptions += 1
+        elif frame.function != 11:
+            stats.event_count += 1
+        return response
+
+    def handle_into(self, request, start, end, buf, stats=None):
+        """
+        Handles the request frame in request[start:end], encoding the response with its CRC into buf.
+        Returns the response length, 0 for broadcasts.
+        Bit and register reads are answered from the banks straight into buf, without parsing
+        or building frames, so they allocate nothing. Other requests are parsed and handled,
+        only their response is encoded in place.
+        """
+        function = request[start + 1]
+        if not 1 <= function <= 4 or end - start != 8 or not request[start]:
+            response = self.handle(ModbusFrame.parse_frame(memoryview(request)[start:end], check_crc=False), stats)
+            return response.encode_into(buf) if response is not None else 0
+
+        if stats is not None:
+            self.stats = stats
+        stats = self.stats
+        stats.server_messages += 1
+        first = request[start + 2] << 8 | request[start + 3]
+        count = request[start + 4] << 8 | request[start + 5]
+        if function == 3:
+            bank = self.holding_registers
+            first = self.holding_start(first)
+        elif function == 4:
+            bank = self.input_registers
+        elif function == 1:
+            bank = self.coils
+        elif function == 2:
+            bank = self.discrete_inputs
+        if count < 1 or count > (125 if function > 2 else 2000):
+            code = ILLEGAL_DATA_VALUE
+        elif first + count > len(bank):
+            code = ILLEGAL_DATA_ADDRESS
+        else:
+            length = bank.read_into(buf, first, count, 3)
+            buf[0] = self.address
+            buf[1] = function
+            buf[2] = length
+            stats.event_count += 1
+            return append_crc(buf, length + 3)
+        stats.bus_exceptions += 1
+        return ModbusFrame.exception_into(buf, self.address, function, code)
+
+    def exception_response(self, frame_bytes, code, stats=None):
+        """ Builds an exception response for a request which could not be parsed """
+        if stats is not None:
+            self.stats = stats
+        self.stats.server_messages += 1
+        if frame_bytes[0]:
+            self.stats.bus_exceptions += 1
+        else:
+            self.stats.server_no_responses += 1
+        return ModbusFrame.exception(self.address, frame_bytes[1] & 0x7F, code) if frame_bytes[0] else None
+
+    def holding_start(self, start):
+        """ The zero based holding register address of a request address """
+        if self.alias_4xxxx and 40001 <= start <= 49999:
+            return start - 40001
+        return start
+
+    @staticmethod
+    def check_count(count, maximum):
+        if count < 1 or count > maximum:
+            raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid quantity: %d" % count)
+
+    @staticmethod
+    def check_range(bank, start, count=1):
+        if start + count > len(bank):
+            raise ModbusException(ILLEGAL_DATA_ADDRESS, "Invalid address: %d+%d" % (start, count))
+
+    def _read_bits(self, bank, frame):
+        start, count = frame.data
+        self.check_count(count, 2000)
+        self.check_range(bank, start, count)
+        length = bank.read_into(self.response_data, start, count)
+        return ModbusFrame(self.address, frame.function, self.response_view[:length], response=True)
+
+    def _read_registers(self, bank, frame):
+        start, count = frame.data
+        if bank is self.holding_registers:
+            start = self.holding_start(start)
+        self.check_count(count, 125)
+        self.check_range(bank, start, count)
+        length = bank.read_into(self.response_data, start, count)
+        return ModbusFrame(self.address, frame.function, self.response_view[:length], response=True)
+
+    def read_coils(self, frame):
+        return self._read_bits(self.coils, frame)
+
+    def read_discrete_inputs(self, frame):
+        return self._read_bits(self.discrete_inputs, frame)
+
+    def read_holding_registers(self, frame):
+        return self._read_registers(self.holding_registers, frame)
+
+    def read_input_registers(self, frame):
+        return self._read_registers(self.input_registers, frame)
+
+    def write_single_coil(self, frame):
+        coil, value = frame.data
+        if value not in (0x0000, 0xFF00):
+            raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid coil value: %04x" % value)
+        self.check_range(self.coils, coil)
+        self.coils[coil] = value
+        return ModbusFrame(self.address, 5, frame.data, response=True)
+
+    def write_single_register(self, frame):
+        register, value = frame.data
+        register = self.holding_start(register)
+        self.check_range(self.holding_registers, register)
+        self.holding_registers.set_u16(register, value)
+        return ModbusFrame(self.address, 6, frame.data, response=True)
+
+    def write_multiple_coils(self, frame):
+        start, count, byte_count = frame.data
+        self.check_count(count, 1968)
+        if byte_count != (count + 7) // 8:
+            raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid byte count: %d" % byte_count)
+        self.check_range(self.coils, start, count)
+        self.coils.write_from(start, count, frame.payload)
+        return ModbusFrame(self.address, 15, (start, count), response=True)
+
+    def write_multiple_registers(self, frame):
+        start, count, byte_count = frame.data
+        start = self.holding_start(start)
+        self.check_count(count, 123)
+        if byte_count != count * 2:
+            raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid byte count: %d" % byte_count)
+        self.check_range(self.holding_registers, start, count)
+        self.holding_registers.write_from(start, frame.payload)
+        return ModbusFrame(self.address, 16, (start, count), response=True)
+
+    def read_write_multiple_registers(self, frame):
+        """ Writes are performed before reads, as defined by the specification """
+        read_start, read_count, write_start, write_count, byte_count = frame.data
+        read_start, write_start = self.holding_start(read_start), self.holding_start(write_start)
+        self.check_count(read_count, 125)
+        self.check_count(write_count, 121)
+        if byte_count != write_count * 2:
+            raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid byte count: %d" % byte_count)
+        self.check_range(self.holding_registers, read_start, read_count)
+        self.check_range(self.holding_registers, write_start, write_count)
+        self.holding_registers.write_from(write_start, frame.payload)
+        length = self.holding_registers.read_into(self.response_data, read_start, read_count)
+        return ModbusFrame(self.address, 23, self.response_view[:length], response=True)
+
+    def diagnostics(self, frame):
+        sub_function, data = frame.data
+        if sub_function in (DIAG_RETURN_QUERY_DATA, DIAG_RESTART_COMMUNICATIONS, DIAG_CLEAR_COUNTERS):
+            if sub_function != DIAG_RETURN_QUERY_DATA:
+                self.stats.clear()
+            return ModbusFrame(self.address, 8, frame.data, response=True)
+
+        if sub_function == DIAG_LATENCY_BUCKET:
+            if data >= len(self.stats.latency):
+                raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid latency bucket: %d" % data)
+            value = self.stats.latency[data]
+        elif sub_function in DIAG_COUNTERS:
+            if data:
+                raise ModbusException(ILLEGAL_DATA_VALUE, "Invalid diagnostics data: %d" % data)
+            counter = DIAG_COUNTERS[sub_function]
+            value = getattr(self.stats, counter) if counter else 0
+        else:
+            raise ModbusException(ILLEGAL_FUNCTION, "Diagnostics sub-function not supported: %d" % sub_function)
+        return ModbusFrame(self.address, 8, (sub_function, min(value, 0xFFFF)), response=True)
+
+    def get_comm_event_counter(self, frame):
+        """ The status word is never busy, requests are handled to completion before the next """
+        return ModbusFrame(self.address, 11, (0x0000, self.stats.event_count & 0xFFFF), response=True)
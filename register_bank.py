@@ -0,0 +1,183 @@
+from array import array
+from struct import pack, pack_into, unpack, unpack_from
+
+from buffers import copy_into
+
+
+GENERATION_BLOCK_SHIFT = 6  # Writes are tracked in blocks of 64 registers
+
+
+class RegisterBank:
+    """
+    Contiguous bank of 16 bit registers, stored as big-endian words in a bytearray.
+    Register addresses are zero based, so 0x0000 is 40001 for holding registers.
+
+    Reads copy the registers straight into the caller's buffer, which matches the
+    Modbus wire format, so no per register conversion is needed.
+    Typed accessors pack values in place, 32 bit values use two registers and
+    word_order selects which register holds the high word:
+        'big': high word first (ABCD), the default
+        'little': low word first (CDAB)
+
+    Every write bumps version, and records it as the generation of the blocks it touched,
+    so cached copies of a range can tell whether it changed. Writes made directly to buffer
+    or view are not tracked.
+    """
+    def __init__(self, count=10000, word_order='big'):
+        if word_order not in ('big', 'little'):
+            raise ValueError("Invalid word order: %s" % word_order)
+        self.count = count
+        self.word_order = word_order
+        self.buffer = bytearray(count * 2)
+        self.view = memoryview(self.buffer)
+        self.version = 0
+        self.generations = array('I', (0 for _ in range((count >> GENERATION_BLOCK_SHIFT) + 1)))
+
+    def __len__(self):
+        return self.count
+
+    def check_range(self, start, count=1):
+        if start < 0 or count < 1 or start + count > self.count:
+            raise ValueError("Invalid register range: %d+%d" % (start, count))
+
+    def _touch(self, start, count):
+        self.version += 1
+        for block in range(start >> GENERATION_BLOCK_SHIFT, ((start + count - 1) >> GENERATION_BLOCK_SHIFT) + 1):
+            self.generations[block] = self.version
+
+    def changed_since(self, version, start, count):
+        """ True if a register in the range was written after version """
+        generations = self.generations
+        for block in range(start >> GENERATION_BLOCK_SHIFT, ((start + count - 1) >> GENERATION_BLOCK_SHIFT) + 1):
+            if generations[block] > version:
+                return True
+        return False
+
+    def read_into(self, buf, start, count, offset=0):
+        """ Copies count registers starting at start into buf at offset, returns the byte length """
+        self.check_range(start, count)
+        length = count * 2
+        copy_into(buf, offset, self.buffer, start * 2, length)
+        return length
+
+    def write_from(self, start, data):
+        """ Writes big-endian register data, such as a write request payload, starting at start """
+        self.check_range(start, len(data) // 2)
+        self.buffer[start * 2:start * 2 + len(data)] = data
+        self._touch(start, len(data) // 2)
+
+    def _pack(self, fmt, start, value):
+        count = 2 if fmt in ('>I', '>i', '>f') else 1
+        self.check_range(start, count)
+        pack_into(fmt, self.buffer, start * 2, value)
+        self._touch(start, count)
+
+    def _unpack(self, fmt, start):
+        self.check_range(start, 2 if fmt in ('>I', '>i', '>f') else 1)
+        return unpack_from(fmt, self.buffer, start * 2)[0]
+
+    def _pack32(self, fmt, start, value, word_order):
+        if (word_order or self.word_order) == 'little':
+            # Both words are written in their final order, the bank never holds the value half swapped
+            self.check_range(start, 2)
+            word = unpack('>I', pack(fmt, value))[0]
+            pack_into('>HH', self.buffer, start * 2, word & 0xFFFF, word >> 16)
+            self._touch(start, 2)
+            return
+        self._pack(fmt, start, value)
+
+    def _unpack32(self, fmt, start, word_order):
+        if (word_order or self.word_order) == 'little':
+            # Combined from the two words, a read never writes to the bank
+            self.check_range(start, 2)
+            lo, hi = unpack_from('>HH', self.buffer, start * 2)
+            return unpack(fmt, pack('>I', hi << 16 | lo))[0]
+        return self._unpack(fmt, start)
+
+    def __getitem__(self, start):
+        return self.get_u16(start)
+
+    def __setitem__(self, start, value):
+        self.set_u16(start, value)
+
+    def get_u16(self, start):
+        return self._unpack('>H', start)
+
+    def set_u16(self, start, value):
+        self._pack('>H', start, value)
+
+    def get_i16(self, start):
+        return self._unpack('>h', start)
+
+    def set_i16(self, start, value):
+        self._pack('>h', start, value)
+
+    def get_u32(self, start, word_order=None):
+        return self._unpack32('>I', start, word_order)
+
+    def set_u32(self, start, value, word_order=None):
+        self._pack32('>I', start, value, word_order)
+
+    def get_i32(self, start, word_order=None):
+        return self._unpack32('>i', start, word_order)
+
+    def set_i32(self, start, value, word_order=None):
+        self._pack32('>i', start, value, word_order)
+
+    def get_float32(self, start, word_order=None):
+        return self._unpack32('>f', start, word_order)
+
+    def set_float32(self, start, value, word_order=None):
+        self._pack32('>f', start, value, word_order)
+
+
+class CoilBank:
+    """
+    Bank of single bit coils or discrete inputs, packed LSB first like the Modbus wire format.
+    """
+    def __init__(self, count=2000):
+        self.count = count
+        self.buffer = bytearray((count + 7) // 8)
+        self.view = memoryview(self.buffer)
+
+    def __len__(self):
+        return self.count
+
+    def check_range(self, start, count=1):
+        if start < 0 or count < 1 or start + count > self.count:
+            raise ValueError("Invalid coil range: %d+%d" % (start, count))
+
+    def __getitem__(self, index):
+        self.check_range(index)
+        return bool(self.buffer[index >> 3] & (1 << (index & 7)))
+
+    def __setitem__(self, index, value):
+        self.check_range(index)
+        if value:
+            self.buffer[index >> 3] |= 1 << (index & 7)
+        else:
+            self.buffer[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def read_into(self, buf, start, count, offset=0):
+        """ Packs count bits starting at start into buf at offset, returns the byte length """
+        self.check_range(start, count)
+        length = (count + 7) // 8
+        byte, shift = start >> 3, start & 7
+        if not shift:
+            copy_into(buf, offset, self.buffer, byte, length)
+        else:
+            bits, last = self.buffer, len(self.buffer) - 1
+            for i in range(length):
+                value = bits[byte + i] >> shift
+                if byte + i < last:
+                    value |= bits[byte + i + 1] << (8 - shift)
+                buf[offset + i] = value & 0xFF
+        if count & 7:  # Unused bits of the last byte must be zero
+            buf[offset + length - 1] &= (1 << (count & 7)) - 1
+        return length
+
+    def write_from(self, start, count, data):
+        """ Writes count bits from packed data, such as a write request payload, starting at start """
+        self.check_range(start, count)
+        for i in range(count):
+            self[start + i] = data[i >> 3] & (1 << (i & 7))
@@ -0,0 +1,153 @@
+"""
+Persistent snapshots of a RegisterBank in flash.
+
+The first count registers are saved as a raw image of the bank buffer behind a small header,
+alternating between two slot files, path.a and path.b, so a power loss during a save
+only ever damages the older snapshot. On boot the newest slot with a valid CRC is read
+straight into the bank buffer with a single readinto, nothing is parsed per register.
+"""
+from struct import calcsize, pack, unpack
+from uasyncio import sleep_ms
+from utime import ticks_ms, ticks_us, ticks_diff
+
+from crc16_modbus import CRC16_INIT, crc16_update
+
+
+SNAPSHOT_MAGIC = b'MBRS'
+SNAPSHOT_HEADER = '<4sIII'  # magic, sequence, image length in bytes, CRC16 of the sequence, length and image
+SNAPSHOT_HEADER_LENGTH = calcsize(SNAPSHOT_HEADER)
+SLOTS = ('a', 'b')
+WRITE_CHUNK = 1024  # Bytes written between yields to the loop
+
+
+class RegisterStore:
+    """
+    Saves the first count registers of a bank, coalescing writes over interval_ms.
+
+    runloop() checks the bank version every interval_ms and saves once if it changed,
+    so a master rewriting setpoints costs at most one flash write per interval.
+    Saves write WRITE_CHUNK bytes at a time and yield between them; registers written
+    meanwhile may or may not be in that snapshot, and make the next check save again.
+
+    wait_quiet is an async function returning once flash writes no longer delay the bus,
+    such as ModbusRTUClient.wait_quiet, awaited before each chunk.
+
+    fs is the filesystem, an object with open(path, mode), the builtin open by default,
+    sim.FlashFS is a file-backed stand-in which can cut a write short like a power loss.
+    """
+    def __init__(self, bank, path, count=None, interval_ms=5000, wait_quiet=None, fs=None, debug=False):
+        self.bank = bank
+        self.path = path
+        self.length = (bank.count if count is None else min(count, bank.count)) * 2
+        self.interval_ms = interval_ms
+        self.open = open if fs is None else fs.open
+        self.wait_quiet = wait_quiet
+        self.debug = debug
+        self.sequence = 0  # Of the newest snapshot
+        self.saved_version = bank.version
+        self.saves = 0
+        self.save_us = 0  # Time the last save took, including the yields
+        self.restore_us = 0  # Time the restore took
+
+    def log(self, msg):
+        if self.debug:
+            print("[%d] %s" % (ticks_ms(), msg))
+
+    def slot_path(self, sequence):
+        return "%s.%s" % (self.path, SLOTS[sequence & 1])
+
+    def _crc(self, sequence, length, image):
+        crc = crc16_update(pack('<II', sequence, length), 0, 8, CRC16_INIT)
+        return crc16_update(image, 0, length, crc)
+
+    def _read_header(self, f):
+        header = f.read(SNAPSHOT_HEADER_LENGTH)
+        if len(header) != SNAPSHOT_HEADER_LENGTH:
+            return None
+        magic, sequence, length, crc = unpack(SNAPSHOT_HEADER, header)
+        if magic != SNAPSHOT_MAGIC or length > len(self.bank.buffer) or length & 1:
+            return None
+        return sequence, length, crc
+
+    def _headers(self):
+        """ Returns (sequence, length, crc, path) of each readable slot, newest first """
+        found = []
+        for slot in SLOTS:
+            path = "%s.%s" % (self.path, slot)
+            try:
+                with self.open(path, 'rb') as f:
+                    if header := self._read_header(f):
+                        found.append(header + (path,))
+            except OSError:
+                pass
+        found.sort(reverse=True)
+        return found
+
+    def restore(self):
+        """
+        Reads the newest valid snapshot into the bank, returns its sequence, or None if there is none.
+        A snapshot failing its CRC is skipped for the older one, the bank is zeroed if neither is valid.
+        The time taken is kept in restore_us.
+        """
+        start = ticks_us()
+        buffer = self.bank.buffer
+        restored = None
+        for sequence, length, crc, path in self._headers():
+            with self.open(path, 'rb') as f:
+                f.seek(SNAPSHOT_HEADER_LENGTH)
+                read = f.readinto(memoryview(buffer)[:length])
+            if read == length and self._crc(sequence, length, buffer) == crc:
+                restored = self.sequence = sequence
+                break
+            self.log("RegisterStore: Snapshot %d in %s is damaged" % (sequence, path))
+        else:
+            length = 0
+        if length < len(buffer):
+            buffer[length:] = bytes(len(buffer) - length)  # Registers the snapshot does not cover
+        self.bank._touch(0, self.bank.count)
+        self.saved_version = self.bank.version
+        self.restore_us = ticks_diff(ticks_us(), start)
+        self.log("RegisterStore: Restored snapshot %s in %d us" % (restored, self.restore_us))
+        return restored
+
+    @property
+    def dirty(self):
+        return self.bank.version != self.saved_version
+
+    async def save(self):
+        """ Writes the registers to the older slot, yielding between chunks, each waits while the bus is busy """
+        start = ticks_us()
+        version = self.bank.version
+        sequence = self.sequence + 1
+        view = self.bank.view
+        if self.wait_quiet is not None:
+            await self.wait_quiet()
+        with self.open(self.slot_path(sequence), 'wb') as f:
+            f.write(pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, sequence, self.length, 0))
+            crc = crc16_update(pack('<II', sequence, self.length), 0, 8, CRC16_INIT)
+            for offset in range(0, self.length, WRITE_CHUNK):
+                end = min(offset + WRITE_CHUNK, self.length)
+                if self.wait_quiet is not None:
+                    await self.wait_quiet()
+                chunk = view[offset:end]
+                crc = crc16_update(chunk, 0, end - offset, crc)  # Of what is written, registers may change meanwhile
+                f.write(chunk)
+                await sleep_ms(0)
+            if self.wait_quiet is not None:
+                await self.wait_quiet()
+            f.seek(0)
+            f.write(pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, sequence, self.length, crc))
+        self.sequence = sequence
+        self.saved_version = version
+        self.saves += 1
+        self.save_us = ticks_diff(ticks_us(), start)
+        self.log("RegisterStore: Saved snapshot %d to %s in %d us" % (sequence, self.slot_path(sequence), self.save_us))
+
+    async def runloop(self):
+        while True:
+            await sleep_ms(self.interval_ms)
+            if self.dirty:
+                try:
+                    await self.save()
+                except OSError as e:
+                    self.log("RegisterStore: Save failed: %s" % e)
@@ -0,0 +1,75 @@
+from struct import unpack_from
+
+
+CACHED_FUNCTIONS = (3, 4)  # Register reads, the requests masters repeat every poll cycle
+
+
+class ResponseCache:
+    """
+    Encoded responses to register reads, keyed on the raw request frame.
+    units maps unit addresses to their ModbusUnit, the address byte of a request selects the bank.
+
+    A hit returns the complete RTU response, CRC included, ready to send, so no frame is parsed,
+    built or encoded. Each entry records the version of its register bank when it was stored,
+    and is dropped once a write touched its range, tracked by the bank generations.
+    The cache is cleared when full, polls repeat so it refills within a cycle.
+    """
+    def __init__(self, units, size=16):
+        self.units = units
+        self.size = size
+        self.entries = {}  # Request bytes: (bank, start, count, version, response bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return "hits: %d, misses: %d, hit rate: %d%%" % (self.hits, self.misses, self.hit_rate)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits * 100 // total if total else 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def _bank(self, request):
+        unit = self.units[request[0]]
+        return unit.holding_registers if request[1] == 3 else unit.input_registers
+
+    def lookup(self, request, stats=None):
+        """
+        Returns the cached response to a request frame, or None.
+        Hits are counted in stats like a handled request.
+        """
+        if len(request) != 8 or request[1] not in CACHED_FUNCTIONS:
+            return None
+        key = bytes(request)
+        if (entry := self.entries.get(key)) is None:
+            self.misses += 1
+            return None
+        bank, start, count, version, response = entry
+        if bank.changed_since(version, start, count):
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        if stats is not None:
+            stats.server_messages += 1
+            stats.event_count += 1
+        return response
+
+    def store(self, request, response):
+        """ Caches the encoded response to a register read request, exception responses are not cached """
+        if (len(request) != 8 or request[1] not in CACHED_FUNCTIONS or response[1] & 0x80
+                or request[0] not in self.units):
+            return
+        if len(self.entries) >= self.size:
+            self.entries.clear()
+        bank = self._bank(request)
+        start, count = unpack_from('>HH', request, 2)
+        if request[1] == 3:
+            start = self.units[request[0]].holding_start(start)
+        self.entries[bytes(request)] = (bank, start, count, bank.version, bytes(response))
@@ -0,0 +1,95 @@
+from array import array
+
+
+class RingQueue:
+    """
+    Fixed capacity FIFO of preallocated, reusable byte buffers.
+
+    The producer fills the buffer returned by reserve(), for example with uart.readinto(),
+    then commits the length, or copies data in with put().
+    pop() returns a memoryview of the oldest buffer, it stays valid until the producer
+    wraps around to that slot again, so the consumer should copy it out before yielding.
+
+    head and tail are free running counters, the producer only writes head
+    and the consumer only writes tail, except when dropping the oldest entry.
+
+    overflow selects what is lost when the queue is full:
+        'oldest': the oldest entry is overwritten
+        'newest': the incoming data is discarded
+    """
+    OVERFLOW_POLICIES = ('oldest', 'newest')
+
+    def __init__(self, capacity=8, slot_size=256, overflow='oldest'):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: %s" % overflow)
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.overflow = overflow
+        self.slots = [bytearray(slot_size) for _ in range(capacity)]
+        self.views = [memoryview(slot) for slot in self.slots]
+        self.lengths = array('H', (0 for _ in range(capacity)))
+        self.discard = bytearray(slot_size)  # Filled instead of a slot when dropping the newest data
+        self.head = 0
+        self.tail = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def reserve(self):
+        """ Returns the buffer the next entry should be written into """
+        if self.head - self.tail >= self.capacity and self.overflow == 'newest':
+            return self.discard
+        return self.slots[self.head % self.capacity]
+
+    def commit(self, length):
+        """ Queues the reserved buffer, holding length bytes, returns True when an entry was dropped """
+        if not length:
+            return False
+        dropped = self.head - self.tail >= self.capacity
+        if dropped:
+            self.dropped += 1
+            if self.overflow == 'newest':
+                return True
+            self.tail += 1  # The reserved slot was the oldest entry
+        self.lengths[self.head % self.capacity] = length
+        self.head += 1
+        self.enqueued += 1
+        if self.head - self.tail > self.high_water:
+            self.high_water = self.head - self.tail
+        return dropped
+
+    def put(self, data):
+        """ Copies data into the queue, truncated to the slot size, returns True when an entry was dropped """
+        length = min(len(data), self.slot_size)
+        self.reserve()[:length] = data[:length]
+        return self.commit(length)
+
+    def pop(self):
+        """ Removes the oldest entry and returns a view of it, or None if the queue is empty """
+        if self.head == self.tail:
+            return None
+        index = self.tail % self.capacity
+        self.tail += 1
+        return self.views[index][:self.lengths[index]]
+
+    def pop_index(self):
+        """
+        Removes the oldest entry and returns its slot index, or -1 if the queue is empty.
+        The entry is slots[index] and lengths[index], nothing is allocated.
+        """
+        if self.head == self.tail:
+            return -1
+        index = self.tail % self.capacity
+        self.tail += 1
+        return index
+
+    def clear(self):
+        self.tail = self.head
+
+    @property
+    def stats(self):
+        return {'enqueued': self.enqueued, 'dropped': self.dropped,
+                'high_water': self.high_water, 'queued': len(self)}
@@ -1,6 +1,14 @@
 from machine import UART, Pin
-from uasyncio import sleep_ms, create_task, Event, Lock
-from utime import sleep_us, ticks_ms
+from uasyncio import sleep_ms, create_task, wait_for_ms, Event, Lock, ThreadSafeFlag, StreamReader, TimeoutError
+from utime import sleep_us, ticks_ms, ticks_us, ticks_add, ticks_diff
+from math import ceil
+
+from ring_queue import RingQueue
+from stats import Stats
+from tracing import TRACE, EV_RX, EV_TX
+from bus_capture import CAP_RX, CAP_TX
+from rs485_calibration import (CALIBRATION_FILE, TEST_PATTERN, calibration_key, load_calibration, save_calibration,
+                               search_hold_time)
 
 
 def get_serial_chartime(baudrate, data_bits, parity, stop_bits):
@@ -9,31 +17,88 @@ def get_serial_chartime(baudrate, data_bits, parity, stop_bits):
     return 1000 * packet_size / baudrate
 
 
+def get_frame_gap(baudrate, data_bits, parity, stop_bits):
+    """ The t3.5 silence which ends a Modbus RTU frame, in us. Fixed at 1750 us above 19200 baud. """
+    if baudrate > 19200:
+        return 1750
+    return ceil(3.5 * get_serial_chartime(baudrate, data_bits, parity, stop_bits) * 1000)
+
+
 class RS485:
+    """
+    Half duplex RS485 transceiver on a UART with a driver enable pin.
+
+    Received chunks are read straight into the preallocated buffers of the messages RingQueue,
+    and the received event is set.
+    The receive path is selected with rx_mode:
+        'irq': woken by the UART RX idle interrupt, which marks the end of a frame
+        'stream': awaits an asyncio StreamReader over the UART, the frame gap is a read timeout
+        'poll': reads the UART in a loop, every poll_interval ms
+    Modes which are not supported by the UART fall back to polling.
+
+    With a BusCapture attached, every received and transmitted chunk is also copied to its log.
+    """
+    RX_MODES = ('irq', 'stream', 'poll')
+    framed = False  # messages holds raw chunks, frames are delimited by the protocol layer
+
     def __init__(self, tx_pin, rx_pin, de_pin, uart=0,
                  baudrate=9600, data_bits=8, parity=None, stop_bits=1,
                  timeout_char=2,  # UART timeout in ms
                  poll_interval=100,  # recv poll interval in ms
                  tx_delay=0,  # delay between consecutive transmissions in us
                  driver_delay=1.5,  # RS485 driver delay after sending data, in char times
+                 rx_mode='poll',  # receive path, one of RX_MODES
+                 queue_size=8,  # number of received chunks buffered for the protocol layer
+                 overflow='oldest',  # chunk dropped when the queue is full, 'oldest' or 'newest'
+                 calibration=CALIBRATION_FILE,  # calibrated turnaround file, None to use the defaults
                  debug=False):
+        """
+        uart and de_pin may be UART and Pin like objects instead of ids, to use simulated hardware.
+        """
         self.debug = debug
-        self.driver_delay = int(driver_delay * get_serial_chartime(baudrate, data_bits, parity, stop_bits) * 1000)
+        self.baudrate = baudrate
+        self.bit_time = 1000000 / baudrate  # in us
+        self.char_time = int(get_serial_chartime(baudrate, data_bits, parity, stop_bits) * 1000)  # in us
+        self.driver_delay = int(driver_delay * self.char_time)
+        self.frame_gap = get_frame_gap(baudrate, data_bits, parity, stop_bits)
+        self.calibration = calibration
+        self.calibration_key = calibration_key(baudrate, data_bits, parity, stop_bits)
+        if calibration and (calibrated := load_calibration(self.calibration_key, calibration)):
+            driver_delay, tx_delay = calibrated
+            self.driver_delay = driver_delay
         self.tx_delay = int(tx_delay)
         if tx_delay > 0:
             timeout = int(tx_delay / 1000 + timeout_char)  # timeout for uart read, in ms
         else:
             timeout = timeout_char * 2  # default to 2 chartimes
-        self.uart = UART(uart, baudrate=baudrate, tx=tx_pin, rx=rx_pin, bits=data_bits,
-                         parity=parity, stop=stop_bits, timeout_char=timeout_char, timeout=timeout)
+        if isinstance(uart, int):
+            uart = UART(uart, baudrate=baudrate, tx=tx_pin, rx=rx_pin, bits=data_bits,
+                        parity=parity, stop=stop_bits, timeout_char=timeout_char, timeout=timeout)
+        self.uart = uart
         self.log(f"RS485: Initialized UART: {self.uart}")
         self.log(f"RS485 driver delay: {self.driver_delay} us")
         self.log(f"RS485 TX delay: {self.tx_delay} us")
         self.log(f"RS485 Poll interval: {poll_interval} ms")
-        self.de = Pin(de_pin, mode=Pin.OUT)
+        self.de = Pin(de_pin, mode=Pin.OUT) if isinstance(de_pin, int) else de_pin
+
+        if rx_mode not in self.RX_MODES:
+            raise ValueError("Invalid rx mode: %s" % rx_mode)
+        if rx_mode == 'irq' and not (hasattr(self.uart, 'irq') and hasattr(self.uart, 'IRQ_RXIDLE')):
+            self.log("RS485: UART RX idle interrupt not available, falling back to polling")
+            rx_mode = 'poll'
+        self.rx_mode = rx_mode
+        self.log(f"RS485 RX mode: {rx_mode}")
 
         self.poll_interval = int(poll_interval)  # 0 to poll continuously
-        self.messages = []
+        self.messages = RingQueue(queue_size, 256, overflow)
+        self.idle = True  # Set when the last read timed out without data
+        self.rx_time = None  # ticks_us of the last received chunk, for the turnaround latency
+        self.tx_yield = False  # Await the transmission instead of blocking the loop, set when serving several ports
+        self.tx_ready = ticks_us()  # ticks_us after which the next transmission may start
+        self.stats = Stats()
+        self.capture = None  # BusCapture recording the traffic, set by BusCapture.attach()
+        self.capture_port = 0
+        self.received = Event()  # Set when a message is queued, or the bus went idle
 
         self.run = Event()
         self.dev_lock = Lock()
@@ -45,33 +110,178 @@ class RS485:
 
     async def runloop(self):
         self.run.set()
+        await getattr(self, '_%s_loop' % self.rx_mode)()
+
+    async def _poll_loop(self):
         while True:
             await self.run.wait()
             await self.recv()
             if self.poll_interval:
                 await sleep_ms(self.poll_interval)
 
+    async def _irq_loop(self):
+        """ Sleeps until the RX idle interrupt, the line has been silent so the frame is complete """
+        rx_flag = ThreadSafeFlag()
+        self.uart.irq(handler=lambda uart: rx_flag.set(), trigger=self.uart.IRQ_RXIDLE)
+        while True:
+            await rx_flag.wait()
+            await self.run.wait()
+            async with self.dev_lock:
+                self.de.off()
+                self._recv(wait=False)
+                self._set_idle()
+
+    async def _stream_loop(self):
+        """ Awaits data from a StreamReader, a read timing out after t3.5 marks the frame gap """
+        reader = StreamReader(self.uart)
+        gap_ms = ceil(self.frame_gap / 1000)
+        while True:
+            await self.run.wait()
+            try:
+                data = await wait_for_ms(reader.read(256), gap_ms)
+            except TimeoutError:
+                self._set_idle()
+                continue
+            if data:
+                if self.messages.put(data):
+                    self.stats.character_overruns += 1
+                self._received(data, len(data))
+
     async def recv(self):
         async with self.dev_lock:
             self.de.off()  # Set DE pin to receive mode
             if not self._recv() and not self.poll_interval:  # Get some data, wait if there os no poll interval
                 await sleep_ms(1)  # if there is not data, pause a bit to avoid lockup
 
-    def _recv(self):
-        if data := self.uart.read():
-            self.log(f"Received data: {data.hex()}")
-            self.messages.append(data)
+    def _received(self, data, length):
+        self.rx_time = ticks_us()
+        if TRACE.enabled:
+            TRACE.record(EV_RX, length, 0, memoryview(data)[:length])
+        if self.capture is not None:
+            self.capture.record(self.capture_port, CAP_RX, data, length)
+        self.idle = False
+        self.received.set()
+
+    def _set_idle(self):
+        if not self.idle:
+            self.idle = True
+            self.received.set()
+
+    def _recv(self, wait=True):
+        """
+        Reads into the next queue buffer.
+        Without wait, only what the UART already holds is read, never waiting for the timeout.
+        """
+        if available := self.uart.any():
+            buf = self.messages.reserve()
+            if length := self.uart.readinto(buf) if wait else self.uart.readinto(buf, min(available, len(buf))):
+                if self.messages.commit(length):
+                    self.stats.character_overruns += 1
+                self._received(buf, length)
+                return length
+        self._set_idle()
 
     def _send(self, data):
+        if self.rx_time is not None:
+            self.stats.record_latency(ticks_diff(ticks_us(), self.rx_time))
+            self.rx_time = None
         self.de.on()
-        self.log(f"Sending data: {data.hex()}")
+        if TRACE.enabled:
+            TRACE.record(EV_TX, len(data), 0, data)
+        if self.capture is not None:
+            self.capture.record(self.capture_port, CAP_TX, data, len(data))
         self.uart.write(data)
         self.uart.flush()
         sleep_us(self.driver_delay)  # Wait for the rs485 driver to complete the transmission
         self.de.off()  # Only disable DE after the uart write is complete
 
+    def loopback_probe(self, pattern, hold_us, timeout_ms=10):
+        """
+        Sends pattern, holding DE for hold_us after the flush.
+        Returns True if the pattern was received back intact,
+        this needs the receiver enabled during transmission, or a peer echoing the pattern.
+        """
+        while self.uart.any():  # Discard stale data
+            self.uart.read()
+        self.de.on()
+        self.uart.write(pattern)
+        self.uart.flush()
+        sleep_us(hold_us)
+        self.de.off()
+        received = b''
+        start = ticks_ms()
+        while len(received) < len(pattern) and ticks_diff(ticks_ms(), start) < timeout_ms:
+            if self.uart.any():
+                received += self.uart.read(len(pattern) - len(received))
+        return received == pattern
+
+    async def calibrate(self, pattern=TEST_PATTERN, repeats=5, save=True):
+        """
+        Finds the shortest DE hold time after a flush which does not truncate the last byte,
+        searching up to the current driver_delay, and adds one bit time of margin.
+        flush() returns as the last character starts shifting out, so the first char_time of the hold
+        is still data on the wire, and the t3.5 gap starts when that character ends.
+        tx_delay covers the part of the gap the rest of the hold does not.
+        The result is used right away, and stored for these line settings if save is set.
+        Returns the (driver_delay, tx_delay) in us, or None if the probe fails at the current delay.
+        """
+        self.run.clear()  # Pause the receiver
+        try:
+            async with self.dev_lock:
+                hold = search_hold_time(lambda hold_us: self.loopback_probe(pattern, hold_us),
+                                        0, self.driver_delay, repeats)
+        finally:
+            self.run.set()
+        if hold is None:
+            self.log("RS485: Calibration failed at %d us" % self.driver_delay)
+            return None
+
+        self.driver_delay = hold + ceil(self.bit_time)
+        self.tx_delay = max(0, self.frame_gap - max(0, self.driver_delay - self.char_time))
+        self.log(f"RS485: Calibrated driver delay: {self.driver_delay} us, TX delay: {self.tx_delay} us")
+        if save and self.calibration:
+            save_calibration(self.calibration_key, self.driver_delay, self.tx_delay, self.calibration)
+        return self.driver_delay, self.tx_delay
+
+    async def _send_yielding(self, data):
+        """
+        Like _send, yielding to other tasks while the UART shifts the data out.
+        The gap before the next transmission is kept as a deadline instead of a sleep.
+        """
+        while ticks_diff(self.tx_ready, ticks_us()) > 0:
+            await sleep_ms(0)
+        if self.rx_time is not None:
+            self.stats.record_latency(ticks_diff(ticks_us(), self.rx_time))
+            self.rx_time = None
+        self.de.on()
+        if TRACE.enabled:
+            TRACE.record(EV_TX, len(data), 0, data)
+        if self.capture is not None:
+            self.capture.record(self.capture_port, CAP_TX, data, len(data))
+        self.uart.write(data)
+        while not self.uart.txdone():
+            await sleep_ms(0)
+        # txdone is set once the last character has ended, the driver delay is counted from its start
+        sleep_us(max(0, self.driver_delay - self.char_time))
+        self.de.off()
+        self.tx_ready = ticks_add(ticks_us(), self.tx_delay)
+
+    def send_nowait(self, data):
+        """
+        Sends data without awaiting, nothing is allocated.
+        Returns False when the device is locked or sends yield, the caller then awaits send().
+        """
+        if self.dev_lock.locked() or self.tx_yield:
+            return False
+        self._send(data)
+        sleep_us(self.tx_delay)
+        return True
+
     async def send(self, data):
         async with self.dev_lock:
+            if self.tx_yield and hasattr(self.uart, 'txdone'):
+                await self._send_yielding(data)
+                return
             self._send(data)
             sleep_us(self.tx_delay)  # Sleep between consecutive transmissions
 
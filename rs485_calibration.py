@@ -0,0 +1,64 @@
+"""
+Turnaround calibration for RS485 transceivers.
+
+The driver enable pin must stay on until the last stop bit has left the UART shift register,
+uart.flush() returns before that, so RS485 holds DE for driver_delay us after flushing.
+Calibration finds the shortest hold which still delivers the last byte intact,
+and stores it per line settings, as the character time and so t3.5 depend on the parity and stop bits,
+so later runs start with it instead of the conservative default.
+"""
+from json import load, dump
+
+
+CALIBRATION_FILE = 'rs485_calibration.json'
+# Ends in 0x00 so the stop bit of the last byte must be driven, a biased idle line can't fake it
+TEST_PATTERN = b'\x55\xaa\xff\x00\x55\xaa\xff\x00'
+
+
+def calibration_key(baudrate, data_bits=8, parity=None, stop_bits=1):
+    """ The entry of a line in the calibration file, such as '19200 8E1', parity is None, 0 for even or 1 for odd """
+    return "%d %d%s%d" % (baudrate, data_bits, 'N' if parity is None else 'EO'[parity], stop_bits)
+
+
+def load_calibration(key, path=CALIBRATION_FILE):
+    """ Returns the calibrated (driver_delay, tx_delay) in us for a calibration_key, or None """
+    try:
+        with open(path) as f:
+            calibration = load(f)
+    except (OSError, ValueError):
+        return None
+    if values := calibration.get(key):
+        return tuple(values)
+
+
+def save_calibration(key, driver_delay, tx_delay, path=CALIBRATION_FILE):
+    try:
+        with open(path) as f:
+            calibration = load(f)
+    except (OSError, ValueError):
+        calibration = {}
+    calibration[key] = [driver_delay, tx_delay]
+    with open(path, 'w') as f:
+        dump(calibration, f)
+
+
+def search_hold_time(probe, low, high, repeats=5):
+    """
+    Binary searches the smallest hold time in [low, high] us for which probe(hold) passes
+    every one of repeats attempts. Returns None if even high fails.
+    """
+    def passes(hold):
+        for _ in range(repeats):
+            if not probe(hold):
+                return False
+        return True
+
+    if not passes(high):
+        return None
+    while low < high:
+        mid = (low + high) // 2
+        if passes(mid):
+            high = mid
+        else:
+            low = mid + 1
+    return high
@@ -0,0 +1,138 @@
+from _thread import start_new_thread
+from uasyncio import sleep_ms, ThreadSafeFlag
+from utime import sleep_us, ticks_us, ticks_diff
+
+from buffers import copy_into
+from ring_queue import RingQueue
+from rs485 import RS485
+from rtu_decoder import RTUDecoder
+
+
+class RS485Thread(RS485):
+    """
+    RS485 transceiver driven from the second core.
+
+    A worker started with _thread reads the UART, delimits frames with its own RTUDecoder,
+    and transmits responses, so none of it waits for the asyncio loop on core 0.
+    Complete frames are handed to core 0 in messages, and responses come back in responses.
+    Both are single producer, single consumer RingQueues which drop the newest entry when full,
+    so each index is only ever written by one core and no lock is needed.
+
+    Responses are held until response_slot_us after the end of their request, and sent then,
+    so the turnaround stays constant while core 0 answers within the slot, even with a display
+    refresh or user code holding the loop. It defaults to the t3.5 frame gap, the earliest a
+    response may start. Responses which miss the slot are sent right away, and counted in late.
+
+    The worker never records trace events or captures traffic, the trace and capture buffers belong to core 0.
+    It allocates nothing once each response length was sent, a collection started by core 0 stops core 1,
+    so frames are delimited with push() and next_frame() and copied into the queue by offset.
+    """
+    RX_MODES = ('thread',)
+    framed = True  # messages holds complete frames
+
+    def __init__(self, *args, response_slot_us=None, queue_size=8, **kwargs):
+        """
+        Takes the RS485 arguments, rx_mode and overflow are fixed.
+        response_slot_us: int, time from the end of a request to its response, None for the frame gap
+        """
+        kwargs['rx_mode'] = 'thread'
+        kwargs['overflow'] = 'newest'
+        super().__init__(*args, queue_size=queue_size, **kwargs)
+        self.response_slot = self.frame_gap if response_slot_us is None else int(response_slot_us)
+        self.responses = RingQueue(queue_size, 256, 'newest')
+        self.decoder = RTUDecoder(stats=self.stats)
+        self.chunk = bytearray(256)
+        self.response_views = {}  # Queue slot index * 257 + length: view of the response, each created once
+        self.running = False
+        self.paused = False  # Set by the worker while run is cleared
+        self.late = 0  # Responses sent after their slot
+        self.received = ThreadSafeFlag()  # Set by the worker itself, waking core 0 without a relay task
+
+    async def _thread_loop(self):
+        """ Runs the worker for as long as this task, it is stopped when the task is cancelled """
+        self.running = True
+        start_new_thread(self._worker, ())
+        try:
+            while self.running:
+                await sleep_ms(1000)
+        finally:
+            self.running = False
+
+    def stop(self):
+        """ Ends the worker, it exits after its current step """
+        self.running = False
+
+    def _worker(self):
+        """ Core 1: transmits queued responses, otherwise reads and delimits frames """
+        uart, decoder, responses, chunk = self.uart, self.decoder, self.responses, self.chunk
+        last_rx = None  # ticks_us when the last byte was read
+        self.de.off()
+        while self.running:
+            if not self.run.is_set():
+                self.paused = True
+                sleep_us(100)
+                continue
+            self.paused = False
+            if (index := responses.pop_index()) >= 0:
+                self._transmit(self._response_view(index, responses.lengths[index]))
+            elif available := uart.any():
+                if length := uart.readinto(chunk, min(available, len(chunk))):
+                    last_rx = ticks_us()
+                    self.idle = False
+                    decoder.push(chunk, length)
+                    while end := decoder.next_frame():
+                        self._deliver(decoder.frame_start, end, last_rx)
+            elif last_rx is not None and ticks_diff(ticks_us(), last_rx) >= self.frame_gap:
+                while end := decoder.next_frame(True):
+                    self._deliver(decoder.frame_start, end, last_rx)
+                decoder.reset()
+                last_rx = None
+                self.idle = True
+                self.received.set()
+
+    def _response_view(self, index, length):
+        key = index * 257 + length
+        if (view := self.response_views.get(key)) is None:
+            view = self.response_views[key] = self.responses.views[index][:length]
+        return view
+
+    def _deliver(self, start, end, rx_time):
+        """ Queues the frame in decoder.buffer[start:end] for core 0 """
+        messages = self.messages
+        copy_into(messages.reserve(), 0, self.decoder.buffer, start, end - start)
+        if messages.commit(end - start):
+            self.stats.character_overruns += 1
+        self.rx_time = rx_time
+        self.received.set()
+
+    def _transmit(self, data):
+        """ Waits for the response slot of the last request, then sends data """
+        if self.rx_time is not None:
+            wait = self.response_slot - ticks_diff(ticks_us(), self.rx_time)
+            if wait > 0:
+                sleep_us(wait)
+            else:
+                self.late += 1
+            self.stats.record_latency(ticks_diff(ticks_us(), self.rx_time))
+            self.rx_time = None
+        self.de.on()
+        self.uart.write(data)
+        self.uart.flush()
+        sleep_us(self.driver_delay)
+        self.de.off()
+        sleep_us(self.tx_delay)
+
+    def send_nowait(self, data):
+        """ Queues data for the worker, it is sent in the slot of the request it answers """
+        self.responses.put(data)
+        return True
+
+    async def send(self, data):
+        self.send_nowait(data)
+
+    async def calibrate(self, *args, **kwargs):
+        """ Pauses the worker, the probes use the UART from core 0 """
+        self.run.clear()
+        while self.running and not self.paused:
+            await sleep_ms(1)
+        return await super().calibrate(*args, **kwargs)
@@ -0,0 +1,185 @@
+from buffers import copy_into
+from crc16_modbus import CRC16_INIT, crc16_update
+from stats import Stats
+
+
+MAX_FRAME_LENGTH = 256  # Modbus RTU ADU limit, address + PDU + CRC
+
+# Total frame lengths for requests with a fixed size, indexed by function code
+REQUEST_LENGTHS = {1: 8, 2: 8, 3: 8, 4: 8, 5: 8, 6: 8, 8: 8, 11: 4}
+# Requests carrying a byte count: (byte count offset, frame length without the data)
+REQUEST_BYTE_COUNTS = {15: (6, 9), 16: (6, 9), 23: (10, 13)}
+
+RESPONSE_LENGTHS = {5: 8, 6: 8, 8: 8, 11: 8, 15: 8, 16: 8}
+RESPONSE_BYTE_COUNTS = {1: (2, 5), 2: (2, 5), 3: (2, 5), 4: (2, 5), 23: (2, 5)}
+EXCEPTION_LENGTH = 5
+
+
+class RTUDecoder:
+    """
+    Incremental Modbus RTU frame delimiter.
+
+    Received chunks are copied once into a fixed buffer, frame boundaries are found
+    using the expected length for each function code. The CRC of the candidate frame is
+    updated as bytes arrive, so a frame is checked the moment its last byte lands,
+    by the CRC over the data and CRC being zero.
+    Complete frames are yielded as memoryviews into the buffer, they are only valid
+    until the next call to feed() or gap().
+
+    When a candidate frame is invalid, the start index is moved forward a single byte,
+    no data is copied or reparsed.
+
+    push() and next_frame() do the same without a generator or views, frames are
+    addressed by their offsets in buffer, so delimiting allocates nothing.
+    """
+    def __init__(self, size=512, response=False, stats=None):
+        """
+        size: int, buffer size, must hold two max length frames
+        response: bool, decode slave responses instead of master requests
+        stats: Stats, counts frames, CRC errors and resyncs
+        """
+        if size < 2 * MAX_FRAME_LENGTH:
+            raise ValueError("Decoder buffer too small: %d < %d" % (size, 2 * MAX_FRAME_LENGTH))
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Start of the current candidate frame
+        self.frame_start = 0  # Start of the frame last returned by next_frame()
+        self.end = 0  # End of the received data
+        self.at_boundary = True  # The next byte starts a frame
+        self.crc = CRC16_INIT  # Running CRC of the candidate frame from crc_start to crc_end
+        self.crc_start = self.crc_end = -1
+        if response:
+            self.lengths, self.byte_counts = RESPONSE_LENGTHS, RESPONSE_BYTE_COUNTS
+        else:
+            self.lengths, self.byte_counts = REQUEST_LENGTHS, REQUEST_BYTE_COUNTS
+        self.response = response
+        self.stats = stats if stats is not None else Stats()
+
+    @property
+    def pending(self):
+        """ Number of received bytes not yet part of a frame """
+        return self.end - self.start
+
+    def reset(self):
+        self.start = self.end = 0
+        self.at_boundary = True  # The next byte starts a frame
+        self.crc_start = self.crc_end = -1
+
+    def feed(self, data):
+        """
+        Adds received data to the buffer, yielding every complete frame.
+        Chunks up to half the buffer size are copied in before the first frame is yielded.
+        """
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            if self.end + len(data) - offset > self.size:
+                self._compact()
+            n = min(len(data) - offset, self.size - self.end)
+            self.buffer[self.end:self.end + n] = data[offset:offset + n]
+            self.end += n
+            offset += n
+            yield from self._frames()
+
+    def gap(self):
+        """
+        Handles a t3.5 silence on the bus, no more bytes belong to the pending frames.
+        Incomplete candidates are skipped so frames following garbage are still found.
+        """
+        yield from self._frames(final=True)
+        self.reset()
+
+    def _compact(self):
+        """ Moves the pending bytes to the start of the buffer """
+        pending = self.end - self.start
+        if pending > self.start:  # Overlapping regions, rare since pending bytes are shorter than a frame
+            self.buffer[:pending] = bytes(self.view[self.start:self.end])
+        elif pending:
+            self.buffer[:pending] = self.view[self.start:self.end]
+        if self.crc_start == self.start:
+            self.crc_start, self.crc_end = 0, self.crc_end - self.start
+        self.start, self.end = 0, pending
+
+    def _crc_update(self, start, end):
+        """ Extends the running CRC of the candidate frame at start up to end, returns it """
+        if self.crc_start != start or self.crc_end > end:
+            self.crc, self.crc_start, self.crc_end = CRC16_INIT, start, start
+        self.crc = crc16_update(self.buffer, self.crc_end, end, self.crc)
+        self.crc_end = end
+        return self.crc
+
+    def frame_length(self, start, available):
+        """
+        Returns the expected length of the frame starting at start.
+        Returns 0 if more bytes are needed, or None if the function code is unknown.
+        """
+        function = self.buffer[start + 1]
+        if self.response and function & 0x80:
+            return EXCEPTION_LENGTH
+        if length := self.lengths.get(function):
+            return length
+        if byte_count := self.byte_counts.get(function):
+            offset, length = byte_count
+            if available <= offset:
+                return 0
+            return length + self.buffer[start + offset]
+
+    def push(self, data, length=None):
+        """
+        Copies the first length bytes of data into the buffer without delimiting,
+        for callers taking frames with next_frame(), which must be called until it returns 0 before the next push.
+        """
+        if length is None:
+            length = len(data)
+        if self.end + length > self.size:
+            self._compact()
+        copy_into(self.buffer, self.end, data, 0, length)
+        self.end += length
+
+    def next_frame(self, final=False):
+        """
+        Finds the next complete frame in the buffer, returns its end, or 0 if there is none yet.
+        The frame starts at frame_start, and is valid until the next push(), feed() or gap().
+        final: the t3.5 gap was seen, call reset() once this returns 0
+        """
+        buf = self.buffer
+        while (available := self.end - self.start) >= 4:
+            start = self.start
+            if buf[start] > 247:
+                length = None
+            elif (length := self.frame_length(start, available)) is None:
+                # Unknown function codes can only be delimited by the silence after them,
+                # so they are only considered right after a gap or a frame, and can still
+                # be answered with an illegal function exception
+                if self.at_boundary and available <= MAX_FRAME_LENGTH:
+                    if not final:
+                        return 0
+                    length = available
+            elif length > MAX_FRAME_LENGTH:
+                length = None
+            elif length == 0 or available < length:
+                if not final:
+                    self._crc_update(start, self.end)
+                    return 0  # Wait for more data
+                length = None  # Nothing else is coming, this cannot be a frame
+
+            if length:
+                end = start + length
+                if not self._crc_update(start, end):
+                    self.start = end
+                    self.frame_start = start
+                    self.at_boundary = True
+                    self.stats.bus_messages += 1
+                    return end
+                if self.at_boundary:  # Count each lost frame once, not every resync attempt
+                    self.stats.bus_comm_errors += 1
+
+            self.start += 1  # Resync, try the next byte
+            self.at_boundary = False
+            self.stats.resyncs += 1
+        return 0
+
+    def _frames(self, final=False):
+        while end := self.next_frame(final):
+            yield self.view[self.frame_start:end]
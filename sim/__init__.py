@@ -0,0 +1,27 @@
+"""
+Host simulation of the board, so the client, RS485 and Display run unmodified under CPython.
+
+    import sim
+    sim.install()  # Before importing any project module
+    bus = sim.RS485Bus(115200)
+    bus.attach(0, de_pin=11)  # UART 0 with DE on pin 11
+    client = ModbusRTUClient(1, 12, 13, 11, uart=0, baudrate=115200)
+
+install() registers machine, utime, uasyncio, micropython and framebuf stand-ins,
+and adds the MicroPython extensions to asyncio, which the display modules import by that name.
+"""
+from sys import modules
+
+
+def install():
+    import asyncio
+    from sim import machine, utime, uasyncio, micropython, framebuf
+    for name, module in (('machine', machine), ('utime', utime), ('uasyncio', uasyncio),
+                         ('micropython', micropython), ('framebuf', framebuf)):
+        modules.setdefault(name, module)
+    for name in ('sleep_ms', 'wait_for_ms', 'ThreadSafeFlag'):
+        if not hasattr(asyncio, name):
+            setattr(asyncio, name, getattr(uasyncio, name))
+
+
+from sim.bus import RS485Bus  # noqa: E402
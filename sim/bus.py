@@ -0,0 +1,141 @@
+"""
+Virtual multi-drop RS485 bus.
+
+Each character takes the time of its bits at the bus baud rate, characters written by a UART
+are queued on the wire behind its previous ones, and are delivered to every other node once their
+last bit has been sent. A node only drives the bus while its DE pin is high, characters still shifting
+out when DE drops are lost. Characters from two nodes which overlap in time collide and are corrupted,
+and noise may flip bits or add garbage.
+Delivery is evaluated lazily, when a node reads, using the simulation clock in sim.utime.
+The bus may be driven from several threads, like a worker on the second core, it is guarded by a lock.
+"""
+from bisect import insort
+from random import Random
+from threading import RLock
+
+from sim.utime import monotonic_us
+
+
+ATTACHED = {}  # UART id: (bus, DE pin id), looked up when a UART is created
+
+
+class _Char:
+    __slots__ = ('end', 'value', 'source')
+
+    def __init__(self, end, value, source):
+        self.end = end
+        self.value = value
+        self.source = source
+
+    def __lt__(self, other):
+        return self.end < other.end
+
+
+class RS485Bus:
+    def __init__(self, baudrate=19200, bits=11, noise_rate=0.0, idle_chars=1.5, seed=1):
+        """
+        bits: int, bits per character including start, parity and stop bits
+        noise_rate: float, probability of a bit flip in each character
+        idle_chars: float, silence after which the RX idle interrupt fires, in character times
+        """
+        self.baudrate = baudrate
+        self.char_us = bits * 1000000 / baudrate
+        self.noise_rate = noise_rate
+        self.idle_us = idle_chars * self.char_us
+        self.random = Random(seed)
+        self.lock = RLock()
+        self.nodes = []  # UARTs on the bus
+        self.wire = []  # _Char in order of end time, not yet delivered
+        self.last_end = 0  # End of the last character on the wire
+        self.last_source = None
+        self.turnarounds = {}  # UART id: silence on the bus before it started answering another node, in us
+        self.max_turnarounds = 10000
+        self.chars = self.collisions = self.noise_errors = self.truncated = self.overruns = 0
+
+    def attach(self, uart_id, de_pin=None):
+        """ Connects the UART with this id to the bus when it is created, driven while de_pin is high """
+        ATTACHED[uart_id] = (self, de_pin)
+
+    def connect(self, uart):
+        self.nodes.append(uart)
+
+    def transmit(self, uart, data, driven=True):
+        """ Queues data from uart behind its previous characters, returns when the last one ends """
+        with self.lock:
+            now = monotonic_us()
+            start = max(now, uart.tx_end)
+            if start > self.last_end and self.last_source is not None and self.last_source is not uart:
+                samples = self.turnarounds.setdefault(uart.id, [])
+                if len(samples) < self.max_turnarounds:
+                    samples.append(start - self.last_end)
+            char_us = self.char_us
+            for n, value in enumerate(data):
+                end = start + (n + 1) * char_us
+                if not driven:
+                    continue
+                if self.noise_rate and self.random.random() < self.noise_rate:
+                    value ^= 1 << self.random.randrange(8)
+                    self.noise_errors += 1
+                char = _Char(end, value, uart)
+                for other in self.wire:
+                    if other.source is not uart and abs(other.end - end) < char_us:
+                        other.value ^= self.random.randrange(1, 256)
+                        char.value ^= self.random.randrange(1, 256)
+                        self.collisions += 1
+                insort(self.wire, char)
+                self.chars += 1
+            end = start + len(data) * char_us
+            uart.tx_end = end
+            if driven and data:
+                self.last_end = max(self.last_end, end)
+                self.last_source = uart
+                for node in self.nodes:
+                    if node is not uart:
+                        node.schedule_idle(end + self.idle_us - now)
+            return end
+
+    def inject(self, data):
+        """ Puts garbage on the wire from no node, starting now """
+        with self.lock:
+            start = monotonic_us()
+            for n, value in enumerate(data):
+                insort(self.wire, _Char(start + (n + 1) * self.char_us, value, None))
+            for node in self.nodes:
+                node.schedule_idle(len(data) * self.char_us + self.idle_us)
+
+    def release(self, uart):
+        """ DE dropped, characters of uart which have not finished are cut off """
+        with self.lock:
+            now = monotonic_us()
+            kept = [char for char in self.wire if char.source is not uart or char.end <= now]
+            self.truncated += len(self.wire) - len(kept)
+            self.wire = kept
+            uart.tx_end = min(uart.tx_end, now)
+
+    def update(self):
+        """ Delivers every character which has finished to the nodes which did not send it """
+        with self.lock:
+            now = monotonic_us()
+            wire = self.wire
+            count = 0
+            while count < len(wire) and wire[count].end <= now:
+                count += 1
+            if not count:
+                return
+            for char in wire[:count]:
+                for node in self.nodes:
+                    if node is not char.source and not node.driving:
+                        node.deliver(char.value)
+            del wire[:count]
+
+    def next_char(self, uart):
+        """ End time of the next character on the way to uart, or None """
+        with self.lock:
+            for char in self.wire:
+                if char.source is not uart:
+                    return char.end
+            return None
+
+    def stats(self):
+        return ("chars: %d, collisions: %d, noise_errors: %d, truncated: %d" %
+                (self.chars, self.collisions, self.noise_errors, self.truncated))
@@ -0,0 +1,75 @@
+"""
+Flash filesystem stand-in, files in a host directory.
+
+Counts files opened for writing and bytes written, for wear, and can cut power:
+after power_loss_after bytes every further write raises OSError, leaving the file
+truncated where the power went, as a littlefs file would be after a reset mid-write.
+"""
+from os import makedirs, replace, path as ospath
+
+
+class FlashFile:
+    def __init__(self, fs, f):
+        self.fs = fs
+        self.f = f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        fs = self.fs
+        if fs.power_loss_after is not None:
+            left = fs.power_loss_after - fs.bytes_written
+            if left < len(data):
+                if left > 0:
+                    self.f.write(bytes(data[:left]))
+                    fs.bytes_written += left
+                self.f.flush()
+                raise OSError(5, "power lost")  # EIO
+        fs.bytes_written += len(data)
+        return self.f.write(data)
+
+    def read(self, n=-1):
+        return self.f.read(n)
+
+    def readinto(self, buf):
+        return self.f.readinto(buf)
+
+    def seek(self, offset, whence=0):
+        return self.f.seek(offset, whence)
+
+    def close(self):
+        self.f.close()
+
+
+class FlashFS:
+    def __init__(self, root):
+        makedirs(root, exist_ok=True)
+        self.root = root
+        self.files_written = 0
+        self.bytes_written = 0
+        self.power_loss_after = None  # Total bytes written before the power goes, None to keep it
+
+    def open(self, name, mode='rb'):
+        if 'w' in mode:
+            if self.power_loss_after is not None and self.bytes_written >= self.power_loss_after:
+                raise OSError(5, "power lost")
+            self.files_written += 1
+        try:
+            return FlashFile(self, open(ospath.join(self.root, name), mode))
+        except FileNotFoundError:
+            raise OSError(2, "ENOENT")
+
+    def rename(self, old, new):
+        """ Replaces new, as littlefs does """
+        try:
+            replace(ospath.join(self.root, old), ospath.join(self.root, new))
+        except FileNotFoundError:
+            raise OSError(2, "ENOENT")
+
+    def power_cycle(self):
+        """ Restores power, files keep whatever reached them """
+        self.power_loss_after = None
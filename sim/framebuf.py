@@ -0,0 +1,81 @@
+"""
+framebuf stand-in, MONO_VLSB only, the format of the SSD1306.
+text() draws a pattern derived from each character code instead of the real 8x8 font,
+the same size and cost shape, and distinct per character, which is all the display code relies on.
+"""
+
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+def _glyph_column(char, column):
+    if char == 32 or column == 7:  # Blank space, and a gap between glyphs
+        return 0
+    return ((char * 0x9E37 + column * 0x79B9) >> 3) & 0xFF | 0x01
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format != MONO_VLSB:
+            raise ValueError("Only MONO_VLSB is simulated")
+        self.buf = buffer
+        self.width = width
+        self.height = height
+        self.stride = stride or width
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None if c is None else 0
+        index = (y >> 3) * self.stride + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buf[index] & bit else 0
+        if c:
+            self.buf[index] |= bit
+        else:
+            self.buf[index] &= ~bit & 0xFF
+
+    def fill(self, c):
+        value = 0xFF if c else 0x00
+        for index in range(((self.height + 7) >> 3) * self.stride):
+            self.buf[index] = value
+
+    def fill_rect(self, x, y, w, h, c):
+        for py in range(max(y, 0), min(y + h, self.height)):
+            for px in range(max(x, 0), min(x + w, self.width)):
+                self.pixel(px, py, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            return self.fill_rect(x, y, w, h, c)
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def text(self, s, x, y, c=1):
+        for n, char in enumerate(s.encode() if isinstance(s, str) else s):
+            for column in range(8):
+                bits = _glyph_column(char, column)
+                for row in range(8):
+                    if bits & (1 << row):
+                        self.pixel(x + n * 8 + column, y + row, c)
+
+    def blit(self, fbuf, x, y, key=-1):
+        for py in range(fbuf.height):
+            for px in range(fbuf.width):
+                c = fbuf.pixel(px, py)
+                if c != key:
+                    self.pixel(x + px, y + py, c)
+
+    def scroll(self, xstep, ystep):
+        copy = FrameBuffer(bytearray(self.buf), self.width, self.height, MONO_VLSB, self.stride)
+        self.blit(copy, xstep, ystep)
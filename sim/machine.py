@@ -0,0 +1,243 @@
+"""
+machine stand-in: Pin, UART and I2C.
+
+Pins with the same id share their level, so a DE pin created by RS485 is the one the bus watches.
+A UART whose id was attached to an RS485Bus talks on that bus, any other UART is unconnected.
+I2C devices are objects with a write(data) method registered by address.
+"""
+import asyncio
+from threading import get_ident
+
+from sim.utime import monotonic_us, sleep_us
+
+
+_LEVELS = {}  # Pin id: level
+_WATCHERS = {}  # Pin id: [callback(level)]
+
+
+def watch_pin(pin_id, callback):
+    _WATCHERS.setdefault(pin_id, []).append(callback)
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def unique_id():
+    return b'\x53\x49\x4d\x00\x00\x00\x00\x01'
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        _LEVELS.setdefault(id, 0)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return _LEVELS[self.id]
+        value = 1 if value else 0
+        if _LEVELS[self.id] != value:
+            _LEVELS[self.id] = value
+            for callback in _WATCHERS.get(self.id, ()):
+                callback(value)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        watch_pin(self.id, lambda level: handler(self) if trigger & (self.IRQ_RISING if level else self.IRQ_FALLING)
+                  else None)
+
+    def __repr__(self):
+        return "Pin(%s)" % self.id
+
+
+class UART:
+    IRQ_RXIDLE = 0x1000
+
+    def __init__(self, id, baudrate=9600, bits=8, parity=None, stop=1, tx=None, rx=None,
+                 timeout=0, timeout_char=0, rxbuf=256, **kwargs):
+        from sim.bus import ATTACHED
+        self.id = id
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.timeout_char = timeout_char
+        self.rxbuf = rxbuf
+        self.rx = bytearray()
+        self.tx_end = 0
+        self.overruns = 0
+        self.idle_handler = None
+        self.idle_at = 0
+        self.loop = None
+        self.loop_thread = None
+        self.bus, self.de_pin = ATTACHED.get(id, (None, None))
+        if self.bus is not None:
+            self.bus.connect(self)
+            if self.de_pin is not None:
+                watch_pin(self.de_pin, self._de_changed)
+
+    def __repr__(self):
+        return "UART(%s, baudrate=%d, sim)" % (self.id, self.baudrate)
+
+    @property
+    def driving(self):
+        return self.de_pin is None or bool(_LEVELS.get(self.de_pin))
+
+    def _de_changed(self, level):
+        if not level:
+            self.bus.release(self)
+
+    def deliver(self, value):
+        if len(self.rx) >= self.rxbuf:
+            self.overruns += 1
+            self.bus.overruns += 1
+            return
+        self.rx.append(value)
+
+    def schedule_idle(self, delay_us):
+        """ Fires the RX idle handler after delay_us, unless more characters arrive first """
+        if self.idle_handler is None or self.loop is None:
+            return
+        self.idle_at = monotonic_us() + delay_us
+        if get_ident() == self.loop_thread:
+            self.loop.call_later(delay_us / 1000000, self._idle)
+        else:  # Transmitted from another thread
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay_us / 1000000, self._idle)
+
+    def _idle(self):
+        if monotonic_us() >= self.idle_at:
+            self.bus.update()
+            if self.rx:
+                self.idle_handler(self)
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        if trigger & self.IRQ_RXIDLE:
+            self.idle_handler = handler
+            try:  # The handler runs on the loop of the thread which registered it
+                self.loop = asyncio.get_running_loop()
+                self.loop_thread = get_ident()
+            except RuntimeError:
+                self.loop = None
+
+    def any(self):
+        if self.bus is not None:
+            self.bus.update()
+        return len(self.rx)
+
+    def _wait(self, timeout_ms):
+        """ Waits up to timeout_ms for a character, returns True if one arrived """
+        if self.any():
+            return True
+        deadline = monotonic_us() + timeout_ms * 1000
+        while self.bus is not None:
+            next_char = self.bus.next_char(self)
+            if next_char is None or next_char > deadline:
+                break
+            sleep_us(int(next_char - monotonic_us()) + 1)
+            if self.any():
+                return True
+        sleep_us(int(deadline - monotonic_us()))
+        return bool(self.any())
+
+    def readinto(self, buf, nbytes=None):
+        """ Reads until nbytes, waiting timeout for the first character and timeout_char for each next """
+        nbytes = len(buf) if nbytes is None else nbytes
+        count = 0
+        timeout = self.timeout
+        while count < nbytes and self._wait(timeout):
+            n = min(nbytes - count, len(self.rx))
+            buf[count:count + n] = self.rx[:n]
+            del self.rx[:n]
+            count += n
+            timeout = self.timeout_char
+        return count or None
+
+    def read(self, nbytes=None):
+        buf = bytearray(nbytes if nbytes is not None else max(self.any(), 1))
+        if count := self.readinto(buf, nbytes):
+            return bytes(buf[:count])
+        return None
+
+    def write(self, data):
+        if self.bus is not None:
+            self.bus.transmit(self, data, self.driving)
+        else:
+            self.tx_end = max(monotonic_us(), self.tx_end) + len(data) * 11000000 / self.baudrate
+        return len(data)
+
+    def flush(self):
+        """ Returns once the last character has started shifting out, like a drained TX FIFO """
+        char_us = self.bus.char_us if self.bus is not None else 11000000 / self.baudrate
+        sleep_us(int(self.tx_end - char_us - monotonic_us()))
+
+    def txdone(self):
+        return monotonic_us() >= self.tx_end
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400000, timing=False):
+        """ timing: sleep for the bus time of each transfer, 9 bit times per byte """
+        self.id = id
+        self.freq = freq
+        self.timing = timing
+        self.devices = {}
+        self.bytes_written = 0
+        self.transfers = 0
+
+    def add_device(self, addr, device=None):
+        self.devices[addr] = device
+
+    def scan(self):
+        return list(self.devices)
+
+    def _transfer(self, addr, length):
+        if addr not in self.devices and self.devices:
+            raise OSError(5)  # EIO, no ACK
+        self.transfers += 1
+        self.bytes_written += length
+        if self.timing:
+            sleep_us((length + 1) * 9 * 1000000 // self.freq)
+
+    def writeto(self, addr, buf, stop=True):
+        self._transfer(addr, len(buf))
+        if device := self.devices.get(addr):
+            device.write(bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        length = sum(len(buf) for buf in vector)
+        self._transfer(addr, length)
+        if device := self.devices.get(addr):
+            device.write(b''.join(bytes(buf) for buf in vector))
+        return length
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self._transfer(addr, 0)
+        for n in range(len(buf)):
+            buf[n] = 0
+
+    def readfrom(self, addr, nbytes, stop=True):
+        buf = bytearray(nbytes)
+        self.readfrom_into(addr, buf)
+        return bytes(buf)
@@ -0,0 +1,23 @@
+"""
+micropython module stand-in. viper is left out, so code with a viper path uses its fallback.
+"""
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+def schedule(func, arg):
+    func(arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(verbose=False):
+    print("mem_info is not available in the simulation")
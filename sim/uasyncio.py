@@ -0,0 +1,104 @@
+"""
+uasyncio stand-in on top of CPython asyncio.
+
+Adds the MicroPython extensions, sleep_ms, wait_for_ms, ThreadSafeFlag and a StreamReader over
+objects with any() and read(). create_task may be called before run(), as it can on MicroPython,
+those tasks are started when run() starts the loop.
+"""
+import asyncio
+from asyncio import (CancelledError, Event, Lock, gather, get_event_loop, open_connection, sleep,
+                     start_server, wait_for)
+from threading import get_ident
+
+
+TimeoutError = asyncio.TimeoutError
+_deferred = []
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, timeout):
+    return await asyncio.wait_for(awaitable, timeout / 1000)
+
+
+class _DeferredTask:
+    """ A task created before the loop runs, started by run() unless cancelled first """
+    def __init__(self, coro):
+        self.coro = coro
+        self.task = None
+        self.cancelled = False
+
+    def start(self):
+        if not self.cancelled:
+            self.task = asyncio.get_running_loop().create_task(self.coro)
+
+    def cancel(self):
+        if self.task is not None:
+            return self.task.cancel()
+        if not self.cancelled:
+            self.cancelled = True
+            self.coro.close()
+        return True
+
+    def done(self):
+        return self.cancelled or (self.task is not None and self.task.done())
+
+
+def create_task(coro):
+    try:
+        return asyncio.get_running_loop().create_task(coro)
+    except RuntimeError:
+        task = _DeferredTask(coro)
+        _deferred.append(task)
+        return task
+
+
+async def _start(main):
+    while _deferred:
+        _deferred.pop(0).start()
+    return await main
+
+
+def run(main):
+    return asyncio.run(_start(main))
+
+
+class ThreadSafeFlag:
+    """ An Event which may be set from interrupt handlers and other threads, wait() clears it """
+    def __init__(self):
+        self._event = Event()
+        try:  # Bind to the running loop now, a thread may set the flag before the first wait
+            self._loop = asyncio.get_running_loop()
+            self._thread = get_ident()
+        except RuntimeError:
+            self._loop = None
+            self._thread = None
+
+    def set(self):
+        if self._loop is not None and get_ident() != self._thread:
+            self._loop.call_soon_threadsafe(self._event.set)
+        else:
+            self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread = get_ident()
+        await self._event.wait()
+        self._event.clear()
+
+
+class StreamReader:
+    """ Polls a UART like object, the wait between polls is poll_us """
+    def __init__(self, stream, poll_us=200):
+        self.stream = stream
+        self.poll_us = poll_us
+
+    async def read(self, n=-1):
+        while not (available := self.stream.any()):
+            await asyncio.sleep(self.poll_us / 1000000)
+        return self.stream.read(available if n < 0 else min(n, available))
@@ -0,0 +1,54 @@
+"""
+utime stand-in, ticks wrap at 2**30 like on the RP2040 port so wrap handling is exercised.
+"""
+from time import perf_counter_ns, sleep, time
+
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+_EPOCH = perf_counter_ns()
+
+
+def monotonic_us():
+    """ Unwrapped microseconds since import, for the simulation itself """
+    return (perf_counter_ns() - _EPOCH) // 1000
+
+
+def ticks_us():
+    return monotonic_us() & TICKS_MAX
+
+
+def ticks_ms():
+    return (monotonic_us() // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(end, start):
+    return ((end - start + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def sleep_us(us):
+    """
+    Spins for short delays, the OS sleep is far coarser than the UART timings being modelled.
+    The spin gives up the interpreter lock on every turn, so a thread standing in for the other core keeps running.
+    """
+    if us <= 0:
+        return
+    if us > 2000:
+        sleep(us / 1000000)
+        return
+    end = perf_counter_ns() + us * 1000
+    while perf_counter_ns() < end:
+        sleep(0)
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
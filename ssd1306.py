@@ -34,6 +34,10 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        self.view = memoryview(self.buffer)
+        # Copy of the display RAM as of the last flush, only changed regions are sent
+        self.shadow = bytearray(self.pages * self.width)
+        self.shadow_valid = False
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
@@ -93,9 +97,7 @@ class SSD1306(framebuf.FrameBuffer):
         self.write_cmd(SET_COM_OUT_DIR | ((rotate & 1) << 3))
         self.write_cmd(SET_SEG_REMAP | (rotate & 1))
 
-    def show(self):
-        x0 = 0
-        x1 = self.width - 1
+    def _set_window(self, x0, x1, page0, page1):
         if self.width != 128:
             # narrow displays use centred columns
             col_offset = (128 - self.width) // 2
@@ -105,9 +107,45 @@ class SSD1306(framebuf.FrameBuffer):
         self.write_cmd(x0)
         self.write_cmd(x1)
         self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        self.write_cmd(page0)
+        self.write_cmd(page1)
+
+    def dirty_regions(self):
+        """ Returns (page, first column, last column) for each page changed since the last flush """
+        buf, shadow, width = self.buffer, self.shadow, self.width
+        regions = []
+        for page in range(self.pages):
+            start = page * width
+            if buf[start:start + width] == shadow[start:start + width]:
+                continue
+            x0, x1 = 0, width - 1
+            while buf[start + x0] == shadow[start + x0]:
+                x0 += 1
+            while buf[start + x1] == shadow[start + x1]:
+                x1 -= 1
+            regions.append((page, x0, x1))
+        return regions
+
+    def flush_region(self, page, x0, x1):
+        """ Sends columns x0 to x1 of a page """
+        start = page * self.width
+        self._set_window(x0, x1, page, page)
+        self.write_data(self.view[start + x0:start + x1 + 1])
+        self.shadow[start + x0:start + x1 + 1] = self.view[start + x0:start + x1 + 1]
+
+    def show(self, full=False):
+        """
+        Sends the regions of the framebuffer which changed since the last flush, nothing if none did.
+        full sends the whole framebuffer, which is always done for the first flush.
+        """
+        if full or not self.shadow_valid:
+            self._set_window(0, self.width - 1, 0, self.pages - 1)
+            self.write_data(self.buffer)
+            self.shadow[:] = self.buffer
+            self.shadow_valid = True
+            return
+        for region in self.dirty_regions():
+            self.flush_region(*region)
 
 
 class SSD1306_I2C(SSD1306):
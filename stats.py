@@ -0,0 +1,54 @@
+from array import array
+
+
+# Upper bounds of the turnaround latency histogram buckets in us, the last bucket counts everything above
+LATENCY_BUCKETS = (250, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+
+class Stats:
+    """
+    Low overhead communication counters, plain integer attributes incremented on the hot path.
+    They follow the Modbus serial line diagnostics counters, and are served over FC8 and FC11:
+        bus_messages: frames with a valid CRC seen on the bus, for any unit
+        bus_comm_errors: CRC errors
+        bus_exceptions: exception responses sent
+        server_messages: frames addressed to this node, including broadcasts
+        server_no_responses: frames addressed to this node which were not answered
+        event_count: successfully completed requests, the FC11 comm event counter
+        character_overruns: received chunks dropped because the receive queue was full
+        foreign_frames: frames addressed to other units
+        resyncs: bytes skipped to find the next frame
+    latency is a histogram of the time from the last request byte to the first response byte.
+    """
+    __slots__ = ('bus_messages', 'bus_comm_errors', 'bus_exceptions', 'server_messages',
+                 'server_no_responses', 'event_count', 'character_overruns', 'foreign_frames', 'resyncs',
+                 'latency')
+
+    def __init__(self):
+        self.latency = array('I', (0 for _ in range(len(LATENCY_BUCKETS) + 1)))
+        self.clear()
+
+    def clear(self):
+        self.bus_messages = 0
+        self.bus_comm_errors = 0
+        self.bus_exceptions = 0
+        self.server_messages = 0
+        self.server_no_responses = 0
+        self.event_count = 0
+        self.character_overruns = 0
+        self.foreign_frames = 0
+        self.resyncs = 0
+        for i in range(len(self.latency)):
+            self.latency[i] = 0
+
+    def record_latency(self, us):
+        bucket = 0
+        for bound in LATENCY_BUCKETS:
+            if us <= bound:
+                break
+            bucket += 1
+        self.latency[bucket] += 1
+
+    def __str__(self):
+        counters = ", ".join("%s: %d" % (name, getattr(self, name)) for name in self.__slots__[:-1])
+        return "%s, latency: %s" % (counters, list(self.latency))
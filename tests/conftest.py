@@ -0,0 +1,13 @@
+"""
+The tests run on CPython with the sim package standing in for the board, from the repository root:
+    python -m pytest tests
+"""
+from os import path as ospath
+from sys import path
+
+ROOT = ospath.dirname(ospath.dirname(ospath.abspath(__file__)))
+if ROOT not in path:
+    path.insert(0, ROOT)
+
+import sim  # noqa: E402
+sim.install()
@@ -0,0 +1,20 @@
+"""
+Every benchmark runs to completion on the host sim, each in its own interpreter from the repository root.
+They take a few minutes together.
+"""
+from os import listdir, path as ospath
+from subprocess import run
+from sys import executable
+
+import pytest
+
+from conftest import ROOT
+
+BENCHMARKS = sorted(name for name in listdir(ospath.join(ROOT, 'benchmarks'))
+                    if name.startswith('bench_') and name.endswith('.py') and name != 'bench_util.py')
+
+
+@pytest.mark.parametrize('name', BENCHMARKS)
+def test_benchmark_runs(name):
+    result = run([executable, ospath.join('benchmarks', name)], cwd=ROOT, capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stderr[-2000:]
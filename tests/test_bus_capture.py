@@ -0,0 +1,74 @@
+from os import path as ospath
+
+from uasyncio import run, create_task, sleep_ms
+
+from bus_capture import BusCapture, CAP_RX, WRITE_CHUNK
+from tools.bus_replay import Capture
+
+CHUNK = bytes(range(40))
+
+
+def test_sessions_are_appended_past_a_torn_record(tmp_path):
+    path = str(tmp_path / 'capture.bin')
+    for boot in range(2):
+        capture = BusCapture(path, 19200)
+        for _ in range(3):
+            capture.record(0, CAP_RX, CHUNK, len(CHUNK))
+        capture.flush()
+        if not boot:
+            with open(path, 'ab') as f:
+                f.write(b'\x00\x00\x00\x00\x00\x30\x00abc')  # A record cut short by a reset
+    replayed = Capture(path)
+    assert replayed.session_count == 2
+    assert replayed.truncated == 1
+    assert [record[3] for record in replayed.records] == [CHUNK] * 6
+
+
+def test_other_line_settings_keep_the_old_log(tmp_path):
+    path = str(tmp_path / 'capture.bin')
+    capture = BusCapture(path, 19200)
+    capture.record(0, CAP_RX, CHUNK, len(CHUNK))
+    capture.flush()
+    BusCapture(path, 9600).flush()
+    assert Capture(path).baudrate == 9600
+    assert not Capture(path).records
+    assert Capture(path + '.old').baudrate == 19200
+    assert len(Capture(path + '.old').records) == 1
+
+
+def test_log_is_rotated_at_max_bytes(tmp_path):
+    path = str(tmp_path / 'capture.bin')
+    capture = BusCapture(path, 19200, buffer_size=256, max_bytes=1024)
+    for _ in range(100):
+        capture.record(0, CAP_RX, CHUNK, len(CHUNK))
+        capture._write()
+    capture.flush()
+    assert capture.rotations
+    assert ospath.getsize(path) <= 1024 and ospath.getsize(path + '.old') <= 1024
+    assert capture.bytes_lost == 0
+
+
+def test_writes_wait_for_the_bus(tmp_path):
+    path = str(tmp_path / 'capture.bin')
+    busy = [True]
+
+    async def wait_quiet():
+        while busy[0]:
+            await sleep_ms(1)
+
+    capture = BusCapture(path, 19200, buffer_size=4 * WRITE_CHUNK, flush_ms=1, wait_quiet=wait_quiet)
+    while capture.full < 0:
+        capture.record(0, CAP_RX, CHUNK, len(CHUNK))
+    size = ospath.getsize(path)
+
+    async def main():
+        task = create_task(capture.runloop())
+        await sleep_ms(20)
+        assert ospath.getsize(path) == size
+        busy[0] = False
+        await sleep_ms(20)
+        task.cancel()
+
+    run(main())
+    assert capture.full < 0
+    assert ospath.getsize(path) == size + capture.bytes_written
@@ -0,0 +1,24 @@
+from crc16_modbus import CRC16, calculate_crc16, check_crc16, crc16
+
+FRAME = bytes((0x01, 0x03, 0x00, 0x00, 0x00, 0x0A))
+
+
+def test_known_modbus_crc():
+    assert calculate_crc16(FRAME) == b'\xc5\xcd'  # The CRC of the classic 01 03 00 00 00 0A request
+    assert check_crc16(FRAME + b'\xc5\xcd')
+    assert not check_crc16(FRAME + b'\xc5\xce')
+
+
+def test_ranges_and_continuation_agree():
+    data = b'\xaa' + FRAME + b'\xc5\xcd\xbb'
+    assert crc16(data, 1, 9) == 0
+    assert crc16(FRAME, 3, crc=crc16(FRAME, 0, 3)) == crc16(FRAME)
+
+
+def test_incremental_crc_is_valid_as_the_last_byte_lands():
+    crc = CRC16()
+    for byte in FRAME + b'\xc5':
+        crc.update(bytes((byte,)))
+        assert not crc.valid
+    crc.update(b'\xcd')
+    assert crc.valid
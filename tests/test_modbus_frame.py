@@ -0,0 +1,14 @@
+from crc16_modbus import calculate_crc16
+from modbus_frame import ModbusFrame
+
+
+def test_to_bytes_is_bytes_for_every_frame():
+    frames = (ModbusFrame.read_holding_registers(1, 0x10, 2),
+              ModbusFrame.write_multiple_registers(1, 0x10, b'\x00\x01\x00\x02'),
+              ModbusFrame(1, 3, b'\x00\x01\x00\x02', response=True),
+              ModbusFrame.exception(1, 3, 2))
+    for frame in frames:
+        encoded = frame.to_bytes()
+        assert type(encoded) is bytes
+        assert encoded[-2:] == calculate_crc16(encoded[:-2])
+        assert frame.to_bytes() is encoded  # Encoded once
@@ -0,0 +1,36 @@
+from uasyncio import run, create_task, gather, sleep_ms
+
+from modbus_frame import ModbusFrame, SERVER_DEVICE_FAILURE
+from modbus_gateway import ModbusTCPGateway
+from modbus_master import ModbusMasterError
+
+
+class FailingMaster:
+    """ Fails the first transaction with a CRC error, answers the others """
+    def __init__(self):
+        self.transactions = 0
+
+    async def transact(self, frame, timeout_ms=None):
+        self.transactions += 1
+        await sleep_ms(1)
+        if self.transactions == 1:
+            raise ModbusMasterError("CRC mismatch")
+        return ModbusFrame(frame[0], frame[1], bytes(2), response=True).to_bytes()
+
+
+def test_worker_survives_a_failed_transaction():
+    gateway = ModbusTCPGateway(FailingMaster())
+    read = ModbusFrame.read_holding_registers(1, 0, 1).to_bytes()
+
+    async def main():
+        worker = create_task(gateway.worker())
+        failed, coalesced = await gather(gateway.submit(read), gateway.submit(read))
+        answered = await gateway.submit(read)
+        worker.cancel()
+        return failed, coalesced, answered
+
+    failed, coalesced, answered = run(main())
+    assert failed == coalesced
+    assert failed[1] == 0x83 and failed[2] == SERVER_DEVICE_FAILURE
+    assert not answered[1] & 0x80
+    assert gateway.failures == 1 and not gateway.in_flight
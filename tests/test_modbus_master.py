@@ -0,0 +1,34 @@
+from uasyncio import run, create_task, sleep_ms, TimeoutError
+
+from modbus_master import ModbusRTUMaster
+from stats import Stats
+
+
+class OfflineLink:
+    """ Just enough of an RS485 link to build a master, polls are replaced in the test """
+    def __init__(self):
+        self.stats = Stats()
+
+
+def test_retries_interleave_with_other_slaves():
+    master = ModbusRTUMaster(serial=OfflineLink(), retries=2)
+    for unit in (2, 1, 3):  # The dead slave is planned first
+        master.add_point("p%d" % unit, unit, 0)
+    polled = []
+
+    async def poll(request):
+        polled.append(request.unit)
+        if request.unit == 2:
+            raise TimeoutError
+
+    master.poll = poll
+
+    async def main():
+        task = create_task(master.runloop())
+        await sleep_ms(50)
+        task.cancel()
+
+    run(main())
+    assert polled == [2, 1, 3, 2, 2]
+    assert master.timeouts == 3
+    assert 2 in master.backoff
@@ -0,0 +1,84 @@
+import pytest
+from uasyncio import run
+
+from crc16_modbus import calculate_crc16
+from modbus_rtu import ModbusRTUClient
+
+
+class CaptureUART:
+    """ Keeps what the client transmits, nothing is received """
+    def __init__(self):
+        self.sent = b''
+
+    def write(self, data):
+        self.sent += bytes(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        return 0
+
+    def readinto(self, buf, n=None):
+        return 0
+
+
+class Pin:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+def make_client():
+    uart = CaptureUART()
+    client = ModbusRTUClient(1, None, None, Pin(), uart=uart, rx_mode='poll')
+    client.serial.task.cancel()
+    client.serial.driver_delay = client.serial.tx_delay = 0
+    return client, uart
+
+
+def request(function, address=1):
+    frame = bytes((address, function, 0, 0, 0, 1))
+    return frame + calculate_crc16(frame)
+
+
+@pytest.mark.parametrize('function', (0, 7, 0x41))
+def test_unknown_function_in_place_matches_frame_path(function):
+    frame = request(function)
+    client, uart = make_client()
+    run(client.parse_recv(frame))
+    expected = uart.sent
+
+    client, _ = make_client()
+    port = client.ports[0]
+    length = client.serve_in_place(port, frame, 0, len(frame))
+    assert bytes(port.tx_buffer[:length]) == expected
+    assert expected[1] == function | 0x80 and expected[2] == 1  # Illegal function
+
+
+@pytest.mark.parametrize('function', (0, 7, 0x41))
+def test_unknown_function_broadcast_is_dropped(function):
+    frame = request(function, address=0)
+    client, uart = make_client()
+    port = client.ports[0]
+    assert client.serve_in_place(port, frame, 0, len(frame)) == 0
+    run(client.parse_recv(frame))
+    assert uart.sent == b''
+    assert port.stats.server_no_responses == 1
+
+
+def test_client_leaves_tracing_alone_unless_asked():
+    from tracing import TRACE
+    enabled = TRACE.enabled
+    try:
+        make_client()
+        TRACE.enabled = True
+        make_client()
+        assert TRACE.enabled
+        ModbusRTUClient(2, None, None, Pin(), uart=CaptureUART(), rx_mode='poll', trace=False).serial.task.cancel()
+        assert not TRACE.enabled
+    finally:
+        TRACE.enabled = enabled
@@ -0,0 +1,104 @@
+import pytest
+
+from modbus_frame import (ModbusFrame, ILLEGAL_DATA_ADDRESS, DIAG_SERVER_MESSAGE_COUNT, DIAG_BUS_EXCEPTION_ERROR_COUNT,
+                          DIAG_CLEAR_COUNTERS, DIAG_SERVER_NO_RESPONSE_COUNT, DIAG_LATENCY_BUCKET)
+from modbus_unit import ModbusUnit
+from register_bank import RegisterBank
+from stats import Stats
+
+
+def handle(unit, request):
+    """ The encoded response to a request, through the frame path """
+    return bytes(unit.handle(ModbusFrame.parse_frame(request.to_bytes())).to_bytes())
+
+
+def handle_in_place(unit, request):
+    frame = bytes(request.to_bytes())
+    buf = bytearray(256)
+    return bytes(buf[:unit.handle_into(frame, 0, len(frame), buf)])
+
+
+@pytest.mark.parametrize('alias', (False, True))
+def test_4xxxx_addresses_only_with_the_alias(alias):
+    unit = ModbusUnit(1, holding_registers=RegisterBank(100), alias_4xxxx=alias)
+    unit.holding_registers.set_u16(2, 0x1234)
+    read = ModbusFrame.read_holding_registers(1, 40003, 1)
+    response = handle_in_place(unit, read)
+    assert handle(unit, read) == response
+    if alias:
+        assert response[1:5] == b'\x03\x02\x12\x34'
+        handle(unit, ModbusFrame.write_single_register(1, 40004, 0x5678))
+        assert unit.holding_registers.get_u16(3) == 0x5678
+    else:
+        assert response[1:3] == bytes((0x83, ILLEGAL_DATA_ADDRESS))
+
+
+def counter(unit, sub_function, stats, data=0):
+    response = handle_with(unit, ModbusFrame.diagnostics(1, sub_function, data), stats)
+    return int.from_bytes(response[4:6], 'big')
+
+
+def handle_with(unit, request, stats):
+    return bytes(unit.handle(ModbusFrame.parse_frame(request.to_bytes()), stats).to_bytes())
+
+
+def test_diagnostic_counters_and_comm_event_counter():
+    unit, stats = ModbusUnit(1, holding_registers=RegisterBank(10)), Stats()
+    handle_with(unit, ModbusFrame.read_holding_registers(1, 0, 2), stats)
+    handle_with(unit, ModbusFrame.read_holding_registers(1, 9, 2), stats)  # Illegal data address
+    unit.handle(ModbusFrame.parse_frame(ModbusFrame.write_single_register(0, 1, 5).to_bytes()), stats)  # Broadcast
+    # FC11 counts completed requests other than FC11 itself, exceptions and broadcasts are left out
+    response = handle_with(unit, ModbusFrame.get_comm_event_counter(1), stats)
+    assert response[1:6] == b'\x0b\x00\x00\x00\x01'
+    assert counter(unit, DIAG_BUS_EXCEPTION_ERROR_COUNT, stats) == 1
+    assert counter(unit, DIAG_SERVER_NO_RESPONSE_COUNT, stats) == 1
+    assert counter(unit, DIAG_SERVER_MESSAGE_COUNT, stats) == 7  # Including this request
+    stats.record_latency(300)
+    assert sum(counter(unit, DIAG_LATENCY_BUCKET, stats, bucket) for bucket in range(len(stats.latency))) == 1
+
+    handle_with(unit, ModbusFrame.diagnostics(1, DIAG_CLEAR_COUNTERS), stats)
+    assert stats.server_messages == 0 and stats.bus_exceptions == 0 and not any(stats.latency)
+    assert counter(unit, DIAG_SERVER_MESSAGE_COUNT, stats) == 1
+
+
+def test_unknown_diagnostic_sub_function_is_rejected():
+    response = handle_with(ModbusUnit(1), ModbusFrame.diagnostics(1, 0x55), Stats())
+    assert response[1:3] == b'\x88\x01'
+
+
+def test_every_standard_function_is_dispatched():
+    unit = ModbusUnit(1, holding_registers=RegisterBank(20), input_registers=RegisterBank(20))
+    unit.input_registers.set_u16(4, 7)
+    stats = Stats()
+    assert handle_with(unit, ModbusFrame.write_single_coil(1, 3, 0xFF00), stats)[1:6] == b'\x05\x00\x03\xff\x00'
+    assert handle_with(unit, ModbusFrame.write_multiple_coils(1, 8, 3, b'\x05'), stats)[1:6] == b'\x0f\x00\x08\x00\x03'
+    assert handle_with(unit, ModbusFrame.read_coils(1, 3, 8), stats)[1:4] == b'\x01\x01\xa1'
+    assert handle_with(unit, ModbusFrame.read_discrete_inputs(1, 0, 1), stats)[1:4] == b'\x02\x01\x00'
+    assert handle_with(unit, ModbusFrame.write_single_register(1, 2, 0x0102), stats)[1:6] == b'\x06\x00\x02\x01\x02'
+    assert (handle_with(unit, ModbusFrame.write_multiple_registers(1, 3, b'\x00\x05\x00\x06'), stats)[1:6]
+            == b'\x10\x00\x03\x00\x02')
+    assert handle_with(unit, ModbusFrame.read_input_registers(1, 4, 1), stats)[1:5] == b'\x04\x02\x00\x07'
+    # FC23 writes before it reads
+    response = handle_with(unit, ModbusFrame.read_write_multiple_registers(1, 2, 3, 4, b'\x00\x09'), stats)
+    assert response[1:9] == b'\x17\x06\x01\x02\x00\x05\x00\x09'
+    assert stats.bus_exceptions == 0
+
+
+@pytest.mark.parametrize('request_frame, code', (
+    (ModbusFrame.read_holding_registers(1, 0, 126), 3),  # Too many registers
+    (ModbusFrame.read_holding_registers(1, 19, 2), 2),  # Past the end of the bank
+    (ModbusFrame(1, 5, (0, 0x1234)), 3),  # Neither ON nor OFF
+    (ModbusFrame.write_multiple_registers(1, 30, b'\x00\x01'), 2),
+))
+def test_exception_responses(request_frame, code):
+    unit, stats = ModbusUnit(1, holding_registers=RegisterBank(20)), Stats()
+    response = handle_with(unit, request_frame, stats)
+    assert response[1:3] == bytes((request_frame.function | 0x80, code))
+    assert stats.bus_exceptions == 1
+
+
+def test_broadcasts_are_executed_but_not_answered():
+    unit, stats = ModbusUnit(1, holding_registers=RegisterBank(20)), Stats()
+    assert unit.handle(ModbusFrame.parse_frame(ModbusFrame.write_single_register(0, 5, 9).to_bytes()), stats) is None
+    assert unit.holding_registers.get_u16(5) == 9
+    assert stats.server_no_responses == 1
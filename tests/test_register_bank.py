@@ -0,0 +1,53 @@
+import pytest
+
+from register_bank import RegisterBank, CoilBank
+
+
+def test_registers_are_big_endian_words():
+    bank = RegisterBank(10)
+    bank.set_u16(1, 0x1234)
+    bank.set_i16(2, -2)
+    assert bytes(bank.buffer[2:6]) == b'\x12\x34\xff\xfe'
+    assert bank.get_i16(2) == -2
+    buf = bytearray(5)
+    assert bank.read_into(buf, 1, 2, 1) == 4
+    assert bytes(buf) == b'\x00\x12\x34\xff\xfe'
+
+
+@pytest.mark.parametrize('word_order, image', (('big', b'\x12\x34\x56\x78'), ('little', b'\x56\x78\x12\x34')))
+def test_32_bit_word_order(word_order, image):
+    bank = RegisterBank(4, word_order)
+    bank.set_u32(1, 0x12345678)
+    assert bytes(bank.buffer[2:6]) == image
+    assert bank.get_u32(1) == 0x12345678
+    assert bank.get_u32(1) == 0x12345678  # Reading leaves the bank as it was
+    assert bytes(bank.buffer[2:6]) == image
+    bank.set_float32(2, 1.5)
+    assert bank.get_float32(2) == 1.5
+    other = 'big' if word_order == 'little' else 'little'
+    bank.set_i32(0, -2, other)
+    assert bank.get_i32(0, other) == -2
+
+
+def test_writes_are_tracked_per_block():
+    bank = RegisterBank(200)
+    version = bank.version
+    bank.write_from(130, b'\x00\x01\x00\x02')
+    assert bank.changed_since(version, 128, 10)
+    assert not bank.changed_since(version, 0, 64)
+    with pytest.raises(ValueError):
+        bank.set_u32(199, 1)
+
+
+def test_coils_are_packed_lsb_first():
+    coils = CoilBank(20)
+    for index in (0, 3, 8, 19):
+        coils[index] = True
+    assert bytes(coils.buffer) == b'\x09\x01\x08'
+    buf = bytearray(2)
+    assert coils.read_into(buf, 3, 9) == 2
+    assert bytes(buf) == b'\x21\x00'  # Coils 3 and 8, unused bits of the last byte cleared
+    coils.write_from(10, 4, b'\x05')
+    assert [coils[i] for i in range(10, 14)] == [True, False, True, False]
+    coils[0] = False
+    assert not coils[0]
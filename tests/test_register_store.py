@@ -0,0 +1,57 @@
+from uasyncio import run
+
+from register_bank import RegisterBank
+from register_store import RegisterStore
+from sim.flash import FlashFS
+
+
+def saved(fs, bank, values):
+    """ Boots a store on an empty flash and saves values into it """
+    store = RegisterStore(bank, 'bank', fs=fs)
+    store.restore()
+    for i, value in enumerate(values):
+        bank[i] = value
+    run(store.save())
+    return store
+
+
+def test_saves_alternate_and_the_newest_is_restored(tmp_path):
+    fs = FlashFS(str(tmp_path))
+    bank = RegisterBank(100)
+    store = saved(fs, bank, (1, 2))
+    bank[0] = 3
+    run(store.save())
+    assert (store.sequence, store.slot_path(1), store.slot_path(2)) == (2, 'bank.b', 'bank.a')
+
+    restored = RegisterBank(100)
+    assert RegisterStore(restored, 'bank', fs=fs).restore() == 2
+    assert (restored[0], restored[1]) == (3, 2)
+
+
+def test_a_save_cut_short_restores_the_older_slot(tmp_path):
+    fs = FlashFS(str(tmp_path))
+    bank = RegisterBank(100)
+    store = saved(fs, bank, (1, 2))
+    bank[0] = 3
+    fs.power_loss_after = fs.bytes_written + 40  # Partway through the image of the second snapshot
+    try:
+        run(store.save())
+    except OSError:
+        pass
+    fs.power_cycle()
+
+    restored = RegisterBank(100)
+    assert RegisterStore(restored, 'bank', fs=fs).restore() == 1
+    assert (restored[0], restored[1]) == (1, 2)
+
+
+def test_damaged_slots_leave_the_bank_zeroed(tmp_path):
+    fs = FlashFS(str(tmp_path))
+    saved(fs, RegisterBank(100), (1, 2))
+    with fs.open('bank.b', 'r+b') as f:
+        f.seek(20)
+        f.write(b'\xff\xff')
+    restored = RegisterBank(100)
+    restored[1] = 9
+    assert RegisterStore(restored, 'bank', fs=fs).restore() is None
+    assert not any(restored.buffer)
@@ -0,0 +1,51 @@
+from modbus_frame import ModbusFrame
+from modbus_unit import ModbusUnit
+from register_bank import RegisterBank
+from response_cache import ResponseCache
+
+
+def cached_unit(alias_4xxxx=False):
+    unit = ModbusUnit(1, holding_registers=RegisterBank(200), alias_4xxxx=alias_4xxxx)
+    return unit, ResponseCache({1: unit})
+
+
+def poll(unit, cache, request):
+    """ Serves a request from the cache, or handles and caches it """
+    frame = request.to_bytes()
+    if (response := cache.lookup(frame)) is not None:
+        return response
+    response = unit.handle(ModbusFrame.parse_frame(frame)).to_bytes()
+    cache.store(frame, response)
+    return response
+
+
+def test_writes_invalidate_only_the_ranges_they_touch():
+    unit, cache = cached_unit()
+    low, high = ModbusFrame.read_holding_registers(1, 0, 10), ModbusFrame.read_holding_registers(1, 150, 10)
+    poll(unit, cache, low)
+    poll(unit, cache, high)
+    poll(unit, cache, low)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    unit.handle(ModbusFrame.parse_frame(ModbusFrame.write_single_register(1, 5, 42).to_bytes()))
+    assert poll(unit, cache, low)[13:15] == b'\x00\x2a'  # Register 5, rebuilt with the write
+    poll(unit, cache, high)
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_4xxxx_reads_are_invalidated_by_writes_to_their_registers():
+    unit, cache = cached_unit(alias_4xxxx=True)
+    read = ModbusFrame.read_holding_registers(1, 40101, 2)
+    poll(unit, cache, read)
+    unit.holding_registers[101] = 7
+    assert poll(unit, cache, read)[3:7] == b'\x00\x00\x00\x07'
+
+
+def test_exceptions_are_not_cached_and_a_full_cache_is_cleared():
+    unit, cache = cached_unit()
+    poll(unit, cache, ModbusFrame.read_holding_registers(1, 199, 2))
+    assert not len(cache)
+    cache.size = 2
+    for start in range(3):
+        poll(unit, cache, ModbusFrame.read_holding_registers(1, start, 1))
+    assert len(cache) == 1
@@ -0,0 +1,35 @@
+import pytest
+
+from ring_queue import RingQueue
+
+
+def test_fifo_order_and_slot_reuse():
+    queue = RingQueue(capacity=2, slot_size=4)
+    for n in range(5):
+        queue.put(bytes((n,)) * 6)  # Truncated to the slot size
+        assert bytes(queue.pop()) == bytes((n,)) * 4
+    assert queue.pop() is None and queue.pop_index() == -1
+    assert queue.enqueued == 5 and not queue.dropped
+
+
+@pytest.mark.parametrize('overflow, kept', (('oldest', [b'\x02', b'\x03']), ('newest', [b'\x00', b'\x01'])))
+def test_overflow_policies(overflow, kept):
+    queue = RingQueue(capacity=2, slot_size=4, overflow=overflow)
+    assert [queue.put(bytes((n,))) for n in range(4)] == [False, False, True, True]
+    assert queue.dropped == 2 and queue.high_water == 2
+    popped = []
+    while (index := queue.pop_index()) >= 0:
+        popped.append(bytes(queue.slots[index][:queue.lengths[index]]))
+    assert popped == kept
+
+
+def test_reserve_and_commit_without_copying():
+    queue = RingQueue(capacity=2, slot_size=4)
+    buf = queue.reserve()
+    buf[:3] = b'abc'
+    queue.commit(0)  # Nothing read, nothing queued
+    assert not len(queue)
+    queue.commit(3)
+    assert bytes(queue.pop()) == b'abc'
+    with pytest.raises(ValueError):
+        RingQueue(overflow='middle')
@@ -0,0 +1,50 @@
+from rs485 import RS485
+from rs485_calibration import calibration_key, save_calibration
+
+
+class ChattyUART:
+    """ Always holds one more chunk """
+    def any(self):
+        return 8
+
+    def readinto(self, buf, n=None):
+        buf[:8] = bytes(range(8))
+        return 8
+
+
+class Pin:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+def make_link(overflow):
+    serial = RS485(None, None, Pin(), uart=ChattyUART(), queue_size=2, overflow=overflow, calibration=None)
+    serial.task.cancel()
+    return serial
+
+
+def test_overruns_count_from_the_last_clear():
+    for overflow in ('oldest', 'newest'):
+        serial = make_link(overflow)
+        for _ in range(6):
+            serial._recv()
+        assert serial.stats.character_overruns == 4
+        serial.stats.clear()  # FC8 clear counters
+        serial._recv()
+        assert serial.stats.character_overruns == 1
+        assert serial.messages.dropped == 5
+
+
+def test_calibration_is_kept_per_line_settings(tmp_path):
+    path = str(tmp_path / 'calibration.json')
+    save_calibration(calibration_key(19200, 8, None, 1), 600, 1400, path)
+    assert calibration_key(19200, 8, 0, 1) == '19200 8E1'
+    even = RS485(None, None, Pin(), uart=ChattyUART(), baudrate=19200, parity=0, calibration=path)
+    none = RS485(None, None, Pin(), uart=ChattyUART(), baudrate=19200, parity=None, calibration=path)
+    for serial in (even, none):
+        serial.task.cancel()
+    assert (none.driver_delay, none.tx_delay) == (600, 1400)
+    assert even.driver_delay == int(1.5 * even.char_time)
@@ -0,0 +1,55 @@
+from crc16_modbus import calculate_crc16
+from modbus_frame import ModbusFrame
+from rtu_decoder import RTUDecoder
+
+READ = bytes(ModbusFrame.read_holding_registers(1, 0, 10).to_bytes())
+WRITE = bytes(ModbusFrame.write_multiple_registers(2, 4, b'\x00\x01\x00\x02').to_bytes())
+
+
+def frames(decoder, *chunks):
+    found = []
+    for chunk in chunks:
+        found += [bytes(frame) for frame in decoder.feed(chunk)]
+    return found
+
+
+def test_frames_split_across_chunks():
+    stream = READ + WRITE + READ
+    for size in (1, 3, 7, len(stream)):
+        decoder = RTUDecoder()
+        assert frames(decoder, *(stream[i:i + size] for i in range(0, len(stream), size))) == [READ, WRITE, READ]
+        assert decoder.stats.bus_messages == 3 and not decoder.stats.resyncs
+
+
+def test_resync_past_a_damaged_frame_and_garbage():
+    damaged = READ[:-1] + bytes((READ[-1] ^ 0xFF,))
+    decoder = RTUDecoder()
+    assert frames(decoder, damaged + b'\xff\x00' + WRITE) == [WRITE]
+    assert decoder.stats.bus_messages == 1
+    assert decoder.stats.bus_comm_errors == 1  # Once per lost frame, not per resync
+    assert decoder.stats.resyncs == len(damaged) + 2
+
+
+def test_gap_ends_a_truncated_frame():
+    decoder = RTUDecoder()
+    assert frames(decoder, READ[:5]) == []
+    assert [bytes(frame) for frame in decoder.gap()] == []
+    assert not decoder.pending
+    assert frames(decoder, READ) == [READ]
+
+
+def test_unknown_function_is_delimited_by_the_gap():
+    unknown = bytes((1, 0x41, 0, 0)) + calculate_crc16(bytes((1, 0x41, 0, 0)))
+    decoder = RTUDecoder()
+    assert frames(decoder, unknown) == []
+    assert [bytes(frame) for frame in decoder.gap()] == [unknown]
+
+
+def test_next_frame_matches_feed():
+    stream = b'\x00' + READ + WRITE
+    decoder = RTUDecoder()
+    decoder.push(stream)
+    found = []
+    while end := decoder.next_frame():
+        found.append(bytes(decoder.buffer[decoder.frame_start:end]))
+    assert found == frames(RTUDecoder(), stream) == [READ, WRITE]
@@ -1,69 +1,147 @@
+from array import array
+
+
 class TextBuffer:
+    """
+    Circular byte buffer of text lines, with an incremental index of line starts.
+
+    Lines are wrapped at line_length and each is stored contiguously,
+    a line which would cross the end of the buffer starts at the beginning instead,
+    so every line is a single memoryview slice. Appending only indexes the new bytes,
+    and the oldest lines are dropped as their space is reused.
+
+    Consecutive identical lines are collapsed when a line ends,
+    they are shown as a "repeat<N>" line followed by the line.
+    """
     def __init__(self, line_length, display_lines, max_length=2048):
         self.line_length = line_length
         self.display_lines = display_lines
         self.max_length = max_length
+        self.buffer = bytearray(max_length)
+        self.view = memoryview(self.buffer)
+        # Line index ring, empty lines take no space so there can be more lines than max_length / line_length
+        self.index_size = max_length // 2
+        self.starts = array('H', (0 for _ in range(self.index_size)))
+        self.lengths = array('B', (0 for _ in range(self.index_size)))
+        self.repeats = array('H', (0 for _ in range(self.index_size)))
         self.clear()  # reset/initialize buffer
 
+    def clear(self):
+        self.first = 0  # Index of the oldest line, free running
+        self.count = 0  # Number of indexed lines, including the open line
+        self.open = False  # The newest line is still being written
+        self.write_pos = 0  # Buffer offset after the newest line
+        self.rows = 0  # Display rows, repeated lines take two
+        self.updated = True
+
     def __add__(self, data):
-        self.buffer.extend(data)
-        if len(self.buffer) > self.max_length:
-            self.buffer = self.buffer[-self.max_length:]
+        if isinstance(data, str):
+            data = data.encode()
+        for char in data:
+            if char == 10 or char == 13:  # '\n' or '\r'
+                self._end_line()
+            elif char:
+                if not self.open:
+                    self._start_line()
+                elif self.lengths[(self.first + self.count - 1) % self.index_size] >= self.line_length:
+                    self._end_line()
+                    self._start_line()
+                i = (self.first + self.count - 1) % self.index_size
+                self.buffer[self.write_pos] = char
+                self.write_pos += 1
+                self.lengths[i] += 1
         self.updated = True
         return self
 
-    @property
-    def lines(self):
-        if not self.updated:
-            return self._lines
+    def _drop_oldest(self):
+        i = self.first % self.index_size
+        self.rows -= 2 if self.repeats[i] > 1 else 1
+        self.first += 1
+        self.count -= 1
 
-        lines = [[]]
-        for char in self.buffer:
-            # Create a new line if the current line is too long
-            if len(lines[-1]) >= self.line_length:
-                lines.append([])
-            # Create a new line if the current character is a newline
-            if char in [ord('\n'), ord('\r')]:
-                lines.append([])
-            elif char == 0:
-                pass
-            # Otherwise, add the character to the current line
+    def _start_line(self):
+        """ Indexes a new line, making room for a full line at the write position """
+        if self.write_pos + self.line_length > self.max_length:
+            self.write_pos = 0
+        start, end = self.write_pos, self.write_pos + self.line_length
+        while self.count:
+            oldest = self.first % self.index_size
+            old_start = self.starts[oldest]
+            if old_start < end and old_start + max(self.lengths[oldest], 1) > start:
+                self._drop_oldest()
             else:
-                lines[-1].append(char)
+                break
+        if self.count == self.index_size:
+            self._drop_oldest()
+        i = (self.first + self.count) % self.index_size
+        self.starts[i] = start
+        self.lengths[i] = 0
+        self.repeats[i] = 1
+        self.count += 1
+        self.rows += 1
+        self.open = True
 
-            if len(lines) > 1 and lines[-2] == lines[-1]:
-                from re import search
-                if len(lines) > 2 and isinstance(lines[-3], str):
-                    if match := search(r"^repeat<(\d+)>$", lines[-3]):
-                        if match.group(1):
-                            lines[-3] = f"repeat<{int(match.group(1)) + 1}>"
-                            lines.pop()
-                else:
-                    lines[-2] = "repeat<2>"
-        if lines[-1] == []:
-            lines.pop()
-        self._lines = lines
+    def _end_line(self):
+        """ Closes the open line, or adds an empty line, then collapses it into an identical previous line """
+        if not self.open:
+            self._start_line()
+        self.open = False
+        if self.count < 2:
+            return
+        i = (self.first + self.count - 1) % self.index_size
+        prev = (self.first + self.count - 2) % self.index_size
+        length = self.lengths[i]
+        if length != self.lengths[prev]:
+            return
+        buf, start, prev_start = self.buffer, self.starts[i], self.starts[prev]
+        for offset in range(length):
+            if buf[start + offset] != buf[prev_start + offset]:
+                return
+        # Drop the new line and count it on the previous one
+        self.count -= 1
+        self.rows -= 1
+        self.write_pos = start
+        self.repeats[prev] += 1
+        if self.repeats[prev] == 2:
+            self.rows += 1
+
+    def iter_rows(self, start=0):
+        """ Yields display rows from row start, as memoryviews or repeat strings """
+        row = 0
+        for n in range(self.first, self.first + self.count):
+            i = n % self.index_size
+            repeat = self.repeats[i]
+            if repeat > 1:
+                if row >= start:
+                    yield "repeat<%d>" % repeat
+                row += 1
+            if row >= start:
+                yield self.view[self.starts[i]:self.starts[i] + self.lengths[i]]
+            row += 1
+
+    @property
+    def lines(self):
         self.updated = False
-        return self._lines
+        return list(self.iter_rows())
 
     @property
     def pages(self):
         from math import ceil
-        return ceil(len(self.lines) / self.display_lines)
+        return ceil(self.rows / self.display_lines)
 
     def get_page(self, page=0):
-        start = page * self.display_lines
-        end = start + self.display_lines
-        return self.lines[start:end]
+        page_lines = []
+        for row in self.iter_rows(page * self.display_lines):
+            page_lines.append(row)
+            if len(page_lines) == self.display_lines:
+                break
+        self.updated = False
+        return page_lines
 
     @property
     def used(self):
-        return int(sum(1 for char in self.buffer if char != 0) * 100 / len(self.buffer))
-
-    def clear(self):
-        self.buffer = bytearray(self.max_length)
-        self._lines = [[]]
-        self.updated = False
+        used = sum(self.lengths[n % self.index_size] for n in range(self.first, self.first + self.count))
+        return int(used * 100 / self.max_length)
 
     def __str__(self):
-        return self.buffer.decode('ascii')
+        return "\n".join(row if isinstance(row, str) else bytes(row).decode('ascii') for row in self.iter_rows())
@@ -0,0 +1,342 @@
+"""
+Replays a BusCapture log on the host, through the RTU decoder, ModbusFrame.parse_frame
+and the dispatch of a ModbusRTUClient, to benchmark decoder and handler changes against real traffic.
+
+    python tools/bus_replay.py capture.bin [--speed max|recorded] [--registers PREFIX] [--in-place]
+
+Reports:
+    decode: the received chunks delimited and parsed, in frames and bytes per second,
+            over the best of --rounds passes
+    errors: CRC errors and resyncs counted by the decoder, the class of every decoded request,
+            and the exception responses the device sent
+    replay: each request dispatched to a client answering as the units which responded in the capture,
+            the transactions per second, and the replayed responses which differ from the recorded ones
+
+A log appended to over several boots is replayed as one, with a second of silence between sessions,
+a record torn by a reset is dropped and the next session is found by its session record.
+Registers start at zero, unless --registers gives the RegisterStore prefix of a snapshot taken
+with the capture, so reads before the first write of a register are expected to differ otherwise.
+Run from the repository root.
+"""
+from argparse import ArgumentParser
+from os import path as ospath
+from struct import unpack_from
+from sys import path
+from time import perf_counter
+
+path.insert(0, ospath.dirname(ospath.dirname(ospath.abspath(__file__))))
+
+import sim  # noqa: E402
+sim.install()
+
+from bus_capture import (CAPTURE_MAGIC, CAPTURE_HEADER, CAPTURE_HEADER_LENGTH, RECORD_HEADER,  # noqa: E402
+                         RECORD_HEADER_LENGTH, CAP_TX, CAP_SESSION, SESSION_MAGIC, SESSION_LENGTH, NO_PARITY)
+from modbus_frame import ModbusFrame, ModbusException, FrameTooShortError  # noqa: E402
+from rs485 import RS485, get_serial_chartime, get_frame_gap  # noqa: E402
+from rtu_decoder import RTUDecoder  # noqa: E402
+from stats import Stats  # noqa: E402
+from sim.utime import TICKS_PERIOD, TICKS_HALFPERIOD  # noqa: E402
+
+SESSION_GAP_US = 1000000  # Silence put between sessions, the ticks of each start afresh
+EXCEPTION_NAMES = {1: "illegal function", 2: "illegal data address", 3: "illegal data value",
+                   4: "server device failure", 6: "server device busy"}
+
+
+class Capture:
+    """ A loaded capture log, records are (us since the first record, port, direction, data) """
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        if len(raw) < CAPTURE_HEADER_LENGTH:
+            raise ValueError("Capture too short: %d" % len(raw))
+        magic, version, self.baudrate, self.data_bits, parity, self.stop_bits = unpack_from(CAPTURE_HEADER, raw)
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("Not a bus capture: %s" % magic)
+        self.version = version
+        self.parity = None if parity == NO_PARITY else parity
+        self.char_time = get_serial_chartime(self.baudrate, self.data_bits, self.parity, self.stop_bits) * 1000
+        self.frame_gap = get_frame_gap(self.baudrate, self.data_bits, self.parity, self.stop_bits)
+        self.records = []
+        self.truncated = 0  # Sessions whose last record was cut short, by a reset during a write
+        starts = self.sessions(raw)
+        self.session_count = len(starts)
+        if not starts or starts[0] != CAPTURE_HEADER_LENGTH:
+            starts.insert(0, CAPTURE_HEADER_LENGTH)  # Records before the first session record
+        elapsed = -SESSION_GAP_US
+        for start, end in zip(starts, starts[1:] + [len(raw)]):
+            elapsed = self._parse(raw, start, end, elapsed + SESSION_GAP_US)
+
+    @staticmethod
+    def sessions(raw):
+        """ Returns the offsets of the session records, those holding their own offset """
+        starts, offset = [], raw.find(SESSION_MAGIC, CAPTURE_HEADER_LENGTH)
+        while offset >= 0:
+            start = offset - RECORD_HEADER_LENGTH
+            if start >= CAPTURE_HEADER_LENGTH and start + RECORD_HEADER_LENGTH + SESSION_LENGTH <= len(raw):
+                _, kind, length, _, own = unpack_from(RECORD_HEADER + '4sI', raw, start)
+                if kind == CAP_SESSION and length == SESSION_LENGTH and own == start:
+                    starts.append(start)
+            offset = raw.find(SESSION_MAGIC, offset + 1)
+        return starts
+
+    def _parse(self, raw, offset, end, elapsed):
+        """ Appends the records in raw[offset:end], timed from elapsed, returns the time of the last """
+        last = None
+        while offset < end:
+            if offset + RECORD_HEADER_LENGTH > end:
+                self.truncated += 1
+                break
+            ticks, kind, length = unpack_from(RECORD_HEADER, raw, offset)
+            offset += RECORD_HEADER_LENGTH
+            if offset + length > end:
+                self.truncated += 1
+                break
+            if last is not None:  # Unwrap the ticks, records are assumed less than half a period apart
+                elapsed += ((ticks - last + TICKS_HALFPERIOD) % TICKS_PERIOD) - TICKS_HALFPERIOD
+            last = ticks
+            if kind != CAP_SESSION:
+                self.records.append((elapsed, kind >> 1, kind & 1, raw[offset:offset + length]))
+            offset += length
+        return elapsed
+
+    @property
+    def ports(self):
+        return sorted(set(record[1] for record in self.records))
+
+    @property
+    def duration_us(self):
+        return self.records[-1][0] if self.records else 0
+
+
+def delimit(capture, stats=None):
+    """
+    Returns the transactions of the capture, as [time, port, request, recorded response or None],
+    and the responses sent without a request.
+    Each port has its own decoder, a t3.5 silence between chunks, or a transmission, ends pending frames.
+    """
+    stats = stats if stats is not None else Stats()
+    decoders, last_rx, pending = {}, {}, {}
+    transactions, unsolicited = [], []
+    for time, port, direction, data in capture.records:
+        decoder = decoders.get(port)
+        if decoder is None:
+            decoder = decoders[port] = RTUDecoder(stats=stats)
+        if direction == CAP_TX or (port in last_rx and
+                                   time - last_rx[port] > capture.frame_gap + len(data) * capture.char_time):
+            for frame in decoder.gap():
+                pending[port] = [time, port, bytes(frame), None]
+                transactions.append(pending[port])
+        if direction == CAP_TX:
+            if (transaction := pending.pop(port, None)) is not None:
+                transaction[3] = data
+            else:
+                unsolicited.append((time, port, data))
+            last_rx.pop(port, None)
+            continue
+        last_rx[port] = time
+        for frame in decoder.feed(data):
+            pending[port] = [time, port, bytes(frame), None]
+            transactions.append(pending[port])
+    for port, decoder in decoders.items():
+        for frame in decoder.gap():
+            transactions.append([capture.duration_us, port, bytes(frame), None])
+    return transactions, unsolicited
+
+
+def classify(request):
+    try:
+        frame = ModbusFrame.parse_frame(request, check_crc=False)
+    except FrameTooShortError:
+        return "too short"
+    except ModbusException as e:
+        return "exception %d, %s" % (e.code, EXCEPTION_NAMES.get(e.code, "unknown"))
+    except ValueError:
+        return "invalid address"
+    return "broadcast" if frame.address == 0 else "ok"
+
+
+def parse(frame):
+    try:
+        ModbusFrame.parse_frame(frame, check_crc=False)
+    except (ValueError, FrameTooShortError, ModbusException):
+        pass
+
+
+def decode(capture, rounds=5):
+    """ Delimits and parses the received chunks, returns the frames, bytes and the best time in seconds """
+    best, frames, received = None, 0, 0
+    for _ in range(rounds):
+        decoders = {port: RTUDecoder() for port in capture.ports}
+        frames = received = 0
+        start = perf_counter()
+        for time, port, direction, data in capture.records:
+            decoder = decoders[port]
+            if direction == CAP_TX:
+                for frame in decoder.gap():
+                    frames += 1
+                    parse(frame)
+                continue
+            received += len(data)
+            for frame in decoder.feed(data):
+                frames += 1
+                parse(frame)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return frames, received, best
+
+
+class ReplayUART:
+    """ Collects what the client transmits, nothing is ever received """
+    def __init__(self):
+        self.sent = []
+
+    def write(self, data):
+        self.sent.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        return 0
+
+    def readinto(self, buf, n=None):
+        return 0
+
+    def take(self):
+        data = b''.join(self.sent) if self.sent else None
+        self.sent.clear()
+        return data
+
+
+class ReplayPin:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+def replay_serial(capture, uart):
+    serial = RS485(None, None, ReplayPin(), uart, capture.baudrate, capture.data_bits, capture.parity,
+                   capture.stop_bits, rx_mode='poll', calibration=None)
+    serial.task.cancel()
+    serial.driver_delay = serial.tx_delay = 0  # Nothing to wait for, they would only slow the replay
+    return serial
+
+
+async def dispatch(capture, transactions, addresses, speed='max', registers=None, in_place=False):
+    """
+    Hands every request to a client, returns the replayed responses, in the order of transactions,
+    and the time taken in seconds.
+    """
+    from uasyncio import sleep_ms
+    from modbus_rtu import ModbusRTUClient
+
+    uarts = {port: ReplayUART() for port in capture.ports}
+    first = min(uarts) if uarts else 0
+    uarts.setdefault(first, ReplayUART())
+    client = ModbusRTUClient(addresses, None, None, ReplayPin(), uart=uarts[first],
+                             baudrate=capture.baudrate, data_bits=capture.data_bits, parity=capture.parity,
+                             stop_bits=capture.stop_bits, rx_mode='poll', in_place=in_place, persist=registers)
+    client.serial.task.cancel()
+    client.serial.driver_delay = client.serial.tx_delay = 0
+    ports = {first: client.ports[0]}
+    for port in sorted(uarts):
+        if port != first:
+            ports[port] = client.add_port(None, None, None, serial=replay_serial(capture, uarts[port]))
+    responses = []
+    start = perf_counter()
+    for time, port_id, request, recorded in transactions:
+        if speed == 'recorded':
+            wait_ms = int(time / 1000 - (perf_counter() - start) * 1000)
+            if wait_ms > 0:
+                await sleep_ms(wait_ms)
+        port = ports[port_id]
+        if in_place:
+            length = client.serve_in_place(port, request, 0, len(request))
+            if length:
+                await port.serial.send(port.response_view(length))
+        elif client.accept[request[0]]:
+            await client.parse_recv(request, port)
+        else:
+            client.foreign_frame(request, port)
+        responses.append(uarts[port_id].take())
+    return responses, perf_counter() - start
+
+
+def report(capture, args):
+    print("capture: %d records, %d ports, %d session(s), %.3f s at %d baud%s"
+          % (len(capture.records), len(capture.ports), capture.session_count, capture.duration_us / 1000000,
+             capture.baudrate, ", %d session(s) cut short" % capture.truncated if capture.truncated else ""))
+
+    frames, received, elapsed = decode(capture, args.rounds)
+    print("decode: %d frames, %d bytes in %.1f ms, %.0f frames/s, %.0f bytes/s"
+          % (frames, received, elapsed * 1000, frames / elapsed if elapsed else 0,
+             received / elapsed if elapsed else 0))
+
+    stats = Stats()
+    transactions, unsolicited = delimit(capture, stats)
+    classes = {}
+    for transaction in transactions:
+        name = classify(transaction[2])
+        classes[name] = classes.get(name, 0) + 1
+    exceptions = {}
+    for _, _, _, response in transactions:
+        if response and len(response) > 2 and response[1] & 0x80:
+            name = EXCEPTION_NAMES.get(response[2], "code %d" % response[2])
+            exceptions[name] = exceptions.get(name, 0) + 1
+    print("errors: %d CRC errors, %d resyncs, %d responses without a request"
+          % (stats.bus_comm_errors, stats.resyncs, len(unsolicited)))
+    for name in sorted(classes):
+        print("    request %-40s %d" % (name, classes[name]))
+    for name in sorted(exceptions):
+        print("    response exception %-30s %d" % (name, exceptions[name]))
+
+    addresses = set(args.address) if args.address else set(
+        request[0] for _, _, request, response in transactions if response and request[0])
+    if not addresses:
+        print("replay: no unit answered in the capture, give the addresses with --address")
+        return
+    from uasyncio import run
+    responses, elapsed = run(dispatch(capture, transactions, addresses, args.speed, args.registers, args.in_place))
+    same = differ = missing = extra = 0
+    shown = 0
+    for (time, port, request, recorded), replayed in zip(transactions, responses):
+        if recorded == replayed:
+            same += 1
+            continue
+        if replayed is None:
+            missing += 1
+        elif recorded is None:
+            extra += 1
+        else:
+            differ += 1
+        if shown < args.diffs:
+            shown += 1
+            print("    diff at %.6f s, port %d: request %s\n        recorded %s\n        replayed %s"
+                  % (time / 1000000, port, request.hex(), recorded.hex() if recorded else None,
+                     replayed.hex() if replayed else None))
+    print("replay: units %s, %d transactions in %.1f ms, %.0f transactions/s (%s speed, %s path)"
+          % (sorted(addresses), len(transactions), elapsed * 1000,
+             len(transactions) / elapsed if elapsed else 0, args.speed, "in place" if args.in_place else "frame"))
+    print("responses: %d identical, %d differ, %d not replayed, %d not recorded" % (same, differ, missing, extra))
+
+
+def main():
+    parser = ArgumentParser(description="Replay a Modbus RTU bus capture through the decoder and client")
+    parser.add_argument('capture', help="BusCapture log")
+    parser.add_argument('--speed', choices=('max', 'recorded'), default='max',
+                        help="dispatch requests as fast as possible, or at their recorded times")
+    parser.add_argument('--address', type=int, action='append',
+                        help="unit address to answer as, repeatable, by default the units which answered")
+    parser.add_argument('--registers', help="RegisterStore path prefix of the holding registers to start from")
+    parser.add_argument('--in-place', action='store_true', help="dispatch through the in-place request path")
+    parser.add_argument('--rounds', type=int, default=5, help="decode passes, the fastest is reported")
+    parser.add_argument('--diffs', type=int, default=10, help="response differences to show")
+    args = parser.parse_args()
+    report(Capture(args.capture), args)
+
+
+if __name__ == '__main__':
+    main()
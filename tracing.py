@@ -0,0 +1,128 @@
+"""
+Binary trace ring buffer for the hot path.
+
+Events are fixed size records of unsigned ints: timestamp in us, event id, two arguments,
+and the offset and length of an optional copy of the data in a separate byte ring.
+Nothing is formatted while recording, and call sites check TRACE.enabled first,
+so a disabled trace costs a single attribute lookup.
+
+Events are decoded to text on demand with format(), or saved with dump()
+and decoded on the host with:
+    python tracing.py trace.bin
+"""
+from array import array
+from struct import pack, unpack_from, calcsize
+
+try:
+    from utime import ticks_us
+except ImportError:  # Decoding a dump on the host
+    ticks_us = None
+
+
+EV_RX = 1  # a: length
+EV_TX = 2  # a: length
+EV_FRAME = 3  # a: address, b: function
+EV_FOREIGN = 4  # a: address, b: function
+EV_EXCEPTION = 5  # a: function, b: exception code
+EV_PARSE_ERROR = 6  # a: length
+EV_BROADCAST = 7  # a: function
+
+EVENT_NAMES = {EV_RX: 'rx', EV_TX: 'tx', EV_FRAME: 'frame', EV_FOREIGN: 'foreign',
+               EV_EXCEPTION: 'exception', EV_PARSE_ERROR: 'parse_error', EV_BROADCAST: 'broadcast'}
+
+EVENT_WORDS = 6  # timestamp, event, a, b, data offset, data length
+MAX_EVENT_DATA = 64  # bytes of data kept per event
+DUMP_MAGIC = b'MBTR'
+DUMP_HEADER = '<4sIIII'  # magic, capacity, events written, data size, data written
+
+
+class Trace:
+    def __init__(self, capacity=256, data_size=4096, enabled=False):
+        self.capacity = capacity
+        self.events = array('I', (0 for _ in range(capacity * EVENT_WORDS)))
+        self.data_size = data_size
+        self.data = bytearray(data_size)
+        self.index = 0  # Events written, free running
+        self.data_pos = 0  # Data bytes written, free running
+        self.enabled = enabled
+
+    def clear(self):
+        self.index = self.data_pos = 0
+
+    def record(self, event, a=0, b=0, data=None):
+        events = self.events
+        i = (self.index % self.capacity) * EVENT_WORDS
+        events[i] = ticks_us() if ticks_us else 0
+        events[i + 1] = event
+        events[i + 2] = a
+        events[i + 3] = b
+        if data is None:
+            events[i + 4] = events[i + 5] = 0
+        else:
+            length = min(len(data), MAX_EVENT_DATA)
+            offset = self.data_pos % self.data_size
+            first = min(length, self.data_size - offset)
+            self.data[offset:offset + first] = data[:first]
+            if first < length:  # Wrap around
+                self.data[:length - first] = data[first:length]
+            events[i + 4] = self.data_pos
+            events[i + 5] = length
+            self.data_pos += length
+        self.index += 1
+
+    def format(self):
+        return format_events(self.events, self.capacity, self.index, self.data, self.data_pos)
+
+    def dump(self, path):
+        """ Writes the raw trace buffers, for decoding on the host """
+        with open(path, 'wb') as f:
+            f.write(pack(DUMP_HEADER, DUMP_MAGIC, self.capacity, self.index, self.data_size, self.data_pos))
+            f.write(self.events)
+            f.write(self.data)
+
+
+def iter_events(events, capacity, index, data, data_pos):
+    """ Yields (timestamp, event, a, b, data) from oldest to newest, data is None if it was overwritten """
+    data_size = len(data)
+    for n in range(max(0, index - capacity), index):
+        i = (n % capacity) * EVENT_WORDS
+        timestamp, event, a, b, offset, length = events[i:i + EVENT_WORDS]
+        event_data = None
+        if length and data_pos - offset <= data_size:
+            start = offset % data_size
+            event_data = bytes(data[start:start + length])
+            if len(event_data) < length:
+                event_data += bytes(data[:length - len(event_data)])
+        yield timestamp, event, a, b, event_data
+
+
+def format_events(events, capacity, index, data, data_pos):
+    lines = []
+    for timestamp, event, a, b, event_data in iter_events(events, capacity, index, data, data_pos):
+        line = "[%d] %s %d %d" % (timestamp, EVENT_NAMES.get(event, event), a, b)
+        if event_data is not None:
+            line += " " + event_data.hex()
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def load(path):
+    """ Reads a trace dump, returns the arguments of format_events """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    magic, capacity, index, data_size, data_pos = unpack_from(DUMP_HEADER, raw)
+    if magic != DUMP_MAGIC:
+        raise ValueError("Not a trace dump: %s" % magic)
+    offset = calcsize(DUMP_HEADER)
+    events = array('I')
+    events.frombytes(raw[offset:offset + capacity * EVENT_WORDS * 4])
+    offset += capacity * EVENT_WORDS * 4
+    return events, capacity, index, raw[offset:offset + data_size], data_pos
+
+
+TRACE = Trace()
+
+
+if __name__ == '__main__':
+    from sys import argv
+    print(format_events(*load(argv[1])))